@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+import os
+import time
+import shutil
+import argparse
+import tempfile
+from typing import Any, Optional
+import ROOT  # type: ignore
+
+from utils.generic.logger import initialize_colorized_logger
+from utils.workspace.generic import create_output_file, parse_compression
+
+logger = initialize_colorized_logger(log_level="INFO")
+
+# Load the Combine library, needed to read the workspaces
+ROOT.gSystem.Load("libHiggsAnalysisCombinedLimit")
+ROOT.gROOT.SetBatch(True)
+
+DEFAULT_SETTINGS = ["zlib:1", "lz4:4", "zstd:5", "lzma:9"]
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse and validate command-line arguments."""
+    parser = argparse.ArgumentParser(description="Compare the write time, size and read time of ROOT files for several compression settings.")
+    parser.add_argument("--input_filenames", type=str, nargs="+", required=True, help="ROOT files to rewrite, e.g. ws_monojet.root combined_model_monojet.root.")
+    parser.add_argument("--settings", type=str, nargs="+", default=DEFAULT_SETTINGS, help="Compression settings as <algorithm>:<level>.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times each file is written and read, the best time is reported.")
+    parser.add_argument("--output_dir", type=str, default=None, help="Directory for the rewritten files (default: temporary, removed at the end).")
+
+    args = parser.parse_args()
+
+    for filename in args.input_filenames:
+        if not os.path.isfile(filename):
+            logger.critical(f"Input file not found: {filename}", exception_cls=IOError)
+    for setting in args.settings:
+        try:
+            parse_compression(setting)
+        except ValueError as error:
+            logger.critical(str(error), exception_cls=ValueError)
+
+    return args
+
+
+def read_objects(directory: ROOT.TDirectory, path: str = "") -> list[tuple[str, str, Any]]:
+    """Recursively read all objects of a directory, returning (directory path, name, object) tuples.
+
+    Only the latest cycle of each key is read. The objects are kept alive by the returned list.
+    """
+    objects = []
+    seen = set()
+    for key in directory.GetListOfKeys():
+        name = key.GetName()
+        if name in seen:
+            continue
+        seen.add(name)
+        obj = key.ReadObj()
+        if obj.InheritsFrom("TDirectory"):
+            objects.extend(read_objects(directory=obj, path=f"{path}/{name}" if path else name))
+        else:
+            objects.append((path, name, obj))
+    return objects
+
+
+def write_objects(objects: list[tuple[str, str, Any]], filename: str, compression: int) -> float:
+    """Write the objects to a new file with the given compression, and return the elapsed time in seconds."""
+    start_time = time.perf_counter()
+    output_file = create_output_file(filename=filename, compression=compression)
+    for path, name, obj in objects:
+        directory = output_file
+        if path:
+            directory = output_file.GetDirectory(path) or output_file.mkdir(path, "", True)
+        directory.WriteTObject(obj, name)
+    output_file.Close()
+    return time.perf_counter() - start_time
+
+
+def drop_page_cache(filename: str) -> bool:
+    """Ask the kernel to evict a file from the page cache, so that the next read comes from the disk.
+
+    Returns False if the platform does not support `posix_fadvise` (e.g. macOS). The eviction is advisory,
+    and does not apply to network file systems that cache on the client (e.g. EOS or AFS mounts).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return False
+    fd = os.open(filename, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+    return True
+
+
+def read_file(filename: str) -> float:
+    """Open a file and read all its objects, and return the elapsed time in seconds."""
+    start_time = time.perf_counter()
+    input_file = ROOT.TFile.Open(filename, "READ")
+    read_objects(directory=input_file)
+    input_file.Close()
+    return time.perf_counter() - start_time
+
+
+def benchmark_compression(input_filename: str, settings: list[str], output_dir: str, repeat: int = 3) -> list[dict[str, Any]]:
+    """Rewrite a ROOT file with each compression setting, and measure the write time, file size and read time.
+
+    The objects are read from the input file once, so that the write time does not include the reading.
+    The reported times are the best over `repeat` runs, to reduce the effect of other activity on the machine.
+    The cold read time is measured after evicting the file from the page cache (see `drop_page_cache`), and is None
+    if this is not supported. The warm read time is measured with the file in the page cache, and mostly measures
+    the decompression.
+
+    Args:
+        input_filename (str): ROOT file to rewrite.
+        settings (list[str]): Compression settings as <algorithm>:<level>.
+        output_dir (str): Directory for the rewritten files.
+        repeat (int): Number of times each file is written and read.
+
+    Returns:
+        list[dict[str, Any]]: One entry per setting, with the size in MB and the write, cold and warm read times in seconds.
+    """
+    input_file = ROOT.TFile.Open(input_filename, "READ")
+    objects = read_objects(directory=input_file)
+    basename = os.path.splitext(os.path.basename(input_filename))[0]
+
+    results = []
+    for setting in settings:
+        compression = parse_compression(setting)
+        output_filename = os.path.join(output_dir, f"{basename}_{setting.replace(':', '_')}.root")
+        write_time = min(write_objects(objects=objects, filename=output_filename, compression=compression) for _ in range(repeat))
+        cold_read_time: Optional[float] = None
+        if drop_page_cache(filename=output_filename):
+            cold_read_time = read_file(filename=output_filename)
+            for _ in range(repeat - 1):
+                drop_page_cache(filename=output_filename)
+                cold_read_time = min(cold_read_time, read_file(filename=output_filename))
+        # Load the file into the page cache before timing the warm reads
+        read_file(filename=output_filename)
+        warm_read_time = min(read_file(filename=output_filename) for _ in range(repeat))
+        size = os.path.getsize(output_filename) / 1024**2
+        results.append({"setting": setting, "size": size, "write_time": write_time, "cold_read_time": cold_read_time, "warm_read_time": warm_read_time})
+    input_file.Close()
+    return results
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    args = parse_args()
+    output_dir = args.output_dir or tempfile.mkdtemp(prefix="benchmark_compression_")
+    os.makedirs(output_dir, exist_ok=True)
+
+    for input_filename in args.input_filenames:
+        logger.info(f"Benchmarking {input_filename} ({os.path.getsize(input_filename) / 1024**2:.2f} MB)")
+        results = benchmark_compression(input_filename=input_filename, settings=args.settings, output_dir=output_dir, repeat=args.repeat)
+        logger.info(f"{'Setting':<10} {'Size [MB]':>10} {'Write [s]':>10} {'Cold read [s]':>14} {'Warm read [s]':>14}")
+        for result in results:
+            cold_read = "n/a" if result["cold_read_time"] is None else f"{result['cold_read_time']:.3f}"
+            logger.info(f"{result['setting']:<10} {result['size']:>10.2f} {result['write_time']:>10.3f} {cold_read:>14} {result['warm_read_time']:>14.3f}")
+
+    if args.output_dir is None:
+        shutil.rmtree(output_dir)
+
+
+if __name__ == "__main__":
+    main()
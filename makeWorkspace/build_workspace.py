@@ -7,7 +7,10 @@ from typing import Optional
 from datetime import date
 from utils.generic.parallelize import timeit
 from utils.generic.logger import initialize_colorized_logger
+from utils.generic.hist_utils import HISTOGRAM_READERS, clear_array_hists_cache, close_root_files, set_histogram_reader, set_root_file_pool_size
+from utils.workspace.generic import VARIATION_HISTOGRAM_MODES, parse_compression
 from makeWorkspace.make_workspace import create_workspace
+from makeWorkspace.validate_inputs import validate_inputs
 from makeWorkspace.generate_combine_model import generate_combine_model
 
 
@@ -57,7 +60,24 @@ def generate_info_lines(input_dir: str, input_filename: str, output_dir: str) ->
     return lines
 
 
-def build_workspace(input_dir: str, analysis: str, year: str, tag: str, variable: str, root_folder: Optional[str] = None) -> None:
+def build_workspace(
+    input_dir: str,
+    analysis: str,
+    year: str,
+    tag: str,
+    variable: str,
+    root_folder: Optional[str] = None,
+    jobs: int = 1,
+    incremental: bool = False,
+    prune_tolerance: Optional[float] = None,
+    pack_mc_stat: bool = False,
+    pack_tf_stat: bool = False,
+    diagnostic_plots: bool = True,
+    streaming: bool = False,
+    validate: bool = False,
+    compression: Optional[int] = None,
+    variation_histograms: str = "main",
+) -> None:
     """Run the full pipeline for a given category and date tag."""
     input_dir = os.path.realpath(input_dir)
     category = f"{analysis}_{year}"
@@ -69,11 +89,36 @@ def build_workspace(input_dir: str, analysis: str, year: str, tag: str, variable
     combined_model_file = os.path.join(output_dir, f"combined_model_{analysis}.root")
     info_file = os.path.join(output_dir, "INFO.txt")
 
+    if validate:
+        validate_inputs(input_filename=input_filename, category=category, variable=variable, root_folder=root_folder)
+
     logger.info(f"Creating workspace for category '{category}'...")
-    create_workspace(input_filename=input_filename, output_filename=workspace_file, category=category, variable=variable, root_folder=root_folder)
+    create_workspace(
+        input_filename=input_filename,
+        output_filename=workspace_file,
+        category=category,
+        variable=variable,
+        root_folder=root_folder,
+        jobs=jobs,
+        incremental=incremental,
+        prune_tolerance=prune_tolerance,
+        pack_mc_stat=pack_mc_stat,
+        streaming=streaming,
+        compression=compression,
+        variation_histograms=variation_histograms,
+    )
 
     logger.info("Running model generation...")
-    generate_combine_model(input_filename=workspace_file, output_filename=combined_model_file, category=category, variable=variable)
+    generate_combine_model(
+        input_filename=workspace_file,
+        output_filename=combined_model_file,
+        category=category,
+        variable=variable,
+        compression=compression,
+        pack_tf_stat=pack_tf_stat,
+        diagnostic_plots=diagnostic_plots,
+        jobs=jobs,
+    )
 
     logger.info("Finalizing...")
 
@@ -86,6 +131,19 @@ def build_workspace(input_dir: str, analysis: str, year: str, tag: str, variable
     logger.info(f"Done! Output path: {os.path.dirname(output_dir)}")
 
 
+def parse_targets(targets: Optional[list[str]], analysis: str, year: str, variables: list[str]) -> list[tuple[str, str, str]]:
+    """Return the (analysis, year, variable) tuples to build, from `analysis:year:variable` strings or else from each variable."""
+    if not targets:
+        return [(analysis, year, variable) for variable in variables]
+    parsed = []
+    for target in targets:
+        fields = target.split(":")
+        if len(fields) != 3 or not all(fields):
+            logger.critical(f"Invalid target '{target}', expected <analysis>:<year>:<variable>.", exception_cls=ValueError)
+        parsed.append((fields[0], fields[1], fields[2]))
+    return parsed
+
+
 @timeit
 def main() -> None:
     """Main function to generate RooWorkspace and datacards for analysis."""
@@ -93,19 +151,87 @@ def main() -> None:
     # parser.add_argument("-a", "--analysis", type=str, default="vbf", help="Analysis name (e.g., 'vbf', 'monojet', 'monov').")
     parser.add_argument("-a", "--analysis", type=str, default="monojet", help="Analysis name (e.g., 'vbf', 'monojet', 'monov').")
     # parser.add_argument("-v", "--variable", type=str, default="mjj", help="Observable variable name (e.g., 'mjj', 'met').")
-    parser.add_argument("-v", "--variable", type=str, default="recoil", help="Observable variable name (e.g., 'mjj', 'met').")
+    parser.add_argument("-v", "--variable", type=str, nargs="+", default=["recoil"], help="Observable variable names (e.g., 'mjj', 'met').")
     parser.add_argument("-y", "--year", type=str, default="Run3", help="Data-taking year (e.g., '2017', '2018', 'Run3').")
+    parser.add_argument(
+        "--targets",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Build several <analysis>:<year>:<variable> targets in one process (e.g., 'monojet:Run3:recoil vbf:Run3:mjj'). Overrides -a, -y and -v.",
+    )
     parser.add_argument("-d", "--dir", type=str, default=None, help="Path to the directory containing the input ROOT files")
     parser.add_argument("-f", "--folder", type=str, default=None, help="Optional folder name inside the ROOT file to read histograms from.")
     parser.add_argument("-t", "--tag", type=str, default=None, help="Custom tag for the output directory (default: today's date in YYYY_MM_DD format).")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes used to compute the systematic variations and build the models (default: 1).")
+    parser.add_argument("-i", "--incremental", action="store_true", help="Only recompute the workspace histograms whose inputs changed since the previous build.")
+    parser.add_argument(
+        "-p", "--prune-tolerance", type=float, default=None, help="Skip variations identical to the nominal within this relative tolerance (default: keep all)."
+    )
+    parser.add_argument("--pack-mc-stat", action="store_true", help="Store the merged MC statistical variations as packed TH2D histograms in the workspace file.")
+    parser.add_argument(
+        "--pack-tf-stat", action="store_true", help="Store the statistical variations of the transfer factors as packed TH2D histograms in the model file."
+    )
+    parser.add_argument(
+        "--no-diagnostic-plots", action="store_true", help="Only build the workspace used by the fit, without the prefit histograms and canvases of the models."
+    )
+    parser.add_argument(
+        "--validate", action="store_true", help="Check the input and systematic histograms before the build, and stop with a report of all problems."
+    )
+    parser.add_argument(
+        "-r", "--reader", type=str, default="root", choices=HISTOGRAM_READERS, help="Library used to read the input and systematic histograms (default: root)."
+    )
+    parser.add_argument("--max-open-files", type=int, default=32, help="Maximum number of input ROOT files kept open by the histogram reader (default: 32).")
+    parser.add_argument("-s", "--streaming", action="store_true", help="Write each workspace histogram as soon as it is computed, to bound the memory usage.")
+    parser.add_argument(
+        "-c",
+        "--compression",
+        type=parse_compression,
+        default=None,
+        help="Compression of the output ROOT files as <algorithm>:<level>, e.g. lz4:4 for fast reads or lzma:9 for archiving (default: ROOT default).",
+    )
+    parser.add_argument(
+        "--variation-histograms",
+        type=str,
+        default="main",
+        choices=VARIATION_HISTOGRAM_MODES,
+        help="Where to write the TH1 copies of the variations: next to the nominal ones (main), in ws_<analysis>.variations.root (sidecar), or nowhere (skip).",
+    )
 
     args = parser.parse_args()
 
-    input_dir = args.dir or f"inputs/histograms/{args.variable}/{args.analysis}_{args.year}/"
-    root_folder = args.folder or f"category_{args.analysis}_{args.year}"
+    targets = parse_targets(targets=args.targets, analysis=args.analysis, year=args.year, variables=args.variable)
+    if args.dir and len(targets) > 1:
+        logger.critical("The input directory (-d) can only be given for a single target.", exception_cls=ValueError)
+    if args.folder and len(targets) > 1:
+        logger.critical("The input folder (-f) can only be given for a single target.", exception_cls=ValueError)
     tag = args.tag or date.today().strftime("%Y_%m_%d")
-
-    build_workspace(input_dir=input_dir, analysis=args.analysis, year=args.year, tag=tag, variable=args.variable, root_folder=root_folder)
+    set_histogram_reader(args.reader)
+    set_root_file_pool_size(args.max_open_files)
+
+    # All targets share the ROOT and Combine initialization. Their systematics files differ, so the cached ones are released after each target
+    for index, (analysis, year, variable) in enumerate(targets, start=1):
+        logger.info(f"Building target {index}/{len(targets)}: {analysis} {year} {variable}")
+        build_workspace(
+            input_dir=args.dir or f"inputs/histograms/{variable}/{analysis}_{year}/",
+            analysis=analysis,
+            year=year,
+            tag=tag,
+            variable=variable,
+            root_folder=args.folder or f"category_{analysis}_{year}",
+            jobs=args.jobs,
+            incremental=args.incremental,
+            prune_tolerance=args.prune_tolerance,
+            pack_mc_stat=args.pack_mc_stat,
+            pack_tf_stat=args.pack_tf_stat,
+            diagnostic_plots=not args.no_diagnostic_plots,
+            streaming=args.streaming,
+            validate=args.validate,
+            compression=args.compression,
+            variation_histograms=args.variation_histograms,
+        )
+        clear_array_hists_cache()
+    close_root_files()
 
 
 if __name__ == "__main__":
@@ -2,16 +2,87 @@ import ROOT  # type: ignore
 import sys
 import array
 import re
+import numpy as np
 from HiggsAnalysis.CombinedLimit.ModelTools import SafeWorkspaceImporter  # type: ignore
-from utils.workspace.generic import safe_import, suppress_roofit_info
+from utils.workspace.generic import safe_import
 from utils.generic.logger import initialize_colorized_logger
 
 log_level = "INFO"
 logger = initialize_colorized_logger(log_level=log_level)
 
+# Provides AsymPow, also available to text2workspace.py and combine
+ROOT.gSystem.Load("libHiggsAnalysisCombinedLimit")
+
 MAXBINS = 100
 
 
+# The per-bin functions below use compiled RooFit/Combine classes with their coefficients stored as constants,
+# instead of RooFormulaVar strings which are JIT-compiled by TFormula once per distinct string.
+def one_plus(name, title, func):
+    """Return the function 1 + `func`."""
+    return ROOT.RooPolyVar(name, title, func, ROOT.RooArgList(ROOT.RooFit.RooConst(1), ROOT.RooFit.RooConst(1)))
+
+
+def linear_response(name, title, nuis, slope):
+    """Return the function `slope` * `nuis`."""
+    return ROOT.RooPolyVar(name, title, nuis, ROOT.RooArgList(ROOT.RooFit.RooConst(slope)), 1)
+
+
+def quadratic_response(name, title, nuis, coeff_a, coeff_b):
+    """Return the function `coeff_a` * `nuis`^2 + `coeff_b` * `nuis`."""
+    return ROOT.RooPolyVar(name, title, nuis, ROOT.RooArgList(ROOT.RooFit.RooConst(coeff_b), ROOT.RooFit.RooConst(coeff_a)), 1)
+
+
+def lognormal_response(name, title, nuis, kappa):
+    """Return the function `kappa`^`nuis` - 1, with `kappa` > 0 (see AsymPow)."""
+    power = ROOT.AsymPow(f"{name}_pow", title, ROOT.RooFit.RooConst(1.0 / kappa), ROOT.RooFit.RooConst(kappa), nuis)
+    return ROOT.RooPolyVar(name, title, power, ROOT.RooArgList(ROOT.RooFit.RooConst(-1), ROOT.RooFit.RooConst(1)))
+
+
+def get_bin_yields(dataset, varname, edges):
+    """Return the sum of weights of a RooDataHist in each bin [edges[i], edges[i+1]) of the model.
+
+    Each entry of the dataset is assigned to a bin by its coordinate, as the cut `edges[i] <= var < edges[i+1]` would do.
+    """
+    n_entries = dataset.numEntries()
+    coordinates = np.empty(n_entries)
+    weights = np.empty(n_entries)
+    for i in range(n_entries):
+        coordinates[i] = dataset.get(i).getRealValue(varname)
+        weights[i] = dataset.weight()
+    indices = np.searchsorted(edges, coordinates, side="right") - 1
+    in_range = (indices >= 0) & (indices < len(edges) - 1)
+    return np.bincount(indices[in_range], weights=weights[in_range], minlength=len(edges) - 1)
+
+
+class WorkspaceHandles:
+    """Python-side cache of the variables and functions of a workspace, to avoid repeated lookups by name.
+
+    Only objects found in the workspace are cached, so an object can still be looked up before it is imported.
+    """
+
+    def __init__(self, wspace):
+        self.wspace = wspace
+        self._vars = {}
+        self._functions = {}
+
+    def var(self, name):
+        if name not in self._vars:
+            obj = self.wspace.var(name)
+            if not obj:
+                return obj
+            self._vars[name] = obj
+        return self._vars[name]
+
+    def function(self, name):
+        if name not in self._functions:
+            obj = self.wspace.function(name)
+            if not obj:
+                return obj
+            self._functions[name] = obj
+        return self._functions[name]
+
+
 def naming_convention(id, catid, convention="BU"):
     if convention == "BU":
         return f"model_mu_cat_{catid}_bin_{id}"
@@ -37,13 +108,87 @@ def getNormalizedHist(hist):
     return thret
 
 
+class BinTable:
+    """Columnar storage of the per-bin quantities of a `Category`, one row per (control region, bin).
+
+    Rows are ordered by control region, then by bin, as the `Bin` objects in `Category.channels`.
+    """
+
+    def __init__(self, edges, n_crs):
+        n_bins = len(edges) - 1
+        n_rows = n_crs * n_bins
+        self.n_bins = n_bins
+        self.cr_index = np.repeat(np.arange(n_crs), n_bins)
+        self.bin_index = np.tile(np.arange(n_bins), n_crs)
+        self.xmin = np.tile(np.asarray(edges[:-1], dtype=float), n_crs)
+        self.xmax = np.tile(np.asarray(edges[1:], dtype=float), n_crs)
+        self.initY = np.zeros(n_rows)
+        self.sfactor = np.zeros(n_rows)
+        self.initE = np.zeros(n_rows)
+        self.initE_precorr = np.zeros(n_rows)
+        self.initB = np.zeros(n_rows)
+        self.binerror = np.zeros(n_rows)
+        self.binerror_m = np.zeros(n_rows)
+
+    def row(self, cr_index, bin_index):
+        return cr_index * self.n_bins + bin_index
+
+
+def bin_table_column(name):
+    """Property reading and writing the row of a `Bin` in the column `name` of its `BinTable`."""
+
+    def fget(self):
+        return float(getattr(self.table, name)[self.row])
+
+    def fset(self, value):
+        getattr(self.table, name)[self.row] = value
+
+    return property(fget, fset)
+
+
 class Bin:
-    def __init__(self, category, catid, chid, id, var, datasetname, wspace, wspace_out, xmin, xmax, convention):
+    # Lightweight proxy to a row of a `BinTable`, holding the workspace objects of a (control region, bin)
+    __slots__ = (
+        "table",
+        "row",
+        "category",
+        "catid",
+        "chid",
+        "id",
+        "convention",
+        "binid",
+        "wspace_out",
+        "handles",
+        "var",
+        "obs",
+        "cr",
+        "b",
+        "sfactor",
+        "model_mu",
+        "model_mu_var",
+        "pure_mu",
+        "mu",
+        "categoryname",
+    )
+
+    o = 1
+
+    xmin = bin_table_column("xmin")
+    xmax = bin_table_column("xmax")
+    initY = bin_table_column("initY")
+    initE = bin_table_column("initE")
+    initE_precorr = bin_table_column("initE_precorr")
+    initB = bin_table_column("initB")
+    binerror = bin_table_column("binerror")
+    binerror_m = bin_table_column("binerror_m")
+
+    def __init__(self, category, catid, chid, id, var, wspace_out, table, row, convention, handles=None):
         self.category = category
         self.chid = chid  # This is the thing that links two bins from different controls togeher
         self.id = id
         self.catid = catid
-        # self.type_id   = 10*MAXBINS*catid+MAXBINS*chid+id
+        self.table = table
+        self.row = row
 
         self.convention = convention
 
@@ -53,98 +198,61 @@ class Bin:
             self.binid = f"cat_{catid}_ch_{chid}_bin{id + 1}"
 
         self.wspace_out = wspace_out
-        self.wspace_out._safe_import = SafeWorkspaceImporter(self.wspace_out)
+        # Shared by all the bins of a `Category`
+        self.handles = handles or WorkspaceHandles(self.wspace_out)
 
-        self.set_wspace(wspace)
-
-        self.var = self.wspace_out.var(var.GetName())
-        # self.dataset   = self.wspace.data(datasetname)
-
-        self.rngename = f"rnge_{self.binid}"
-        self.xmin = xmin
-        self.xmax = xmax
-        self.cen = (self.xmax + self.xmin) / 2
-        with suppress_roofit_info(debug=log_level == "DEBUG"):
-            self.var.setRange(self.rngename, self.xmin, self.xmax)
-
-        self.initY = 0
-        self.initE = 0
-        self.initE_precorr = 0
-        self.initB = 0
-        self.binerror = 0
-        self.binerror_m = 0
-
-        self.o = 1
+        self.var = self.handles.var(var.GetName())
         # ROOT.RooRealVar("observed","Observed Events bin",1)
-        self.obs = self.wspace_out.var("observed")
-
-        # <-------------------------- Check this is cool
-        self.argset = ROOT.RooArgSet(wspace.var(self.var.GetName()))
-        self.obsargset = ROOT.RooArgSet(self.wspace_out.var("observed"), self.wspace_out.cat("bin_number"))
+        self.obs = self.handles.var("observed")
 
         self.b = 0
         # self.constBkg = True
 
-    def add_background(self, bkg):
+    @property
+    def cen(self):
+        return (self.xmax + self.xmin) / 2
+
+    def add_background(self, bkg, bkg_yields=None):
+        # bkg_yields holds the yield of the background dataset in each bin, see `get_bin_yields`
         if "Purity" in bkg:
             tmp_pfunc = ROOT.TF1(f"tmp_bkg_{self.id}", bkg.split(":")[-1])  # ?
             b = self.o * (1 - tmp_pfunc.Eval(self.cen))
             # self.constBkg = False
         else:
-            bkg_set = self.wspace.data(bkg)
             # if not self.wspace_out.data(bkg): safe_import(workspace=self.wspace_out, obj=bkg)
-            var = self.var.GetName()
-            b = bkg_set.sumEntries(f"{var}>={self.xmin} && {var}<{self.xmax} ")
+            b = float(bkg_yields[self.id])
 
-        # Now model nuisances for background
-        nuisances = self.cr.ret_bkg_nuisances()
+        # Now model nuisances for background, only those affecting this bin have a function in the workspace
+        nuisances = self.cr.ret_bin_nuisances(self.id, bkg=True)
         if len(nuisances) > 0:
-            prod = 0
-            print("Is this really true? How many nuisance:", len(nuisances))
-
+            logger.debug(f"Adding background nuisances to {self.binid}: {nuisances}")
             if len(nuisances) > 1:
                 nuis_args = ROOT.RooArgList()
                 for nuis in nuisances:
-                    print("Adding Background Nuisance ", nuis)
                     # Nuisance*Scale is the model
                     func_name = f"sys_function_{nuis}_{self.binid}"
-                    print("Trying to continue", self.wspace_out.function(func_name).GetName())
-                    print("Does it have an attribute:", self.wspace_out.function(func_name).getAttribute("temp"))
-                    if self.wspace_out.function(func_name).getAttribute("temp"):
-                        continue
-                    form_args = ROOT.RooArgList(self.wspace_out.function(func_name))
-                    delta_nuis = ROOT.RooFormulaVar(f"delta_bkg_{self.binid}_{nuis}", f"Delta Change from {nuis}", "1+@0", form_args)
+                    delta_nuis = one_plus(f"delta_bkg_{self.binid}_{nuis}", f"Delta Change from {nuis}", self.handles.function(func_name))
                     safe_import(workspace=self.wspace_out, obj=delta_nuis)
-                    nuis_args.add(self.wspace_out.function(delta_nuis.GetName()))
+                    nuis_args.add(self.handles.function(delta_nuis.GetName()))
                 prod = ROOT.RooProduct(f"prod_background_{self.binid}", "Nuisance Modifier", nuis_args)
             else:
-                print("Adding Background Nuisance ", nuisances[0])
-                # if (self.wspace_out.function.getAttribute("temp")):
-                # else:
-                prod = ROOT.RooFormulaVar(
+                prod = one_plus(
                     f"prod_background_{self.binid}",
                     f"Delta Change in Background from {nuisances[0]}",
-                    "1+@0",
-                    ROOT.RooArgList(self.wspace_out.function(f"sys_function_{nuisances[0]}_{self.binid}")),
+                    self.handles.function(f"sys_function_{nuisances[0]}_{self.binid}"),
                 )
 
-            self.b = ROOT.RooFormulaVar(f"background_{self.binid}", f"Number of expected background events in {self.binid}", f"@0*{b}", ROOT.RooArgList(prod))
-        else:
-            self.b = ROOT.RooFormulaVar(
-                f"background_{self.binid}", f"Number of expected background events in {self.binid}", "@0", ROOT.RooArgList(ROOT.RooFit.RooConst(b))
+            self.b = ROOT.RooProduct(
+                f"background_{self.binid}", f"Number of expected background events in {self.binid}", ROOT.RooArgList(prod, ROOT.RooFit.RooConst(b))
             )
+        else:
+            self.b = ROOT.RooProduct(f"background_{self.binid}", f"Number of expected background events in {self.binid}", ROOT.RooArgList(ROOT.RooFit.RooConst(b)))
         safe_import(workspace=self.wspace_out, obj=self.b)
-        self.b = self.wspace_out.function(self.b.GetName())
+        self.b = self.handles.function(self.b.GetName())
 
     def ret_initY(self):
         return self.initY
 
-    def set_initY(self, mcdataset):
-        var = self.var.GetName()
-        sum_formula = f"{var}>={self.xmin} && {var}<{self.xmax}"
-        logger.debug(f"INIT Y: {sum_formula} {self.rngename} {self.wspace} {self.wspace.data(mcdataset)} {mcdataset}")
-        self.initY = self.wspace.data(mcdataset).sumEntries(sum_formula, self.rngename)
-
     def set_initE_precorr(self):
         return 0
         self.initE_precorr = (
@@ -160,15 +268,12 @@ class Bin:
     def set_label(self, cat):
         self.categoryname = cat.GetName()
 
-    def set_wspace(self, w):
-        self.wspace = w
-        self.wspace._safe_import = SafeWorkspaceImporter(self.wspace)
-
     def set_sfactor(self, val):
         # print "Scale Factor for " ,self.binid,val
-        if self.wspace_out.var(f"sfactor_{self.binid}"):
+        self.table.sfactor[self.row] = val
+        if self.handles.var(f"sfactor_{self.binid}"):
             self.sfactor.setVal(val)
-            self.wspace_out.var(self.sfactor.GetName()).setVal(val)
+            self.handles.var(self.sfactor.GetName()).setVal(val)
         else:
             self.sfactor = ROOT.RooRealVar(f"sfactor_{self.binid}", f"Scale factor for bin {self.binid}", val, 0.00001, 10000)
             self.sfactor.removeRange()
@@ -181,14 +286,13 @@ class Bin:
         # or the transfer factor and nuisances from the category this process depends on
         logger.debug(f"functionalForm: {functionalForm}")
         if not len(functionalForm):
-            if not self.wspace_out.var(naming_convention(self.id, self.catid, self.convention)):
+            model_mu_name = naming_convention(self.id, self.catid, self.convention)
+            if not self.handles.var(model_mu_name):
                 # RooRealVar containing `initY` (for `qcd_zjets`, this is the QCD Znunu in SR yield)
-                self.model_mu = ROOT.RooRealVar(
-                    naming_convention(self.id, self.catid, self.convention), f"Model of N expected events in {self.id}", self.initY, 0, 3 * self.initY
-                )
+                self.model_mu = ROOT.RooRealVar(model_mu_name, f"Model of N expected events in {self.id}", self.initY, 0, 3 * self.initY)
                 # self.model_mu.removeMax() TODO
             else:
-                self.model_mu = self.wspace_out.var(naming_convention(self.id, self.catid, self.convention))
+                self.model_mu = self.handles.var(model_mu_name)
         else:
             logger.debug("Setting up dependence!!")
             if self.convention == "BU":
@@ -197,53 +301,48 @@ class Bin:
                 DEPENDANT = f"{functionalForm}_bin{self.id + 1}"
 
             # Fetch the expected yield from the category this one depends on (pmu_cat_{category}_{BASE}_ch_{CONTROL})
-            self.model_mu = self.wspace_out.function(f"pmu_{DEPENDANT}")
+            self.model_mu = self.handles.function(f"pmu_{DEPENDANT}")
             if not self.model_mu:
                 logger.critical(f"Missing pmu_{DEPENDANT} from wspace_out.", exception_cls=ValueError)
 
-        arglist = ROOT.RooArgList((self.model_mu), self.wspace_out.var(self.sfactor.GetName()))
+        arglist = ROOT.RooArgList((self.model_mu), self.handles.var(self.sfactor.GetName()))
 
         # Multiply by each of the uncertainties in the control region, dont alter the Poisson pdf, we will add the constraint at the end. Actually we won't use this right now.
-        nuisances = self.cr.ret_nuisances()
+        # Only the nuisances with a non-zero effect in this bin have a function in the workspace (see `Channel.add_bin_effect`).
+        # Effectively, this skips the EWK theory variations and statistical variations, which are decorelated by bin,
+        # for the bins they don't affect.
+        nuisances = self.cr.ret_bin_nuisances(self.id)
         if len(nuisances) > 0:
             prod = 0
             if len(nuisances) > 1:
                 nuis_args = ROOT.RooArgList()
                 # Fetch each nuisance, and create a "delta" formula (1 + nuisance effect), store it for the product
                 for nuis in nuisances:
-                    # Skip nuisances that have the "temp" Attribute.
-                    # This attribute is given to nuisances in bins where the difference between up and down variation is 0
-                    # Effectively, this skips the EWK theory variations and statistical variations, which are decorelated by bin,
-                    # for the bins they don't affect.
-                    if self.wspace_out.function(f"sys_function_{nuis}_{self.binid}").getAttribute("temp"):
-                        continue
-
                     logger.debug(f"Adding Nuisance {nuis}")
                     # Nuisance*Scale is the model
-                    form_args = ROOT.RooArgList(self.wspace_out.function(f"sys_function_{nuis}_{self.binid}"))
-                    delta_nuis = ROOT.RooFormulaVar(f"delta_{self.binid}_{nuis}", f"Delta Change from {nuis}", "1+@0", form_args)
+                    delta_nuis = one_plus(f"delta_{self.binid}_{nuis}", f"Delta Change from {nuis}", self.handles.function(f"sys_function_{nuis}_{self.binid}"))
                     safe_import(workspace=self.wspace_out, obj=delta_nuis)
-                    nuis_args.add(self.wspace_out.function(delta_nuis.GetName()))
+                    nuis_args.add(self.handles.function(delta_nuis.GetName()))
 
                 prod = ROOT.RooProduct(f"prod_{self.binid}", "Nuisance Modifier", nuis_args)
             else:
                 logger.debug(f"Adding Nuisance {nuisances[0]}")
-                prod = ROOT.RooFormulaVar(
+                prod = one_plus(
                     f"prod_{self.binid}",
                     f"Delta Change from {nuisances[0]}",
-                    "1+@0",
-                    ROOT.RooArgList(self.wspace_out.function(f"sys_function_{nuisances[0]}_{self.binid}")),
+                    self.handles.function(f"sys_function_{nuisances[0]}_{self.binid}"),
                 )
             arglist.add(prod)
-            # Now create the formula for the expected number of events, which is the product of the QCD Znunu yield, transfer factor and nuisances
-            self.pure_mu = ROOT.RooFormulaVar(f"pmu_{self.binid}", f"Number of expected (signal) events in {self.binid}", "(@0*@1)*@2", arglist)
-        else:
-            self.pure_mu = ROOT.RooFormulaVar(f"pmu_{self.binid}", f"Number of expected (signal) events in {self.binid}", "(@0*@1)", arglist)
+        # Now create the expected number of events, which is the product of the QCD Znunu yield, transfer factor and nuisances
+        self.pure_mu = ROOT.RooProduct(f"pmu_{self.binid}", f"Number of expected (signal) events in {self.binid}", arglist)
         # Finally we add in the background
         bkgArgList = ROOT.RooArgList(self.pure_mu)
-        self.mu = ROOT.RooFormulaVar(f"mu_{self.binid}", f"Number of expected events in {self.binid}", "@0", bkgArgList)
+        self.mu = ROOT.RooProduct(f"mu_{self.binid}", f"Number of expected events in {self.binid}", bkgArgList)
 
         safe_import(workspace=self.wspace_out, obj=self.mu)
+        # Keep the imported objects, to evaluate them without looking them up by name
+        self.mu = self.handles.function(self.mu.GetName())
+        self.model_mu_var = self.handles.var(self.model_mu.GetName())
         # safe_import(workspace=self.wspace_out, obj=self.obs)
         self.wspace_out.factory(f"Poisson::pdf_{self.binid}(observed,mu_{self.binid})")
 
@@ -280,10 +379,10 @@ class Bin:
         self.binerror_m = (self.binerror_m**2 + e**2) ** 0.5
 
     def ret_expected(self):
-        return self.wspace_out.function(self.mu.GetName()).getVal()
+        return self.mu.getVal()
 
     def ret_expected_err(self):
-        return self.wspace_out.function(self.mu.GetName()).getError()
+        return self.mu.getError()
 
     def ret_model_err(self):
         return self.binerror_m
@@ -294,13 +393,13 @@ class Bin:
         return 0  # self.wspace_out.function(self.b.GetName()).getVal()
 
     def ret_correction(self):
-        return (self.wspace_out.var(self.model_mu.GetName()).getVal()) / self.initY
+        return (self.model_mu_var.getVal()) / self.initY
 
     def ret_correction_err(self):
         return self.ret_model_err() / self.initY
 
     def ret_model(self):
-        return self.wspace_out.var(self.model_mu.GetName()).getVal()
+        return self.model_mu_var.getVal()
 
     def Print(self):
         print(
@@ -321,7 +420,7 @@ class Bin:
             " .... observed = ",
             self.o,
             ", expected = ",
-            self.wspace_out.function(self.mu.GetName()).getVal(),
+            self.mu.getVal(),
             f" (of which {self.ret_background()} is background)",
             ", scale factor = ",
             self.wspace_out.function(self.sfactor.GetName()).getVal(),
@@ -347,6 +446,9 @@ class Channel:
         self.crname = cname
         self.nbins = scalefactors.GetNbinsX()
         self.convention = convention
+        # Sparse bin -> nuisances map: only the nuisances with a non-zero effect in a bin have a function in the workspace
+        self.bin_nuisances = [[] for _ in range(self.nbins)]
+        self.bin_bkg_nuisances = [[] for _ in range(self.nbins)]
 
     def ret_title(self):
         return self.crname
@@ -364,21 +466,34 @@ class Channel:
             )
             safe_import(workspace=self.wspace_out, obj=cont)
 
-        # run through all of the bins in the control regions and create a function to interpolate
+        # run through all of the bins in the control regions and create a function to interpolate, unless the nuisance has no effect
+        nuis = self.wspace_out.var(name)
         for b in range(self.nbins):
-            if self.convention == "BU":
-                fname = f"sys_function_{name}_cat_{self.catid}_ch_{self.chid}_bin_{ b}"
-            else:
-                fname = f"sys_function_{name}_cat_{self.catid}_ch_{self.chid}_bin{b + 1}"
-            func = ROOT.RooFormulaVar(fname, "Systematic Variation", f"@0*{size}", ROOT.RooArgList(self.wspace_out.var(name)))
-            if not self.wspace_out.function(func.GetName()):
-                safe_import(workspace=self.wspace_out, obj=func)
+            if size == 0:
+                break
+            func = linear_response(self.sys_function_name(name, b), "Systematic Variation", nuis, size)
+            self.add_bin_effect(name, b, func, bkg=bkg)
         if bkg:
             self.bkg_nuisances.append(name)
         else:
             self.nuisances.append(name)
 
-    def add_nuisance_shape(self, name, file, setv="", functype="quadratic"):
+    def sys_function_name(self, name, b):
+        # Name of the function depends on naming scheme
+        fname = f"sys_function_{name}_cat_{self.catid}_ch_{self.chid}"
+        if self.convention == "BU":
+            return f"{fname}_bin_{b}"
+        return f"{fname}_bin{b + 1}"
+
+    def add_bin_effect(self, name, b, func, bkg=False):
+        # Import the function describing the effect of a nuisance in bin b, and record it in the sparse bin -> nuisances map
+        if not self.wspace_out.function(func.GetName()):
+            safe_import(workspace=self.wspace_out, obj=func)
+        bin_nuisances = self.bin_bkg_nuisances[b] if bkg else self.bin_nuisances[b]
+        if name not in bin_nuisances:
+            bin_nuisances.append(name)
+
+    def add_shape_nuisance_parameter(self, name):
         if not (self.wspace_out.var(name)):
             nuis = ROOT.RooRealVar(name, f"Nuisance - {name}", 0, -3, 3)
             nuis.setAttribute("NuisanceParameter_EXTERNAL", True)
@@ -396,25 +511,14 @@ class Channel:
             )
             safe_import(workspace=self.wspace_out, obj=cont)
 
-        sf_base = f"{self.scalefactors.GetName()}_{name}"
-        logger.debug(f"Looking for systematic shapes: {sf_base}")
-        sysup, sysdn = file.Get(f"{sf_base}_Up"), file.Get(f"{sf_base}_Down")
-        try:
-            sysup.GetName()
-            sysdn.GetName()
-        except ReferenceError:
-            logger.info(f"Missing {sf_base} up or down in {file.GetName()}")
-            logger.info("Following is in directory ")
-            file.ls()
-            sys.exit()
+    def add_nuisance_shape(self, name, sysup, sysdn, setv="", functype="quadratic"):
+        # sysup and sysdn are the Up and Down variations of the scale factors, see `model_utils.VariationRegistry`
+        self.add_shape_nuisance_parameter(name)
+        nuis = self.wspace_out.var(name)
+        logger.debug(f"Adding systematic shapes: {sysup.GetName()}, {sysdn.GetName()}")
         # Now we loop through each bin and construct a polynomial function per bin
         for b in range(self.nbins):
-            # Name of the function depends on naming scheme
-            fname = f"sys_function_{name}_cat_{self.catid}_ch_{self.chid}"
-            if self.convention == "BU":
-                fname = f"{fname}_bin_{b}"
-            else:
-                fname = f"{fname}_bin{b + 1}"
+            fname = self.sys_function_name(name, b)
             if functype == "quadratic":
                 if self.scalefactors.GetBinContent(b + 1) == 0:
                     nsf = 0
@@ -433,10 +537,12 @@ class Channel:
                 coeff_b = 0.5 * (vu - vd)
 
                 # this is now relative deviation, SF-SF_0 = func => SF = SF_0*(1+func/SF_0)
-                func = ROOT.RooFormulaVar(fname, "Systematic Variation", f"({coeff_a}*@0*@0+{coeff_b}*@0)/{nsf}", ROOT.RooArgList(self.wspace_out.var(name)))
-
-                if coeff_a == 0 and coeff_b == 0:
-                    func.setAttribute("temp", True)
+                # Without nominal scale factor, there is no variation (instead of a 0/0 formula)
+                norm = 1.0 / nsf if nsf != 0 else 0
+                # Bins without variation have no function at all
+                if (coeff_a == 0 and coeff_b == 0) or norm == 0:
+                    continue
+                func = quadratic_response(fname, "Systematic Variation", nuis, coeff_a * norm, coeff_b * norm)
             elif functype == "lognorm":
                 n0 = self.scalefactors.GetBinContent(b + 1)
                 if n0 == 0:
@@ -449,17 +555,14 @@ class Channel:
 
                     direction = 1 if sfmax > sfmin else -1
 
-                func = ROOT.RooFormulaVar(
-                    fname,
-                    "Systematic Variation",
-                    f"({n0} * (1+{sigma}/{n0})**({direction}*@0) - {n0}) / {n0}",
-                    ROOT.RooArgList(self.wspace_out.var(name)),
-                )
-                if sigma == 0:
-                    func.setAttribute("temp", True)
-            self.wspace_out.var(name).setVal(0)
-            if not self.wspace_out.function(func.GetName()):
-                safe_import(workspace=self.wspace_out, obj=func)
+                # (n0 * (1+sigma/n0)**(direction*x) - n0) / n0, without variation if n0 is 0 (instead of a 0/0 formula)
+                kappa = (1 + sigma / n0) ** direction if n0 != 0 else 1
+                # Bins without variation have no function at all
+                if sigma == 0 or kappa == 1:
+                    continue
+                func = lognormal_response(fname, "Systematic Variation", nuis, kappa)
+            nuis.setVal(0)
+            self.add_bin_effect(name, b, func)
         if setv != "":
             if "SetTo" in setv:
                 vv = float(setv.split("=")[1])
@@ -470,6 +573,17 @@ class Channel:
                 sys.exit()
         self.nuisances.append(name)
 
+    def add_bin_nuisances(self, names, kappas):
+        # One lognormal nuisance per bin, names[i] scales bin i by kappas[i] ** names[i] and leaves the other bins unchanged.
+        # Equivalent to `add_nuisance_shape` with functype="lognorm" and variations differing from the scale factors in one bin only.
+        for b, name in enumerate(names):
+            self.add_shape_nuisance_parameter(name)
+            nuis = self.wspace_out.var(name)
+            nuis.setVal(0)
+            if kappas[b] != 1:
+                self.add_bin_effect(name, b, lognormal_response(self.sys_function_name(name, b), "Systematic Variation", nuis, float(kappas[b])))
+            self.nuisances.append(name)
+
     def set_wspace(self, w):
         self.wspace = w
         self.wspace._safe_import = SafeWorkspaceImporter(self.wspace)
@@ -480,6 +594,10 @@ class Channel:
     def ret_nuisances(self):
         return self.nuisances
 
+    def ret_bin_nuisances(self, b, bkg=False):
+        # Nuisances with a non-zero effect in bin b, in the order they were added
+        return self.bin_bkg_nuisances[b] if bkg else self.bin_nuisances[b]
+
     def ret_name(self):
         return self.chname
 
@@ -541,12 +659,18 @@ class Category:
 
         self._wspace_out._safe_import = SafeWorkspaceImporter(self._wspace_out)
         self._wspace._safe_import = SafeWorkspaceImporter(self._wspace)
+        # Workspace objects used by the bins, shared by all the bins of the category
+        self.handles = WorkspaceHandles(self._wspace_out)
 
         # self.diag = diag
         self.additional_vars = {}
         self.additional_targets = []
 
         self.channels = []
+        # Bins of each control region, indexed by `chid`, in the order of `self.channels`
+        self.channels_by_cr = {}
+        # Per-bin quantities of the channels, filled by `init_channels`
+        self.bin_table = None
         self.all_hists = []
         self.cr_prefit_hists = []
         # Setup a bunch of the attributes for this category
@@ -566,6 +690,8 @@ class Category:
             safe_import(workspace=self._wspace_out, obj=self._var)
         self._var = self._wspace_out.var(self._var.GetName())
         self.isSecondDependant = False
+        # Whether the prefit histograms, templates and canvases (not used by the combine fit) are made, see `init_channels`
+        self.diagnostic_plots = True
 
         self.convention = convention
 
@@ -580,37 +706,29 @@ class Category:
     def addVar(self, vnam, n, xmin, xmax):
         self.additional_vars[vnam] = [n, xmin, xmax]
 
+    def ret_cr_channels(self, cr):
+        # Bins of a control region, without scanning all the channels of the category
+        return self.channels_by_cr.get(cr.chid, [])
+
     def fillExpectedHist(self, cr, expected_hist):
-        bc = 0
-        for i, ch in enumerate(self.channels):
-            if ch.chid == cr.chid:
-                bc += 1
-                expected_hist.SetBinContent(bc, ch.ret_expected())
-                expected_hist.SetBinError(bc, ch.ret_err())
+        for bc, ch in enumerate(self.ret_cr_channels(cr), start=1):
+            expected_hist.SetBinContent(bc, ch.ret_expected())
+            expected_hist.SetBinError(bc, ch.ret_err())
 
     def fillExpectedCorr(self, cr, expected_hist, regen=False):
-        bc = 0
-        for i, ch in enumerate(self.channels):
-            if ch.chid == cr.chid:
-                bc += 1
-                prefitValue = ch.initE_precorr if regen else ch.initE - ch.initB
-                expected_hist.SetBinContent(bc, (ch.ret_expected() - ch.ret_background()) / (prefitValue))
-                expected_hist.SetBinError(bc, ch.ret_err() / (ch.initE - ch.initB))
+        for bc, ch in enumerate(self.ret_cr_channels(cr), start=1):
+            prefitValue = ch.initE_precorr if regen else ch.initE - ch.initB
+            expected_hist.SetBinContent(bc, (ch.ret_expected() - ch.ret_background()) / (prefitValue))
+            expected_hist.SetBinError(bc, ch.ret_err() / (ch.initE - ch.initB))
 
     def fillObservedHist(self, cr, observed_hist):
-        bc = 0
-        for i, ch in enumerate(self.channels):
-            if ch.chid == cr.chid:
-                bc += 1
-                observed_hist.SetBinContent(bc, ch.ret_observed())
-                observed_hist.SetBinError(bc, (ch.ret_observed()) ** 0.5)
+        for bc, ch in enumerate(self.ret_cr_channels(cr), start=1):
+            observed_hist.SetBinContent(bc, ch.ret_observed())
+            observed_hist.SetBinError(bc, (ch.ret_observed()) ** 0.5)
 
     def fillBackgroundHist(self, cr, background_hist):
-        bc = 0
-        for i, ch in enumerate(self.channels):
-            if ch.chid == cr.chid:
-                bc += 1
-                background_hist.SetBinContent(bc, ch.ret_background())
+        for bc, ch in enumerate(self.ret_cr_channels(cr), start=1):
+            background_hist.SetBinContent(bc, ch.ret_background())
 
     def fillModelHist(self, model_hist):
         for i, ch in enumerate(self.channels):
@@ -637,42 +755,59 @@ class Category:
 
         return hist.Clone()
 
-    def init_channels(self):
+    def init_channels(self, diagnostic_plots=True):
+        # Without diagnostic plots, only the workspace objects used by the fit are built
+        self.diagnostic_plots = diagnostic_plots
         # print "self._wspace_out.Print(V)", self._wspace_out.Print("V")
         # ROOT.RooCategory("bin_number","bin_number")
         sample = self._wspace_out.cat("bin_number")
         # print "zeynep sample", sample, self._wspace_out.cat("bin_number")
 
+        # Sum the target and background datasets in each bin once, the last bin extends to the overflow
+        edges = np.array(self._bins, dtype=float)
+        edges[-1] = 999999.0
+        target_yields = get_bin_yields(self._wspace.data(self._target_datasetname), self._varname, edges)
+        bkg_yields = {}
+        for cr in self._control_regions:
+            bkg = cr.ret_background() if cr.has_background() else None
+            if bkg and "Purity" not in bkg and bkg not in bkg_yields:
+                bkg_yields[bkg] = get_bin_yields(self._wspace.data(bkg), self._varname, edges)
+
+        # Per-bin quantities of all the processes are stored in columns, the `Bin` objects only hold the workspace objects.
+        # set the "initial yield" to the number of events of the process of that category for that given bin.
+        # This is only usefull for process in the `qcd_zjets` model,
+        # where initY is set to the yield of QCD Znunu in the SR
+        self.bin_table = BinTable(edges, len(self._control_regions))
+        self.bin_table.initY = np.tile(target_yields, len(self._control_regions))
+
         # This loops for every process in the model and builds `Bin` objects.
         # Each of the `Bin` builds the modeled number of events for that process
         # in that given bin as a function of the nuissances affecting that process
         # and transfer factors to express it as a function of QCD Znunu in the SR
         for j, cr in enumerate(self._control_regions):
-            for i, bl in enumerate(self._bins):
-
-                # Fetch the edges of the bin
-                if i >= len(self._bins) - 1:
-                    continue
-                xmin, xmax = bl, self._bins[i + 1]
-                if i == len(self._bins) - 2:
-                    xmax = 999999.0
-
+            for i in range(self.bin_table.n_bins):
                 # Initialize the bin, with IDs to link it to the process and model,
-                ch = Bin(self.category, self.catid, cr.chid, i, self._var, "", self._wspace, self._wspace_out, xmin, xmax, convention=self.convention)
+                ch = Bin(
+                    self.category,
+                    self.catid,
+                    cr.chid,
+                    i,
+                    self._var,
+                    self._wspace_out,
+                    self.bin_table,
+                    self.bin_table.row(j, i),
+                    convention=self.convention,
+                    handles=self.handles,
+                )
                 # link the process
                 ch.set_control_region(cr)
 
                 # This is unused
                 if cr.has_background():
-                    ch.add_background(cr.ret_background())
+                    ch.add_background(cr.ret_background(), bkg_yields.get(cr.ret_background()))
 
                 ch.set_label(sample)  # should import the sample category label
 
-                # set the "initial yield" to the number of events of the process of that category for that given bin.
-                # This is only usefull for process in the `qcd_zjets` model,
-                # where initY is set to the yield of QCD Znunu in the SR
-                ch.set_initY(self._target_datasetname)
-
                 # Set the "scale factor" for this given bin (rather a transfer factor),
                 # the ratio between the yield of the process of the "control region" and
                 # the process of the "category" (e.g. in the `ewk_zjets` model, it would be process / EWK Znunu in SR)
@@ -696,8 +831,12 @@ class Category:
                 ch.set_initE()
                 ch.add_to_dataset()
                 self.channels.append(ch)
+                self.channels_by_cr.setdefault(cr.chid, []).append(ch)
         # fit is buggered so need to scale by 1.1
 
+        if not self.diagnostic_plots:
+            return
+
         # Save the prefit histograms (these are not used by the combine fit)
         for j, cr in enumerate(self._control_regions):
             # save the prefit histos
@@ -715,13 +854,16 @@ class Category:
         for i, bl in enumerate(self.channels):
             if i >= len(self._bins) - 1:
                 break
-            model_mu = self._wspace_out.var(naming_convention(bl.id, bl.catid, self.convention))
+            model_mu = self.handles.var(naming_convention(bl.id, bl.catid, self.convention))
             # self._wspace_out.var(model_mu.GetName()).setVal(1.2*model_mu.getVal())
 
     def ret_control_regions(self):
         return self._control_regions
 
     def generate_systematic_templates(self, diag, npars):
+        if not self.diagnostic_plots:
+            logger.info(f"Diagnostic plots are disabled, not generating the systematic templates of {self.cname}")
+            return
         if self.model_hist == 0:
             sys.exit(
                 "Error in generate_systematic_templates: cannot generate template variations before nominal model is created, first run Category.save_model() !!!! "
@@ -730,12 +872,7 @@ class Category:
         # First store nominal values in control regions (to make error bands)
         nominals = []
         for j, cr in enumerate(self._control_regions):
-            nominal_values = []
-            for i, ch in enumerate(self.channels):
-                if ch.chid != cr.chid:
-                    continue
-                nominal_values.append(ch.ret_expected())
-            nominals.append(nominal_values)
+            nominals.append([ch.ret_expected() for ch in self.ret_cr_channels(cr)])
 
         # The parameters have changed so re-generate the templates
         # We also re-calculate the expectations in each CR to update the errors for the plotting
@@ -776,13 +913,9 @@ class Category:
 
             # Also want to calculate for each control region an error per bin associated, its very easy to do, but only do it for "Up" variation and the error will symmetrize itself
             for j, cr in enumerate(self._control_regions):
-                chi = 0
-                for i, ch in enumerate(self.channels):
-                    if ch.chid != cr.chid:
-                        continue
+                for chi, ch in enumerate(self.ret_cr_channels(cr)):
                     derr = abs(ch.ret_expected() - nominals[j][chi])
                     ch.add_err(derr)
-                    chi += 1
 
             # also add in signalregion the errors
             for i, ch in enumerate(self.channels):
@@ -969,6 +1102,9 @@ class Category:
                 self.histograms.append(model_hist_vx_tg.Clone())
 
     def make_post_fit_plots(self):
+        if not self.diagnostic_plots:
+            logger.info(f"Diagnostic plots are disabled, not making the post-fit plots of {self.cname}")
+            return
         c = ROOT.TCanvas(f"{self._target_datasetname}region_mc_fit_before_after")
         hist_original = ROOT.TH1F(f"{self.cname}_OriginalZvv", "", len(self._bins) - 1, array.array("d", self._bins))
         hist_post = ROOT.TH1F(f"{self.cname}_NewZvv", "", len(self._bins) - 1, array.array("d", self._bins))
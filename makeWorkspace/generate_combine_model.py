@@ -3,12 +3,18 @@
 import os
 import re
 import argparse
+import tempfile
+import multiprocessing
+from typing import Any, Optional
+from types import SimpleNamespace
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
 import ROOT  # type: ignore
 from HiggsAnalysis.CombinedLimit.ModelTools import SafeWorkspaceImporter  # type: ignore
 
 from utils.generic.logger import initialize_colorized_logger
-from utils.workspace.model import get_year_from_category, get_control_region_models
-from utils.workspace.generic import safe_import
+from utils.generic.hist_utils import HISTOGRAM_READERS, set_histogram_reader
+from utils.workspace.model import get_year_from_category, get_control_region_models, get_model_dependencies, sort_models
+from utils.workspace.generic import safe_import, create_output_file, import_workspace, parse_compression
 from utils.workspace.convert_to_combine_workspace import convert_to_combine_workspace
 
 logger = initialize_colorized_logger(log_level="INFO")
@@ -32,6 +38,11 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--category", type=str, required=True, help="Analysis category, e.g., 'vbf_2017'.")
     parser.add_argument("--variable", type=str, required=True, help="Variable name")
     parser.add_argument("--rename", type=str, default="", help="Optional new name for the observable variable.")
+    parser.add_argument("--reader", type=str, default="root", choices=HISTOGRAM_READERS, help="Library used to read the systematic histograms.")
+    parser.add_argument("--compression", type=parse_compression, default=None, help="Compression of the output file as <algorithm>:<level>, e.g. lz4:4 or zstd:5.")
+    parser.add_argument("--pack-tf-stat", action="store_true", help="Store the statistical variations of the transfer factors as packed TH2D histograms.")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="Number of processes used to build the control region models (default: 1).")
+    parser.add_argument("--no-diagnostic-plots", action="store_true", help="Only build the workspace used by the fit, without prefit histograms and canvases.")
 
     args = parser.parse_args()
 
@@ -46,70 +57,211 @@ def parse_args() -> argparse.Namespace:
     return args
 
 
+class ModelSummary:
+    """Picklable description of a `Category` built in a worker process, with what `convert_to_combine_workspace` uses."""
+
+    def __init__(self, model: Any) -> None:
+        self.catid = model.catid
+        self.cname = model.cname
+        self.control_regions = [SimpleNamespace(chid=cr.chid, crname=cr.crname) for cr in model.ret_control_regions()]
+
+    def ret_control_regions(self) -> list[SimpleNamespace]:
+        return self.control_regions
+
+
+def create_combine_workspace() -> ROOT.RooWorkspace:
+    """Create the Combine workspace with the global observables."""
+    workspace = ROOT.RooWorkspace("combinedws")
+    workspace._safe_import = SafeWorkspaceImporter(workspace)
+    sample_type = ROOT.RooCategory("bin_number", "Bin Number")
+    observed = ROOT.RooRealVar("observed", "Observed Events bin", 1)
+    safe_import(workspace=workspace, obj=sample_type)  # Global variables for dataset
+    safe_import(workspace=workspace, obj=observed)
+    return workspace
+
+
+def build_model(
+    model_name: str,
+    input_file: ROOT.TFile,
+    output_file: ROOT.TFile,
+    workspace: ROOT.RooWorkspace,
+    diag: Any,
+    category: str,
+    variable: str,
+    convention: str,
+    pack_tf_stat: bool = False,
+    diagnostic_plots: bool = True,
+) -> Any:
+    """Build a control region model into `workspace`, and write its transfer factors and their variations to `output_file`."""
+    module = __import__(model_name)
+    cr_dir = output_file.mkdir(f"{model_name}_category_{category}")
+    # The `cmodel` function is where models are created. This function does two things:
+    # 1) Compute transfer factors
+    #   Processes are express different processes as a ratio with of QCD Znunu in SR
+    #   For the qcd_zjets model, this is directly the ratio of the two processes
+    #   For other models, processes are first taken as a ratio with either EWK Znunu, QCD Wjets and EWK Wjets,
+    #   but these are later expressed as transfer factors to make QCD Znunu appear at the `init_channels` step
+    # 2) Add nuisances and add them to the workspace
+    #   for veto, JES/JER, theory and statistical uncertainties
+    #   for each transfer factor in the model
+    logger.info(f"Creating model for {model_name}")
+    model = module.cmodel(
+        category_id=category,
+        category_name=model_name,
+        input_file=input_file,
+        output_file=cr_dir,
+        output_workspace=workspace,
+        diagonalizer=diag,
+        year=get_year_from_category(category=category),
+        variable=variable,
+        convention=convention,
+        pack_tf_stat=pack_tf_stat,
+    )
+    logger.info(f"Initializing model channels for model: {model.cname}, cat: {model.catid}")
+    # This is where the actual model distributions as a function of QCD Znunu in SR are made for all processes.
+    # Processes modelled with `qcd_zjets` are expressed as:
+    #   (process yield) * [transfer factor = (QCD Znunu in SR) / (process yield)] * Product of all nuisances
+    # Processes using the other models will first fetch the above model, before multiplying the transfer factor and nuisances
+    # For instance, EWK Zll in the diMuon region, modelled with `ewk_zjets` will fetch
+    #   (EWK Znunu in SR) * [transfer factor = (QCD Znunu in SR) / (EWK Znunu in SR)] * Product of all nuisances (for EWK Znunu in SR)
+    # and multiply by
+    #   [transfer factor = (EWK Znunu in SR) / (EWK Zll in diMuon)] * Product of all nuisances (for EWK Zll in diMuon)
+    # These models are made for each bin of the given variable distribution and saved to the workspace
+    model.init_channels(diagnostic_plots=diagnostic_plots)
+    return model
+
+
+def build_partial_model(
+    model_name: str,
+    input_filename: str,
+    partial_filename: str,
+    dependency_filenames: list[str],
+    category: str,
+    variable: str,
+    convention: str,
+    pack_tf_stat: bool = False,
+    diagnostic_plots: bool = True,
+) -> ModelSummary:
+    """Build a control region model in its own workspace and file, starting from the partial workspaces of the models it depends on."""
+    input_file = ROOT.TFile.Open(input_filename)
+    workspace = create_combine_workspace()
+    for filename in dependency_filenames:
+        dependency_file = ROOT.TFile.Open(filename)
+        import_workspace(workspace=workspace, source=dependency_file.Get("combinedws"))
+        dependency_file.Close()
+
+    partial_file = ROOT.TFile(partial_filename, "RECREATE")
+    model = build_model(
+        model_name=model_name,
+        input_file=input_file,
+        output_file=partial_file,
+        workspace=workspace,
+        diag=diagonalizer(workspace),
+        category=category,
+        variable=variable,
+        convention=convention,
+        pack_tf_stat=pack_tf_stat,
+        diagnostic_plots=diagnostic_plots,
+    )
+    partial_file.WriteTObject(workspace)
+    partial_file.Close()
+    input_file.Close()
+    return ModelSummary(model)
+
+
+def build_models_in_parallel(
+    model_list: list[str], dependencies: dict[str, list[str]], partial_filenames: dict[str, str], jobs: int, **kwargs: Any
+) -> dict[str, ModelSummary]:
+    """Build each model in a worker process as soon as the models it depends on are built, see `build_partial_model`.
+
+    The workers are spawned rather than forked: a forked worker would inherit the ROOT state of this process, including
+    the output file open for writing, which can corrupt the output or deadlock.
+    """
+    summaries: dict[str, ModelSummary] = {}
+    pending = list(model_list)
+    running: dict[Future, str] = {}
+    with ProcessPoolExecutor(max_workers=jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+        while pending or running:
+            for model_name in [model_name for model_name in pending if all(dep in summaries for dep in dependencies[model_name])]:
+                pending.remove(model_name)
+                future = executor.submit(
+                    build_partial_model,
+                    model_name=model_name,
+                    partial_filename=partial_filenames[model_name],
+                    dependency_filenames=[partial_filenames[dep] for dep in dependencies[model_name]],
+                    **kwargs,
+                )
+                running[future] = model_name
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                summaries[running.pop(future)] = future.result()
+    return summaries
+
+
 def generate_combine_model(
     input_filename: str,
     output_filename: str,
     category: str,
     variable: str,
     rename: str = "",
+    compression: Optional[int] = None,
+    pack_tf_stat: bool = False,
+    diagnostic_plots: bool = True,
+    jobs: int = 1,
 ) -> None:
-    """Generate a Combine RooWorkspace with control region models."""
+    """Generate a Combine RooWorkspace with control region models.
+
+    The output file is written with the ROOT compression setting `compression` (see `parse_compression`), or the ROOT default if None.
+    With `pack_tf_stat`, the bin-by-bin statistical variations of each transfer factor are stored as two TH2D instead of one TH1 per bin and direction.
+    Without `diagnostic_plots`, the prefit histograms and canvases of the models are not made, only the workspace used by the fit.
+
+    With `jobs` > 1, the models are built in up to `jobs` worker processes, each one as soon as the models it depends on
+    (see `get_model_dependencies`) are built. Each model is built in a partial workspace, and the partial workspaces are
+    merged into the combined workspace in the order of `sort_models`, such that the output does not depend on the scheduling.
+    The merged workspace holds the same models as the one built in-process with `jobs` = 1, but the order of its objects differs.
+    """
     model_list = get_control_region_models(category=category)
+    dependencies = get_model_dependencies(model_list=model_list)
+    model_list = sort_models(model_list=model_list, dependencies=dependencies)
+    convention = "IC" if "MTR" in rename else "BU"
 
     os.makedirs(os.path.dirname(output_filename), exist_ok=True)
     input_file = ROOT.TFile.Open(input_filename)
-    output_file = ROOT.TFile(output_filename, "RECREATE")
-
-    workspace = ROOT.RooWorkspace("combinedws")
-    workspace._safe_import = SafeWorkspaceImporter(workspace)
+    output_file = create_output_file(filename=output_filename, compression=compression)
 
     logger.info("Creating global observables")
-    sample_type = ROOT.RooCategory("bin_number", "Bin Number")
-    observed = ROOT.RooRealVar("observed", "Observed Events bin", 1)
-    safe_import(workspace=workspace, obj=sample_type)  # Global variables for dataset
-    safe_import(workspace=workspace, obj=observed)
+    workspace = create_combine_workspace()
+    common_kwargs = {"category": category, "variable": variable, "convention": convention, "pack_tf_stat": pack_tf_stat, "diagnostic_plots": diagnostic_plots}
 
     # Loop over control region definitions, and load their model definitions
-    diag = diagonalizer(workspace)
     cmb_categories = []
-    year = get_year_from_category(category=category)
-    for model_name in model_list:
-        module = __import__(model_name)
-        cr_dir = output_file.mkdir(f"{model_name}_category_{category}")
-        # The `cmodel` function is where models are created. This function does two things:
-        # 1) Compute transfer factors
-        #   Processes are express different processes as a ratio with of QCD Znunu in SR
-        #   For the qcd_zjets model, this is directly the ratio of the two processes
-        #   For other models, processes are first taken as a ratio with either EWK Znunu, QCD Wjets and EWK Wjets,
-        #   but these are later expressed as transfer factors to make QCD Znunu appear at the `init_channels` step
-        # 2) Add nuisances and add them to the workspace
-        #   for veto, JES/JER, theory and statistical uncertainties
-        #   for each transfer factor in the model
-        convention = "IC" if "MTR" in rename else "BU"
-        logger.info(f"Creating model for {model_name}")
-        model = module.cmodel(
-            category_id=category,
-            category_name=model_name,
-            input_file=input_file,
-            output_file=cr_dir,
-            output_workspace=workspace,
-            diagonalizer=diag,
-            year=year,
-            variable=variable,
-            convention=convention,
-        )
-        cmb_categories.append(model)
-        logger.info(f"Initializing model channels for model: {model.cname}, cat: {model.catid}")
-        # This is where the actual model distributions as a function of QCD Znunu in SR are made for all processes.
-        # Processes modelled with `qcd_zjets` are expressed as:
-        #   (process yield) * [transfer factor = (QCD Znunu in SR) / (process yield)] * Product of all nuisances
-        # Processes using the other models will first fetch the above model, before multiplying the transfer factor and nuisances
-        # For instance, EWK Zll in the diMuon region, modelled with `ewk_zjets` will fetch
-        #   (EWK Znunu in SR) * [transfer factor = (QCD Znunu in SR) / (EWK Znunu in SR)] * Product of all nuisances (for EWK Znunu in SR)
-        # and multiply by
-        #   [transfer factor = (EWK Znunu in SR) / (EWK Zll in diMuon)] * Product of all nuisances (for EWK Zll in diMuon)
-        # These models are made for each bin of the given variable distribution and saved to the workspace
-        model.init_channels()
+    if jobs > 1 and len(model_list) > 1:
+        with tempfile.TemporaryDirectory(prefix="partial_models_", dir=os.path.dirname(output_filename)) as tmp_dir:
+            partial_filenames = {model_name: os.path.join(tmp_dir, f"{model_name}.root") for model_name in model_list}
+            summaries = build_models_in_parallel(
+                model_list=model_list,
+                dependencies=dependencies,
+                partial_filenames=partial_filenames,
+                jobs=jobs,
+                input_filename=input_filename,
+                **common_kwargs,
+            )
+            # Merge in a fixed order, the objects shared between the partial workspaces are only imported once
+            for model_name in model_list:
+                logger.info(f"Merging model {model_name}")
+                partial_file = ROOT.TFile.Open(partial_filenames[model_name])
+                import_workspace(workspace=workspace, source=partial_file.Get("combinedws"))
+                dirname = f"{model_name}_category_{category}"
+                cr_dir = output_file.mkdir(dirname)
+                for key in partial_file.Get(dirname).GetListOfKeys():
+                    cr_dir.WriteTObject(key.ReadObj(), key.GetName())
+                partial_file.Close()
+                cmb_categories.append(summaries[model_name])
+    else:
+        diag = diagonalizer(workspace)
+        for model_name in model_list:
+            model = build_model(model_name=model_name, input_file=input_file, output_file=output_file, workspace=workspace, diag=diag, **common_kwargs)
+            cmb_categories.append(model)
 
     # Save pre-fit snapshot
     workspace.saveSnapshot("PRE_EXT_FIT_Clean", workspace.allVars())
@@ -135,12 +287,17 @@ def generate_combine_model(
 def main() -> None:
     """Main entry point for the script."""
     args = parse_args()
+    set_histogram_reader(args.reader)
     generate_combine_model(
         input_filename=args.input_filename,
         output_filename=args.output_filename,
         category=args.category,
         variable=args.variable,
         rename=args.rename,
+        compression=args.compression,
+        pack_tf_stat=args.pack_tf_stat,
+        diagnostic_plots=not args.no_diagnostic_plots,
+        jobs=args.jobs,
     )
 
 
@@ -2,22 +2,52 @@
 
 import os
 import re
+import hashlib
 import argparse
-from math import sqrt
-from typing import Optional
+from typing import Any, Optional
 from collections import defaultdict
-from collections.abc import Callable
+from collections.abc import Iterable, Iterator
+import numpy as np
 import ROOT  # type: ignore
 from HiggsAnalysis.CombinedLimit.ModelTools import SafeWorkspaceImporter  # type: ignore
 
 from utils.generic.general import rename_region, is_minor_bkg
+from utils.generic.array_hist import ArrayHist, multiply_histogram_by_function, prune_identity_variations, sum_array_hists
+from utils.generic.hist_utils import (
+    HISTOGRAM_READERS,
+    array_hist_to_th1,
+    pack_array_hists_to_th2,
+    read_array_hists,
+    read_array_hists_cached,
+    get_histogram_reader,
+    set_histogram_reader,
+)
 from utils.generic.logger import initialize_colorized_logger
 from utils.generic.colors import green
-from utils.workspace.generic import safe_import
+from utils.generic.parallelize import multi_process, multi_process_iter
+from utils.generic.file_utils import load_json, save_json
+from utils.workspace.generic import (
+    VARIATION_HISTOGRAM_MODES,
+    VARIATION_HISTOGRAM_MODE_KEY,
+    BulkImporter,
+    create_output_file,
+    get_variation_histograms_filename,
+    parse_compression,
+)
 from utils.workspace.uncertainties import get_shape_systematic_sources, get_qcd_variations_names
 
 logger = initialize_colorized_logger(log_level="INFO")
 
+# Mapping of nominal histogram name to the (variation name, multiplier) to apply to it, grouped by shapes source
+ShapePlan = dict[str, dict[str, list[tuple[str, ArrayHist]]]]
+
+# Output groups of each nominal histogram that are not related to a shapes source
+NOMINAL_GROUP = "nominal"
+PURITY_GROUP = "purity_fit"
+
+# Number of RooDataHists queued before they are imported into the workspace, a few MB for the usual binnings
+IMPORT_BATCH_SIZE = 1000
+
 # Load the Combine library (required for RooWorkspace manipulation)
 ROOT.gSystem.Load("libHiggsAnalysisCombinedLimit")
 
@@ -30,6 +60,22 @@ def parse_args():
     parser.add_argument("--category", type=str, required=True, help="Analysis category (e.g., 'vbf_2017').")
     parser.add_argument("--variable", type=str, default=None, help="Variable name to extract (default: 'mjj' for VBF, otherwise 'met').")
     parser.add_argument("--root_folder", type=str, default=None, help="Optional folder path inside the input ROOT file.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of processes used to compute the systematic variations.")
+    parser.add_argument("--incremental", action="store_true", help="Only recompute the outputs whose inputs changed since the previous build.")
+    parser.add_argument(
+        "--prune-tolerance", type=float, default=None, help="Do not write variations identical to the nominal within this relative tolerance (e.g. 1e-6)."
+    )
+    parser.add_argument("--pack-mc-stat", action="store_true", help="Store the merged MC statistical variations as packed TH2D histograms.")
+    parser.add_argument("--streaming", action="store_true", help="Write each histogram as soon as it is computed, to bound the memory usage.")
+    parser.add_argument("--reader", type=str, default="root", choices=HISTOGRAM_READERS, help="Library used to read the input and systematic histograms.")
+    parser.add_argument("--compression", type=parse_compression, default=None, help="Compression of the output file as <algorithm>:<level>, e.g. lz4:4 or zstd:5.")
+    parser.add_argument(
+        "--variation-histograms",
+        type=str,
+        default="main",
+        choices=VARIATION_HISTOGRAM_MODES,
+        help="Where to write the TH1 copies of the variations: with the nominal histograms, in a sidecar file, or nowhere.",
+    )
 
     args = parser.parse_args()
 
@@ -43,46 +89,24 @@ def parse_args():
     return args
 
 
-def ensure_nonzero_integral(hist: ROOT.TH1) -> None:
+def ensure_nonzero_integral(hist: ArrayHist) -> None:
     """Ensure the histogram has a non-zero integral.
 
     This is required by the Combine framework to avoid invalid likelihoods.
     If the histogram is empty, it sets the first bin to a small positive value.
     """
-    if hist.Integral() <= 0:
-        hist.SetBinContent(1, 1e-4)
+    if hist.integral() <= 0:
+        hist.values[1] = 1e-4
 
 
-def merge_overflow_into_last_bin(hist: ROOT.TH1) -> None:
+def merge_overflow_into_last_bin(hist: ArrayHist) -> None:
     """Move the overflow content into the last visible bin of the histogram."""
-    n_bins = hist.GetNbinsX()
-    overflow_content = hist.GetBinContent(n_bins + 1)
-    overflow_error = hist.GetBinError(n_bins + 1)
-    if overflow_content == 0 and overflow_error == 0:
+    if hist.values[-1] == 0 and hist.sumw2[-1] == 0:
         return
+    hist.merge_overflow()
 
-    last_bin_content = hist.GetBinContent(n_bins)
-    last_bin_error = hist.GetBinError(n_bins)
-    new_content = last_bin_content + overflow_content
-    new_error = sqrt(last_bin_error**2 + overflow_error**2)
-    hist.SetBinContent(n_bins, new_content)
-    hist.SetBinError(n_bins, new_error)
-    hist.SetBinContent(n_bins + 1, 0)
-    hist.SetBinError(n_bins + 1, 0)
 
-
-def multiply_histogram_by_function(histogram: ROOT.TH1, function: Callable[[float], float]) -> None:
-    """Apply a scaling function to the content and error of each bin in a histogram."""
-    for bin_idx in range(1, histogram.GetNbinsX() + 1):
-        bin_center = histogram.GetBinCenter(bin_idx)
-        scale = function(bin_center)
-        content = histogram.GetBinContent(bin_idx)
-        error = histogram.GetBinError(bin_idx)
-        histogram.SetBinContent(bin_idx, content * scale)
-        histogram.SetBinError(bin_idx, error * scale)
-
-
-def get_photon_id_variations(hist: ROOT.TH1, category: str) -> dict[str, ROOT.TH1]:
+def get_photon_id_variations(hist: ArrayHist, category: str) -> dict[str, ArrayHist]:
     """Get photon ID variations from file, returns all the varied histograms stored in a dictionary."""
     match = re.match(r".*(201[6-8]).*", category)
     if not match:
@@ -97,26 +121,22 @@ def get_photon_id_variations(hist: ROOT.TH1, category: str) -> dict[str, ROOT.TH
     }
 
     variations = {}
-    f_pho = ROOT.TFile(f"inputs/sys/{category}/photon_id_unc.root", "READ")
+    factors = read_array_hists_cached(filename=f"inputs/sys/{category}/photon_id_unc.root", names=list(name_map.values()))
     for variation, histo_name in name_map.items():
-        variation_name = f"{hist.GetName()}_{variation}"
-        varied_hist = hist.Clone(variation_name)
-        varied_hist.Multiply(f_pho.Get(histo_name))
-        varied_hist.SetDirectory(0)
-        variations[variation_name] = varied_hist
-    f_pho.Close()
+        variation_name = f"{hist.name}_{variation}"
+        variations[variation_name] = hist.multiply(factors[histo_name], name=variation_name)
     return variations
 
 
-def get_photon_qcd_variations(hist: ROOT.TH1, category: str) -> dict[str, ROOT.TH1]:
+def get_photon_qcd_variations(hist: ArrayHist, category: str) -> dict[str, ArrayHist]:
     """Create photon QCD purity fit variations based on category/year.
 
     Args:
-        hist (ROOT.TH1): The central histogram to vary.
+        hist (ArrayHist): The central histogram to vary.
         category (str): Category string containing the year (2016/17/18).
 
     Returns:
-        dict[str, ROOT.TH1]: Dictionary with Up and Down varied histograms.
+        dict[str, ArrayHist]: Dictionary with Up and Down varied histograms.
     """
     year = category.split("_")[-1]
 
@@ -134,216 +154,302 @@ def get_photon_qcd_variations(hist: ROOT.TH1, category: str) -> dict[str, ROOT.T
     unc = unc_dict[year]
 
     tag = f"purity_fit_{year}"
-    func_up = lambda x: 1 + (unc - 1) / 550 * (x - 250)
-    func_dn = lambda x: 1 - (unc - 1) / 550 * (x - 250)
+    formula_up = f"1 + {unc - 1} / 550 * (x - 250)"
+    formula_dn = f"1 - {unc - 1} / 550 * (x - 250)"
 
-    variations: dict[str, ROOT.TH1] = {}
-    for direction, func in [("Up", func_up), ("Down", func_dn)]:
-        variation_name = f"{hist.GetName()}_{tag}{direction}"
-        varied_hist = hist.Clone(variation_name)
-        varied_hist.SetDirectory(0)
-        multiply_histogram_by_function(histogram=varied_hist, function=func)
-        variations[variation_name] = varied_hist
+    variations: dict[str, ArrayHist] = {}
+    for direction, func in [("Up", formula_up), ("Down", formula_dn)]:
+        variation_name = f"{hist.name}_{tag}{direction}"
+        variations[variation_name] = multiply_histogram_by_function(histogram=hist, function=func, name=variation_name)
 
     return variations
 
 
-def add_histograms(histograms: list[ROOT.TH1], new_name: str) -> ROOT.TH1:
-    """Add a list of histograms into a new histogram with a given name."""
-    if not histograms:
-        logger.critical("Empty list provided to add_histograms", exception_cls=ValueError)
-
-    summed_hist = histograms[0].Clone(new_name)
-    summed_hist.SetDirectory(0)
-
-    for hist in histograms[1:]:
-        summed_hist.Add(hist)
+def compute_mergedMC_stat_templates(hists: list[ArrayHist], region: str, category: str) -> tuple[list[str], np.ndarray, dict[str, np.ndarray]]:
+    """Compute the autoMCstats-like per-bin variations of all the minor backgrounds of a region at once.
 
-    return summed_hist
+    The variation of bin `b` scales bin `b` of every background by the relative statistical
+    uncertainty of the merged background in that bin, leaving all the other bins untouched.
 
+    Args:
+        hists (list[ArrayHist]): MC background histograms of the region.
+        region (str): Region label (e.g. "Zmm").
+        category (str): Analysis category name (used for naming).
 
-def get_mergedMC_stat_variations(per_region_minor_backgrounds: dict[str, list[ROOT.TH1]], category: str) -> dict[str, ROOT.TH1]:
+    Returns:
+        tuple: Names of the systematics, the varied bin indices, and the Up and Down contents of shape (n_hists, n_systematics, nbins + 2).
+    """
+    merged_name = f"{rename_region(region)}_mergedMCBkg"
+    merged_hist = sum_array_hists(histograms=hists, name=merged_name)
+    contents, errors = merged_hist.values[1:-1], merged_hist.errors[1:-1]
+    if np.any(errors <= 0):
+        bin_idx = int(np.argmax(errors <= 0)) + 1
+        logger.critical(f"Please check why there is no error in the background prediction in bin {bin_idx} for {region}.", exception_cls=ValueError)
+
+    # Skip variation if central value is zero or negative
+    stat_bins = np.flatnonzero(contents > 0) + 1
+    relative_errors = errors[stat_bins - 1] / contents[stat_bins - 1]
+    systematics = [f"{merged_name}_{category}_stat_bin{bin_idx - 1}" for bin_idx in stat_bins]
+
+    values = np.stack([hist.values for hist in hists])
+    rows = np.arange(len(stat_bins))
+    templates = {}
+    for direction, ratios in [("Up", 1.0 + relative_errors), ("Down", np.maximum(0.0, 1.0 - relative_errors))]:
+        varied = np.repeat(values[:, np.newaxis, :], len(stat_bins), axis=1)
+        varied[:, rows, stat_bins] = np.maximum(0.0, values[:, stat_bins] * ratios)
+        templates[direction] = varied
+    return systematics, stat_bins, templates
+
+
+def iter_mergedMC_stat_variations(
+    per_region_minor_backgrounds: dict[str, list[ArrayHist]],
+    category: str,
+    prune_tolerance: Optional[float] = None,
+) -> Iterator[tuple[str, list[ArrayHist], list[str]]]:
     """Create autoMCstats-like per-bin statistical variation histograms for merged MC backgrounds.
 
+    The variation histograms are materialized one background at a time, so that they can be written and released in turn.
+
     Args:
         per_region_minor_backgrounds (dict): A mapping of region name to a list of MC background histograms.
         category (str): Analysis category name (used for naming).
+        prune_tolerance (Optional[float]): Relative tolerance below which variations identical to the nominal are dropped.
 
-    Returns:
-        dict: A dictionary mapping histogram names to ROOT.TH1 up/down variation histograms.
+    Yields:
+        tuple: Name of the background, its Up/Down variation histograms, and its pruned systematics.
     """
-    variations: dict[str, ROOT.TH1] = {}
-
     for region, hists in per_region_minor_backgrounds.items():
-        logger.info(f"Creating MCstat histograms for region = {region}, with histograms = {[h.GetName() for h in hists]}")
-        merged_name = f"{rename_region(region)}_mergedMCBkg"
-        merged_hist = add_histograms(histograms=hists, new_name=merged_name)
-
-        for bin_idx in range(1, merged_hist.GetNbinsX() + 1):
-            bin_content = merged_hist.GetBinContent(bin_idx)
-            bin_error = merged_hist.GetBinError(bin_idx)
-            if bin_error <= 0:
-                logger.critical(f"Please check why there is no error in the background prediction in bin {bin_idx} for {region}.", exception_cls=ValueError)
-
-            if bin_content <= 0:
-                continue  # Skip variation if central value is zero or negative
-
-            ratio_up = 1.0 + bin_error / bin_content
-            ratio_dn = max(0.0, 1.0 - bin_error / bin_content)
-
-            variation_base = f"{merged_name}_{category}_stat_bin{bin_idx-1}"
-
-            for hist in hists:
-                base_name = hist.GetName()
-                name_up = f"{base_name}_{variation_base}Up"
-                name_dn = f"{base_name}_{variation_base}Down"
-
-                h_up = hist.Clone(name_up)
-                h_up.SetDirectory(0)
-                content = hist.GetBinContent(bin_idx)
-                h_up.SetBinContent(bin_idx, max(0.0, content * ratio_up))
-                variations[name_up] = h_up
-                h_dn = hist.Clone(name_dn)
-                h_dn.SetDirectory(0)
-                h_dn.SetBinContent(bin_idx, max(0.0, content * ratio_dn))
-                variations[name_dn] = h_dn
-
-    return variations
+        logger.info(f"Creating MCstat histograms for region = {region}, with histograms = {[h.name for h in hists]}")
+        systematics, stat_bins, templates = compute_mergedMC_stat_templates(hists=hists, region=region, category=category)
+
+        # Only the varied bin differs from the nominal
+        identical = np.zeros((len(hists), len(systematics)), dtype=bool)
+        if prune_tolerance is not None:
+            nominal = np.stack([hist.values[stat_bins] for hist in hists])
+            rows = np.arange(len(stat_bins))
+            identical[:] = True
+            for varied in templates.values():
+                identical &= np.abs(varied[:, rows, stat_bins] - nominal) <= prune_tolerance * np.abs(nominal)
+
+        for hist_idx, hist in enumerate(hists):
+            variations, pruned = [], []
+            for syst_idx, systematic in enumerate(systematics):
+                if identical[hist_idx, syst_idx]:
+                    pruned.append(systematic)
+                    continue
+                for direction, varied in templates.items():
+                    name = f"{hist.name}_{systematic}{direction}"
+                    variations.append(ArrayHist(name=name, edges=hist.edges, values=varied[hist_idx, syst_idx], sumw2=hist.sumw2))
+            yield hist.name, variations, pruned
 
 
 def write_histogram_to_workspace(
-    hist: ROOT.TH1,
+    hist: ArrayHist,
     name: str,
     category: str,
-    workspace: ROOT.RooWorkspace,
-    output_dir: ROOT.TDirectory,
+    importer: BulkImporter,
+    output_dir: Optional[ROOT.TDirectory],
     observable: ROOT.RooRealVar,
 ) -> None:
-    """Convert histogram to RooDataHist and import into the workspace and ROOT output file."""
+    """Convert histogram to RooDataHist, queue it for import into the workspace and write it to the ROOT output directory, if any.
+
+    Without output directory, the RooDataHist is the only copy of the histogram and has no flow bins (see `roo_data_hist_to_th1`),
+    so the underflow and overflow bins of the histogram must be empty.
+    """
     logger.debug(f"Creating RooDataHist for {name}")
-    roo_hist = ROOT.RooDataHist(name, f"DataSet - {category}, {name}", ROOT.RooArgList(observable), hist)
-    msg_service = ROOT.RooMsgService.instance()
-    prev_level = msg_service.globalKillBelow()
-    msg_service.setGlobalKillBelow(ROOT.RooFit.WARNING)
-    safe_import(workspace=workspace, obj=roo_hist)
-    msg_service.setGlobalKillBelow(prev_level)
+    if output_dir is None and (hist.values[0] != 0 or hist.values[-1] != 0):
+        logger.critical(
+            f"{name} has non-empty flow bins, which would be lost without its TH1: use --variation-histograms main or sidecar.", exception_cls=ValueError
+        )
+    th1 = array_hist_to_th1(hist=hist, name=name)
+    roo_hist = ROOT.RooDataHist(name, f"DataSet - {category}, {name}", ROOT.RooArgList(observable), th1)
+    importer.add(roo_hist)
+    if output_dir is None:
+        return
 
     # Write the individual histograms for easy transfer factor calculation later on
-    hist.SetDirectory(0)
-    if not hist.GetSumw2N():
-        hist.Sumw2()
     output_dir.cd()
-    output_dir.WriteTObject(hist)
+    output_dir.WriteTObject(th1)
 
 
 def write_variations_to_workspace(
     variations: dict,
     category: str,
-    workspace: ROOT.RooWorkspace,
-    output_dir: ROOT.TDirectory,
+    importer: BulkImporter,
+    output_dir: Optional[ROOT.TDirectory],
     observable: ROOT.RooRealVar,
 ) -> None:
     """Write multiple histograms from a dictionary of variations into the workspace."""
     for name, hist in variations.items():
-        if not hist:
+        if hist is None:
             logger.critical(f"Null histogram for {name}", exception_cls=RuntimeError)
-        write_histogram_to_workspace(hist=hist, name=name, category=category, workspace=workspace, output_dir=output_dir, observable=observable)
+        write_histogram_to_workspace(hist=hist, name=name, category=category, importer=importer, output_dir=output_dir, observable=observable)
 
 
-def process_histogram(
-    hist: ROOT.TH1,
+def compute_histogram_variations(
+    hist: ArrayHist,
     category: str,
-    workspace: ROOT.RooWorkspace,
-    output_dir: ROOT.TDirectory,
-    observable: ROOT.RooRealVar,
-    per_region_minor_backgrounds: dict[str, list[ROOT.TH1]],
-    variable: str,
-) -> None:
-    """Process a single histogram by applying systematic variations and importing it into the workspace."""
-    name = hist.GetName()
+    shape_variations: dict[str, list[tuple[str, ArrayHist]]],
+    skip_groups: frozenset[str] = frozenset(),
+) -> dict[str, dict[str, ArrayHist]]:
+    """Compute the processed nominal histogram and all its systematic variations.
+
+    This only involves array arithmetic, so that it can run in worker processes.
+
+    Args:
+        hist (ArrayHist): The nominal input histogram.
+        category (str): Analysis category (e.g., "monojet_Run3").
+        shape_variations (dict[str, list[tuple[str, ArrayHist]]]): Planned (variation name, multiplier) shapes for this histogram, by source.
+        skip_groups (frozenset[str]): Output groups that do not need to be computed. The nominal is always computed.
+
+    Returns:
+        dict[str, dict[str, ArrayHist]]: Histograms to write, in order, grouped by origin and starting with the processed nominal.
+    """
+    name = hist.name
     logger.debug(f"Processing histogram: {name}")
-    common_kwargs = {"category": category, "workspace": workspace, "output_dir": output_dir, "observable": observable}
 
     ensure_nonzero_integral(hist=hist)
     merge_overflow_into_last_bin(hist=hist)
-    write_histogram_to_workspace(hist=hist, name=name, **common_kwargs)
+    groups = {NOMINAL_GROUP: {name: hist}}
 
     if "data" in name:
-        return
+        return groups
 
-    # Apply shapes variations
-    for source in get_shape_systematic_sources(category=category):
-        # Apply shape uncertainties to all histograms. The datacard will determine which processes are affected. TODO it can be potentially dangerous
-        apply_shapes(
-            hist=hist,
-            category=category,
-            variable=variable,
-            source=source,
-            workspace=workspace,
-            output_dir=output_dir,
-            observable=observable,
-        )
-    # MC stat
-    if is_minor_bkg(category=category, hname=name):
-        # for MC-based background, merge the stat unc into single nuisance
-        region, background = name.split("_")
-        logger.debug(f"Adding {background} as minor background for {region} region.")
-        per_region_minor_backgrounds[region].append(hist)
+    # Apply shapes variations resolved once for all histograms by `build_shape_plan`
+    for source, variations in shape_variations.items():
+        if source not in skip_groups:
+            groups[source] = get_shape_variations(hist=hist, shape_variations=variations)
 
     # Photon purity shape
-    if name == "gjets_qcd_estimate":
-        photon_qcd_vars = get_photon_qcd_variations(hist, category)
-        write_variations_to_workspace(variations=photon_qcd_vars, **common_kwargs)
+    if name == "gjets_qcd_estimate" and PURITY_GROUP not in skip_groups:
+        groups[PURITY_GROUP] = get_photon_qcd_variations(hist, category)
 
-    return
+    return groups
 
 
-def apply_shapes(
-    hist: ROOT.TH1,
-    category: str,
-    variable: str,
-    source: str,
-    workspace: ROOT.RooWorkspace,
-    output_dir: ROOT.TDirectory,
-    observable: ROOT.RooRealVar,
+def compute_group_hashes(hist: ArrayHist, category: str, shape_variations: dict[str, list[tuple[str, ArrayHist]]]) -> dict[str, str]:
+    """Return a content hash for each output group of a nominal histogram, before any processing.
+
+    The groups match the ones produced by `compute_histogram_variations`.
+    """
+    nominal_hash = hist.digest()
+    hashes = {NOMINAL_GROUP: nominal_hash}
+    if "data" in hist.name:
+        return hashes
+    for source, variations in shape_variations.items():
+        hash_sha = hashlib.sha256(nominal_hash.encode())
+        for variation_name, multiplier in variations:
+            hash_sha.update(variation_name.encode())
+            hash_sha.update(multiplier.digest().encode())
+        hashes[source] = hash_sha.hexdigest()
+    if hist.name == "gjets_qcd_estimate":
+        hashes[PURITY_GROUP] = hashlib.sha256(f"{nominal_hash}_{category}".encode()).hexdigest()
+    return hashes
+
+
+def get_manifest_filename(output_filename: str) -> str:
+    """Return the path of the sidecar manifest of a workspace file."""
+    return re.sub(r"\.root$", "", output_filename) + ".manifest.json"
+
+
+def get_pruning_report_filename(output_filename: str) -> str:
+    """Return the path of the report of the variations pruned from a workspace file."""
+    return re.sub(r"\.root$", "", output_filename) + ".pruned.json"
+
+
+def copy_previous_outputs(
+    names: list[str],
+    previous_dir: Optional[ROOT.TDirectory],
+    previous_workspace: ROOT.RooWorkspace,
+    importer: BulkImporter,
+    output_dir: Optional[ROOT.TDirectory],
 ) -> None:
+    """Copy unchanged RooDataHists and histograms from a previous build of the workspace.
+
+    The histograms are only copied if `output_dir` is given, from `previous_dir` where the previous build wrote them.
+    """
+    for name in names:
+        roo_hist = previous_workspace.data(name)
+        hist = previous_dir.Get(name) if output_dir is not None else None
+        if not roo_hist or (output_dir is not None and not hist):
+            logger.critical(f"Could not find {name} in the previous workspace, please run a full rebuild.", exception_cls=RuntimeError)
+        importer.add(roo_hist)
+        if output_dir is None:
+            continue
+        output_dir.cd()
+        output_dir.WriteTObject(hist)
 
-    name = hist.GetName()
 
-    shapes_filename = f"inputs/sys/{variable}/{category}/shapes_{source}.root"
-    shapes_file = ROOT.TFile.Open(shapes_filename, "READ")
-    logger.debug(f"Applying {source} shapes to histogram {name} and saving to workspace.")
-    common_kwargs = {"category": category, "workspace": workspace, "output_dir": output_dir, "observable": observable}
+def resolve_shape_variation_name(source: str, varname: str, name: str) -> Optional[str]:
+    """Return the name of the variation of histogram `name` built from key `varname` of the `source` shapes file.
 
-    # Apply shape variations to nominal histograms, and save to the workspace.
-    for key in shapes_file.GetListOfKeys():
-        obj = key.ReadObj()
-        varname = key.GetName()
-        if "_over_" in varname:
-            continue
-        if "qcd_estimate_closure" in source and ("signal_qcd_estimate" not in name or "syst" not in varname):
-            continue
-        if "id_shapes" in source:
-            if varname[: varname.find("CMS")] not in name:
-                continue
+    Returns None if the shape does not apply to the histogram.
+    """
+    if "_over_" in varname:
+        return None
+    if "qcd_estimate_closure" in source and ("signal_qcd_estimate" not in name or "syst" not in varname):
+        return None
+    if "id_shapes" in source:
+        if varname[: varname.find("CMS")] not in name:
+            return None
+        varname = varname[varname.find("CMS") :]
+    variation_name = f"{name}_{varname}"
+    if "jecs" in source or "btag" in source:
+        if ("top" in varname) ^ ("top" in name):
+            return None
+        if "btag" in source and "top" in name and name not in varname:
+            return None
+        if "btag" in source:
             varname = varname[varname.find("CMS") :]
-        variation_name = f"{name}_{varname}"
-        if "jecs" in source or "btag" in source:
-            if ("top" in varname) ^ ("top" in name):
-                continue
-            if "btag" in source and "top" in name and name not in varname:
+        variation_name = f"{name}_{varname.replace('top_','').replace('others_','')}"
+    return variation_name
+
+
+def load_shape_multipliers(shapes_filename: str) -> dict[str, ArrayHist]:
+    """Read all multiplicative shape histograms from a shapes file into arrays."""
+    try:
+        return read_array_hists_cached(filename=shapes_filename)
+    except OSError:
+        logger.critical(f"Could not open shapes file: {shapes_filename}", exception_cls=IOError)
+
+
+def build_shape_plan(names: list[str], category: str, variable: str) -> ShapePlan:
+    """Resolve, for every nominal histogram, the list of shape variations to apply.
+
+    Each shapes file under `inputs/sys/<variable>/<category>` is read once, and the naming rules
+    of each source are evaluated once per (histogram, key) pair.
+
+    Args:
+        names (list[str]): Names of the nominal histograms.
+        category (str): Analysis category (e.g., "monojet_Run3").
+        variable (str): Observable variable (e.g., mjj, recoil).
+
+    Returns:
+        ShapePlan: Mapping of nominal histogram name to the lists of (variation name, multiplier) of each source.
+    """
+    plan: ShapePlan = defaultdict(dict)
+    # Shapes are applied to all histograms. The datacard will determine which processes are affected. TODO it can be potentially dangerous
+    for source in get_shape_systematic_sources(category=category):
+        shapes_filename = f"inputs/sys/{variable}/{category}/shapes_{source}.root"
+        logger.debug(f"Loading {source} shapes from {shapes_filename}.")
+        multipliers = load_shape_multipliers(shapes_filename=shapes_filename)
+        for name in names:
+            if "data" in name:
                 continue
-            if "btag" in source:
-                varname = varname[varname.find("CMS") :]
-            variation_name = f"{name}_{varname.replace('top_','').replace('others_','')}"
-        logger.debug(f"Applying shape {varname} to histogram {name} as {variation_name}.")
-        varied_hist = hist.Clone(variation_name)
-        varied_hist.SetDirectory(0)
-        # Only one set of shapes for all process (copied from QCD Z(nunu) in signal region)
-        varied_hist.Multiply(obj)
-        write_histogram_to_workspace(hist=varied_hist, name=variation_name, **common_kwargs)
+            for varname, multiplier in multipliers.items():
+                variation_name = resolve_shape_variation_name(source=source, varname=varname, name=name)
+                if variation_name is None:
+                    continue
+                logger.debug(f"Planning shape {varname} for histogram {name} as {variation_name}.")
+                plan[name].setdefault(source, []).append((variation_name, multiplier))
+    return plan
+
 
-    shapes_file.Close()
+def get_shape_variations(hist: ArrayHist, shape_variations: list[tuple[str, ArrayHist]]) -> dict[str, ArrayHist]:
+    """Apply the planned shape variations to a nominal histogram."""
+    logger.debug(f"Applying {len(shape_variations)} shapes to histogram {hist.name}.")
+    # Only one set of shapes for all process (copied from QCD Z(nunu) in signal region)
+    return {variation_name: hist.multiply(multiplier, name=variation_name) for variation_name, multiplier in shape_variations}
 
 
 def create_workspace(
@@ -352,23 +458,98 @@ def create_workspace(
     category: str,
     variable: str,
     root_folder: Optional[str] = None,
+    jobs: int = 1,
+    incremental: bool = False,
+    prune_tolerance: Optional[float] = None,
+    pack_mc_stat: bool = False,
+    streaming: bool = False,
+    compression: Optional[int] = None,
+    variation_histograms: str = "main",
 ) -> None:
     """Create a RooWorkspace and fill it with histograms from the input ROOT file.
 
+    A sidecar manifest records a content hash of every (input histogram, shapes source) pair.
+    In incremental mode, the outputs of unchanged pairs are copied from the previous workspace
+    file instead of being recomputed. The merged MC statistical variations are always recomputed.
+
+    With a pruning tolerance, Up/Down pairs identical to their nominal are not written, and are
+    listed in a sidecar report read by `DatacardBuilder` to drop them from the card.
+
+    Every histogram is stored as a RooDataHist in the workspace, and as a plain TH1 next to it. Only the
+    nominal TH1s are needed to build the transfer factors, so the TH1 copies of the variations can instead
+    be written to a sidecar file or skipped. The mode is recorded in the output file for
+    `convert_to_combine_workspace`, which rebuilds the skipped histograms from the RooDataHists.
+
     Args:
         input_filename (str): Path to the input ROOT file.
         output_filename (str): Path to save the RooWorkspace.
         category (str): Analysis category (e.g., "vbf_2017").
         variable (str): Observable variable (e.g., mjj, met).
         root_folder (Optional[str]): Subdirectory inside the input ROOT file.
+        jobs (int): Number of worker processes computing the variations. The output does not depend on it.
+        incremental (bool): Reuse unchanged outputs of the previous build of `output_filename`.
+        prune_tolerance (Optional[float]): Relative tolerance to the nominal below which variations are pruned. Disabled if None.
+        pack_mc_stat (bool): Store the merged MC statistical variations of each background as two TH2D instead of one TH1D and RooDataHist per bin.
+        streaming (bool): Write the variations of each input histogram as soon as they are computed, to bound the memory usage.
+            The RooWorkspace itself is only written at the end, so its RooDataHists are still kept in memory.
+        compression (Optional[int]): ROOT compression setting of the output file (see `parse_compression`). ROOT default if None.
+        variation_histograms (str): Where the TH1 copies of the variations are written, one of `VARIATION_HISTOGRAM_MODES`:
+            "main" next to the nominal ones, "sidecar" in `get_variation_histograms_filename(output_filename)`, or "skip".
     """
     os.makedirs(os.path.dirname(output_filename), exist_ok=True)
 
-    input_file = ROOT.TFile(input_filename, "READ")
-    output_file = ROOT.TFile(output_filename, "RECREATE")
-
-    input_dir = input_file if root_folder is None else input_file.Get(root_folder)
+    manifest_filename = get_manifest_filename(output_filename)
+    previous_filename = f"{output_filename}.prev"
+    variations_filename = get_variation_histograms_filename(output_filename)
+    previous_variations_filename = f"{variations_filename}.prev"
+    previous_manifest: dict[str, Any] = {}
+    if incremental and os.path.isfile(output_filename) and os.path.isfile(manifest_filename):
+        previous_manifest = load_json(manifest_filename)
+        previous_settings = (
+            previous_manifest.get("category"),
+            previous_manifest.get("variable"),
+            previous_manifest.get("prune_tolerance"),
+            previous_manifest.get("variation_histograms", "main"),
+        )
+        if variation_histograms == "sidecar" and not os.path.isfile(variations_filename):
+            logger.warning(f"No previous variation histograms file found for {output_filename}, running a full rebuild.")
+            previous_manifest = {}
+        elif previous_settings != (category, variable, prune_tolerance, variation_histograms):
+            logger.warning(
+                f"Manifest {manifest_filename} does not match the current category, variable, pruning tolerance or variation histograms mode, running a full rebuild."
+            )
+            previous_manifest = {}
+        else:
+            os.replace(output_filename, previous_filename)
+            if variation_histograms == "sidecar":
+                os.replace(variations_filename, previous_variations_filename)
+    elif incremental:
+        logger.warning(f"No previous workspace or manifest found for {output_filename}, running a full rebuild.")
+
+    output_file = create_output_file(filename=output_filename, compression=compression)
     output_dir = output_file.mkdir(f"category_{category}")
+    output_dir.WriteTObject(ROOT.TNamed(VARIATION_HISTOGRAM_MODE_KEY, variation_histograms))
+
+    # Directory of the TH1 copies of the variations, None if they are skipped
+    variations_file, variations_dir = None, None
+    if variation_histograms == "main":
+        variations_dir = output_dir
+    elif variation_histograms == "sidecar":
+        variations_file = create_output_file(filename=variations_filename, compression=compression)
+        variations_dir = variations_file.mkdir(f"category_{category}")
+    elif os.path.isfile(variations_filename):
+        os.remove(variations_filename)
+
+    previous_file, previous_dir, previous_workspace = None, None, None
+    previous_variations_file, previous_variations_dir = None, None
+    if previous_manifest:
+        previous_file = ROOT.TFile(previous_filename, "READ")
+        previous_dir = previous_file.Get(f"category_{category}")
+        previous_workspace = previous_dir.Get(f"wspace_{category}")
+        previous_variations_dir = previous_dir if variation_histograms == "main" else None
+        if variation_histograms == "sidecar":
+            previous_variations_file = ROOT.TFile(previous_variations_filename, "READ")
+            previous_variations_dir = previous_variations_file.Get(f"category_{category}")
 
     workspace = ROOT.RooWorkspace(f"wspace_{category}", f"wspace_{category}")
     workspace._safe_import = SafeWorkspaceImporter(workspace)
@@ -377,50 +558,159 @@ def create_workspace(
 
     # Loop through all histograms in the input file and add them to the work space.
     logger.info(green("Adding histograms to workspace..."))
-    per_region_minor_backgrounds: dict[str, list[ROOT.TH1]] = defaultdict(list)
+    per_region_minor_backgrounds: dict[str, list[ArrayHist]] = defaultdict(list)
 
-    for key in input_dir.GetListOfKeys():
-        obj = key.ReadObj()
-        if not isinstance(obj, (ROOT.TH1D, ROOT.TH1F)):
-            continue
-        process_histogram(
-            hist=obj,
-            category=category,
-            workspace=workspace,
-            output_dir=output_dir,
-            observable=observable,
-            per_region_minor_backgrounds=per_region_minor_backgrounds,
-            variable=variable,
-        )
+    logger.info(green(f"Reading input histograms with {get_histogram_reader()}..."))
+    histograms = list(read_array_hists(filename=input_filename, folder=root_folder).values())
+
+    logger.info(green("Resolving shape variations..."))
+    shape_plan = build_shape_plan(names=[hist.name for hist in histograms], category=category, variable=variable)
+
+    # Find the output groups that are unchanged since the previous build
+    hashes = {hist.name: compute_group_hashes(hist=hist, category=category, shape_variations=shape_plan.get(hist.name, {})) for hist in histograms}
+    previous_entries = previous_manifest.get("histograms", {})
+    reused_groups = {
+        name: frozenset(group for group, group_hash in group_hashes.items() if previous_entries.get(name, {}).get(group, {}).get("hash") == group_hash)
+        for name, group_hashes in hashes.items()
+    }
+    if previous_manifest:
+        n_reused = sum(len(groups) for groups in reused_groups.values())
+        n_total = sum(len(group_hashes) for group_hashes in hashes.values())
+        logger.info(green(f"Reusing {n_reused} out of {n_total} (histogram, source) outputs from the previous build."))
+
+    # Variations are computed independently for each histogram, possibly in worker processes,
+    # and imported in the order of the input keys so that the output does not depend on `jobs`.
+    # In streaming mode, the variations of each histogram are written and released before the next ones are computed.
+    arglist = [
+        {"hist": hist, "category": category, "shape_variations": shape_plan.get(hist.name, {}), "skip_groups": reused_groups[hist.name]}
+        for hist in histograms
+    ]
+    del histograms
+    results: Iterable[dict[str, dict[str, ArrayHist]]]
+    if jobs > 1:
+        logger.info(green(f"Computing variations with {jobs} processes..."))
+        if streaming:
+            results = multi_process_iter(func=compute_histogram_variations, arglist=arglist, ncores=jobs)
+        else:
+            results = multi_process(func=compute_histogram_variations, arglist=arglist, ncores=jobs)
+    elif streaming:
+        results = (compute_histogram_variations(**kwargs) for kwargs in arglist)
+    else:
+        results = [compute_histogram_variations(**kwargs) for kwargs in arglist]
+
+    # RooDataHists are imported in bulk, in batches of IMPORT_BATCH_SIZE to bound the size of the queue
+    importer = BulkImporter(workspace=workspace, batch_size=IMPORT_BATCH_SIZE)
+    common_kwargs = {"category": category, "importer": importer, "observable": observable}
+    manifest_entries: dict[str, dict[str, Any]] = {}
+    pruned_variations: dict[str, list[str]] = defaultdict(list)
+    for groups in results:
+        name, nominal = next(iter(groups[NOMINAL_GROUP].items()))
+        manifest_entries[name] = {}
+        for group, group_hash in hashes[name].items():
+            is_nominal = group == NOMINAL_GROUP
+            if group in reused_groups[name]:
+                outputs = previous_entries[name][group]["outputs"]
+                pruned = previous_entries[name][group].get("pruned", [])
+                copy_previous_outputs(
+                    names=outputs,
+                    previous_dir=previous_dir if is_nominal else previous_variations_dir,
+                    previous_workspace=previous_workspace,
+                    importer=importer,
+                    output_dir=output_dir if is_nominal else variations_dir,
+                )
+            else:
+                variations, pruned = groups[group], []
+                if prune_tolerance is not None and not is_nominal:
+                    variations, pruned_by_nominal = prune_identity_variations(variations=variations, nominals={name: nominal}, tolerance=prune_tolerance)
+                    pruned = pruned_by_nominal.get(name, [])
+                outputs = list(variations.keys())
+                write_variations_to_workspace(variations=variations, output_dir=output_dir if is_nominal else variations_dir, **common_kwargs)
+            manifest_entries[name][group] = {"hash": group_hash, "outputs": outputs, "pruned": pruned}
+            pruned_variations[name].extend(pruned)
+        # Only the processed nominal is kept, for the merged MC statistical variations
+        del groups
+
+        # MC stat
+        if "data" not in name and is_minor_bkg(category=category, hname=name):
+            # for MC-based background, merge the stat unc into single nuisance
+            region, background = name.split("_")
+            logger.debug(f"Adding {background} as minor background for {region} region.")
+            per_region_minor_backgrounds[region].append(nominal)
 
     # now do the merging of MC-based bkg
-    stat_variations = get_mergedMC_stat_variations(per_region_minor_backgrounds, category)
-    write_variations_to_workspace(
-        variations=stat_variations,
-        category=category,
-        workspace=workspace,
-        output_dir=output_dir,
-        observable=observable,
-    )
+    for name, variations, pruned in iter_mergedMC_stat_variations(per_region_minor_backgrounds, category, prune_tolerance=prune_tolerance):
+        pruned_variations[name].extend(pruned)
+        if pack_mc_stat:
+            # The packed histograms are unpacked when building the combined model.
+            # They are the only copy of these variations, so they are written even if the variation TH1s are skipped.
+            packed_dir = variations_dir or output_dir
+            for direction in ["Up", "Down"]:
+                hists = [hist for hist in variations if hist.name.endswith(direction)]
+                if not hists:
+                    continue
+                packed = pack_array_hists_to_th2(hists=hists, name=f"{name}_mergedMCBkg_stat_packed{direction}")
+                packed_dir.cd()
+                packed_dir.WriteTObject(packed)
+        else:
+            write_variations_to_workspace(variations={hist.name: hist for hist in variations}, output_dir=variations_dir, **common_kwargs)
+    importer.flush()
 
     # Finalize workspace and close files
     output_dir.cd()
     output_dir.WriteTObject(workspace)
     output_dir.Write()
     output_file.Write()
-    input_file.Close()
     output_file.Close()
+    if variations_file is not None:
+        variations_file.Write()
+        variations_file.Close()
+
+    if previous_file is not None:
+        previous_file.Close()
+        os.remove(previous_filename)
+    if previous_variations_file is not None:
+        previous_variations_file.Close()
+        os.remove(previous_variations_filename)
+
+    manifest = {
+        "category": category,
+        "variable": variable,
+        "prune_tolerance": prune_tolerance,
+        "variation_histograms": variation_histograms,
+        "input_filename": input_filename,
+        "histograms": manifest_entries,
+    }
+    save_json(file_path=manifest_filename, content=manifest, sort_keys=False)
+
+    report_filename = get_pruning_report_filename(output_filename)
+    if prune_tolerance is not None:
+        pruned_variations = {name: pruned for name, pruned in pruned_variations.items() if pruned}
+        n_pruned = sum(len(pruned) for pruned in pruned_variations.values())
+        logger.info(green(f"Pruned {n_pruned} variation pairs identical to their nominal, see {report_filename}."))
+        report = {"category": category, "tolerance": prune_tolerance, "pruned": pruned_variations}
+        save_json(file_path=report_filename, content=report, sort_keys=True)
+    elif os.path.isfile(report_filename):
+        # Do not leave a stale report behind, the card would miss the variations written by this build
+        os.remove(report_filename)
 
 
 def main() -> None:
     """Main entry point for the script."""
     args = parse_args()
+    set_histogram_reader(args.reader)
     create_workspace(
         input_filename=args.input_filename,
         output_filename=args.output_filename,
         category=args.category,
         root_folder=args.root_folder,
         variable=args.variable,
+        jobs=args.jobs,
+        incremental=args.incremental,
+        prune_tolerance=args.prune_tolerance,
+        pack_mc_stat=args.pack_mc_stat,
+        streaming=args.streaming,
+        compression=args.compression,
+        variation_histograms=args.variation_histograms,
     )
 
 
@@ -1,12 +1,45 @@
 import ROOT  # type:ignore
+import numpy as np
 from typing import Any
 from counting_experiment import Category, Channel
 from utils.generic.logger import initialize_colorized_logger
+from utils.generic.array_hist import ArrayHist
+from utils.generic.hist_utils import th1_to_array_hist, array_hist_to_th1, pack_array_hists_to_th2, read_array_hists_cached
 from utils.workspace.uncertainties import get_veto_unc, get_jes_variations_names, get_id_variations_names
 
 logger = initialize_colorized_logger(log_level="INFO")
 
 
+class VariationRegistry:
+    """Keep the variations of the transfer factors in memory, and write them to the output directory as an artifact.
+
+    The variations are passed directly to `Channel.add_nuisance_shape` instead of being read back from the output file.
+    They are queued until `flush`, which writes them and releases the queue. Only their names are kept afterwards,
+    to reject duplicates.
+    """
+
+    def __init__(self, output_dir: ROOT.TDirectory) -> None:
+        self.output_dir = output_dir
+        self._names: set[str] = set()
+        self._queue: list[ROOT.TH1] = []
+
+    def add(self, hist: ROOT.TH1) -> ROOT.TH1:
+        """Register a variation, detached from any directory so that it lives until it is written."""
+        name = hist.GetName()
+        if name in self._names:
+            raise RuntimeError(f"Variation '{name}' is already registered.")
+        hist.SetDirectory(0)
+        self._names.add(name)
+        self._queue.append(hist)
+        return hist
+
+    def flush(self) -> None:
+        """Write all queued variations to the output directory, in the order they were added, and empty the queue."""
+        for hist in self._queue:
+            self.output_dir.WriteTObject(hist)
+        self._queue.clear()
+
+
 def define_model(
     category_id: str,
     category_name: str,
@@ -26,6 +59,7 @@ def define_model(
     jes_jer_channel_list: list[str],
     region_names: dict[str, str],
     do_monojet_theory: bool = False,
+    pack_tf_stat: bool = False,
 ):
     """
     Defines a statistical model for a given category using transfer factors.
@@ -57,6 +91,8 @@ def define_model(
         veto_dict (dict[str, float]): Dictionary of veto nuisance values.
         jes_jer_channel_list (list[str]): Channels where JES/JER uncertainties are applied.
         region_names (dict[str, str]): Mapping of transfer factor labels to region names.
+        do_monojet_theory (bool): Whether to apply the monojet theory uncertainties.
+        pack_tf_stat (bool): Store the statistical variations of the transfer factors as packed TH2D.
 
     Returns:
         Category: A `Category` object encapsulating the defined model.
@@ -81,6 +117,9 @@ def define_model(
         output_file=output_file,
     )
 
+    # Variations of the transfer factors are passed in memory to the channels, and written to the output file at the end
+    registry = VariationRegistry(output_dir=output_file)
+
     # Create a `Channel` object for each transfer factor
     CRs = define_channels(
         transfer_factors=transfer_factors,
@@ -98,7 +137,7 @@ def define_model(
         channel_list=veto_channel_list,
         model_name=model_name,
         category_id=category_id,
-        output_file=output_file,
+        registry=registry,
         syst_folder=common_syst_folder,
         year=year,
     )
@@ -107,7 +146,7 @@ def define_model(
         channel_objects=CRs,
         channel_list=trigger_channel_list,
         category_id=category_id,
-        output_file=output_file,
+        registry=registry,
         syst_folder=common_syst_folder,
         year=year,
     )
@@ -118,7 +157,7 @@ def define_model(
         channel_list=samples_map.keys(),
         year=year,
         category_id=category_id,
-        output_file=output_file,
+        registry=registry,
         syst_folder=common_syst_folder,
         model_name=model_name,
     )
@@ -129,7 +168,7 @@ def define_model(
         channel_list=jes_jer_channel_list,
         year=year,
         category_id=category_id,
-        output_file=output_file,
+        registry=registry,
         model_name=model_name,
         syst_folder=common_syst_folder,
     )
@@ -139,13 +178,21 @@ def define_model(
             transfer_factors=transfer_factors,
             channel_objects=CRs,
             category_id=category_id,
-            output_file=output_file,
+            registry=registry,
             syst_folder=common_syst_folder,
             model_name=model_name,
         )
 
     # Add Bin by bin nuisances to cover statistical uncertainties
-    do_stat_unc(transfer_factors=transfer_factors, channel_objects=CRs, region_names=region_names, category_id=category_id, output_file=output_file)
+    do_stat_unc(
+        transfer_factors=transfer_factors,
+        channel_objects=CRs,
+        region_names=region_names,
+        category_id=category_id,
+        registry=registry,
+        pack_tf_stat=pack_tf_stat,
+    )
+    registry.flush()
 
     # Extract the bin edges of the distribution
     bin_edges = [target.GetBinLowEdge(b + 1) for b in range(target.GetNbinsX() + 1)]
@@ -248,7 +295,7 @@ def add_veto_nuisances(
     channel_list: list[str],
     model_name: str,
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     syst_folder: str,
     year: str,
 ) -> None:
@@ -274,7 +321,7 @@ def add_veto_nuisances(
                     transfer_factors=transfer_factors,
                     channel_objects=channel_objects,
                     category_id=category_id,
-                    output_file=output_file,
+                    registry=registry,
                     sample=channel,
                     param_name=veto_name,
                     unc_file_name=unc_file_name,
@@ -292,7 +339,7 @@ def add_shape_nuisances(
     transfer_factors: dict[str, Any],
     channel_objects: dict[str, Channel],
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     sample: str,
     param_name: str,
     unc_file_name: str,
@@ -305,21 +352,22 @@ def add_shape_nuisances(
         transfer_factors (dict[str, ROOT.TH1]): Dictionary mapping transfer factors labels to their distributions.
         channel_objects (dict[str, Channel]): Dictionary of `Channel` objects.
         category_id (str): Unique identifier for the category.
-        output_file (ROOT.TFile): Output ROOT file for storing variations.
+        registry (VariationRegistry): Registry of the variations of the transfer factors.
         sample: (str): Name of sample to which the systematic should be applied to.
         param_name: (str): Name of the nuisance parameter to add to the model.
         unc_file_name: (str): Name of the root file where the systematic uncertainties are stored.
         hist_basename: (str): Name of the histogram to load that contains the relative systematic uncertainty.
     """
-    unc_file = ROOT.TFile(unc_file_name)
-    for direction in ["Up", "Down"]:
-        # Scale transfer factor by relative variation and write to output file
+    directions = ["Up", "Down"]
+    factors = read_array_hists_cached(filename=unc_file_name, names=[f"{hist_basename}{direction}" for direction in directions])
+    variations = {}
+    for direction in directions:
+        # Scale transfer factor by relative variation and register it
         unc_name = f"{hist_basename}{direction}"
         new_name = get_weight_name(sample=sample, category_id=category_id, param_name=param_name, direction=direction)
-        add_variation(nominal=transfer_factors[sample], unc_file=unc_file, unc_name=unc_name, new_name=new_name, outfile=output_file)
+        variations[direction] = add_variation(nominal=transfer_factors[sample], factor=factors[unc_name], new_name=new_name, registry=registry)
     # Add function (quadratic) to model the nuisance
-    channel_objects[sample].add_nuisance_shape(name=param_name, file=output_file, functype=functype)
-    unc_file.Close()
+    channel_objects[sample].add_nuisance_shape(name=param_name, sysup=variations["Up"], sysdn=variations["Down"], functype=functype)
 
 
 def add_trigger_nuisances(
@@ -327,7 +375,7 @@ def add_trigger_nuisances(
     channel_objects: dict[str, Channel],
     channel_list: list[str],
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     syst_folder: str,
     year: str,
 ) -> None:
@@ -340,7 +388,7 @@ def add_trigger_nuisances(
             transfer_factors=transfer_factors,
             channel_objects=channel_objects,
             category_id=category_id,
-            output_file=output_file,
+            registry=registry,
             sample=sample,
             param_name=param_name,
             unc_file_name=unc_file_name,
@@ -354,7 +402,7 @@ def add_id_nuisances(
     channel_list: list[str],
     year: str,
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     syst_folder: str,
     model_name: str,
 ) -> None:
@@ -369,7 +417,7 @@ def add_id_nuisances(
                 transfer_factors=transfer_factors,
                 channel_objects=channel_objects,
                 category_id=category_id,
-                output_file=output_file,
+                registry=registry,
                 sample=sample,
                 param_name=param_name,
                 unc_file_name=unc_file_name,
@@ -383,7 +431,7 @@ def add_jes_jer_uncertainties(
     channel_list: list[str],
     year: str,
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     model_name: str,
     syst_folder: str,
 ) -> None:
@@ -398,7 +446,7 @@ def add_jes_jer_uncertainties(
                 transfer_factors=transfer_factors,
                 channel_objects=channel_objects,
                 category_id=category_id,
-                output_file=output_file,
+                registry=registry,
                 sample=sample,
                 param_name=param_name,
                 unc_file_name=unc_file_name,
@@ -410,7 +458,7 @@ def add_monojet_theory_uncertainties(
     transfer_factors: dict[str, ROOT.TH1],
     channel_objects: dict[str, Channel],
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
     syst_folder: str,
     model_name: str,
 ) -> None:
@@ -455,7 +503,7 @@ def add_monojet_theory_uncertainties(
                     transfer_factors=transfer_factors,
                     channel_objects=channel_objects,
                     category_id=category_id,
-                    output_file=output_file,
+                    registry=registry,
                     sample=sample,
                     param_name=param_name,
                     unc_file_name=unc_file_name,
@@ -482,7 +530,7 @@ def add_monojet_theory_uncertainties(
             transfer_factors=transfer_factors,
             channel_objects=channel_objects,
             category_id=category_id,
-            output_file=output_file,
+            registry=registry,
             sample=sample,
             param_name=hist_basename,
             unc_file_name=pdf_file_name,
@@ -495,41 +543,72 @@ def do_stat_unc(
     channel_objects: dict[str, Channel],
     region_names: dict[str, str],
     category_id: str,
-    output_file: ROOT.TFile,
+    registry: VariationRegistry,
+    pack_tf_stat: bool = False,
 ) -> None:
-    """Add stat. unc. variations to the workspace"""
+    """Add stat. unc. variations to the workspace, one lognormal nuisance per bin of each transfer factor.
+
+    The kappas of all bins are computed at once from the bin contents and errors, and passed directly to `Channel.add_bin_nuisances`.
+    The Up and Down variations are still written as an artifact, either as one TH1 per bin and direction,
+    or with `pack_tf_stat` as the rows of one TH2D per direction (see `pack_array_hists_to_th2`).
+    The bins where a transfer factor is not positive are all reported at once, before any variation is made.
+    """
+    nominals = {sample: th1_to_array_hist(histogram) for sample, histogram in transfer_factors.items()}
+
+    # Safety
+    # if (content <= 0) or (err / content < 0.001):
+    problems = [
+        f"  - {nominal.name} in bin {b + 1}: content = {nominal.values[b + 1]}, error = {nominal.errors[b + 1]}"
+        for nominal in nominals.values()
+        for b in np.flatnonzero(nominal.values[1:-1] <= 0)
+    ]
+    if problems:
+        report = "\n".join(problems)
+        logger.critical(f"Undefined behaviour for non-positive transfer factors in category {category_id}:\n{report}", exception_cls=ValueError)
 
     for sample, histogram in transfer_factors.items():
-        # Add one variation per bin
         region = region_names[sample]
-        for b in range(1, histogram.GetNbinsX() + 1):
-            err = histogram.GetBinError(b)
-            content = histogram.GetBinContent(b)
-            # Safety
-            # if (content <= 0) or (err / content < 0.001):
-            if content <= 0:
-                logger.critical(f"Undefined behaviour for {histogram.GetName()} in bin {b}: content = {content}, error = {err}.", exception_cls=ValueError)
-
-            # Careful: The bin count "b" in this loop starts at 1. In the combine model, we want it to start from 0!
-            param_name = f"{category_id}_stat_error_{region}_bin{b-1}"
-            up = histogram.Clone(get_weight_name(sample=sample, category_id=category_id, param_name=param_name, direction="Up"))
-            down = histogram.Clone(get_weight_name(sample=sample, category_id=category_id, param_name=param_name, direction="Down"))
-            up.SetBinContent(b, content + err)
-            down.SetBinContent(b, content - err)
-            output_file.WriteTObject(up)
-            output_file.WriteTObject(down)
-
-            logger.debug(f"Adding statistical variation with absolute error = {err:.4f}, relative error = {err / content:.4f}: {up.GetName()}")
-            channel_objects[sample].add_nuisance_shape(name=param_name, file=output_file, functype="lognorm")
-
-
-def add_variation(nominal: ROOT.TH1, unc_file: ROOT.TFile, unc_name: str, new_name: str, outfile: ROOT.TFile) -> None:
-    factor = unc_file.Get(unc_name)
-    variation = nominal.Clone(new_name)
-    if factor.GetNbinsX() == 1:
-        factor_value = factor.GetBinContent(1)
-        variation.Scale(factor_value)
+        nominal = nominals[sample]
+        contents = nominal.values[1:-1]
+        errors = nominal.errors[1:-1]
+
+        # Same as the "lognorm" response of `Channel.add_nuisance_shape` for variations content +/- error in one bin
+        sfmax = np.maximum(contents + errors, 0)
+        sfmin = np.maximum(contents - errors, 0)
+        sigma = 0.5 * np.abs(sfmax - sfmin)
+        direction = np.where(sfmax > sfmin, 1, -1)
+        kappas = (1 + sigma / contents) ** direction
+
+        # In the combine model, the bin count starts from 0
+        param_names = [f"{category_id}_stat_error_{region}_bin{b}" for b in range(nominal.nbins)]
+        logger.debug(f"Adding {nominal.nbins} statistical variations for {histogram.GetName()}, relative errors = {np.round(errors / contents, 4)}")
+        channel_objects[sample].add_bin_nuisances(names=param_names, kappas=kappas)
+
+        for direction_name, sign in [("Up", 1), ("Down", -1)]:
+            variations = []
+            for b, param_name in enumerate(param_names):
+                variation = nominal.copy(name=get_weight_name(sample=sample, category_id=category_id, param_name=param_name, direction=direction_name))
+                variation.values[b + 1] += sign * errors[b]
+                variations.append(variation)
+            if pack_tf_stat:
+                param_name = f"{category_id}_stat_error_{region}_packed"
+                packed = pack_array_hists_to_th2(
+                    hists=variations, name=get_weight_name(sample=sample, category_id=category_id, param_name=param_name, direction=direction_name)
+                )
+                registry.add(packed)
+            else:
+                for variation in variations:
+                    registry.add(array_hist_to_th1(hist=variation, title=histogram.GetTitle()))
+
+
+def add_variation(nominal: ROOT.TH1, factor: ArrayHist, new_name: str, registry: VariationRegistry) -> ROOT.TH1:
+    """Scale a transfer factor by a relative variation, and register the result."""
+    variation = th1_to_array_hist(nominal, name=new_name)
+    if factor.nbins == 1:
+        variation = variation.scale(factor.values[1])
     else:
-        assert variation.Multiply(factor)
-        variation.Multiply(factor)
-    outfile.WriteTObject(variation)
+        # KNOWN ISSUE: multi-bin relative variations are applied twice (nominal * factor**2), as in the original TH1-based
+        # implementation, while single-bin factors are applied once. Applying them once changes the size of every multi-bin
+        # transfer-factor nuisance, and must be validated against reference workspaces and fits before it is changed.
+        variation = variation.multiply(factor).multiply(factor)
+    return registry.add(array_hist_to_th1(hist=variation, title=nominal.GetTitle()))
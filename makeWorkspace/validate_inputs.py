@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+
+import os
+import glob
+import argparse
+from typing import Optional
+from collections import defaultdict
+import numpy as np
+
+from utils.generic.logger import initialize_colorized_logger
+from utils.generic.colors import green
+from utils.generic.general import is_minor_bkg
+from utils.generic.array_hist import ArrayHist, sum_array_hists
+from utils.generic.hist_utils import HISTOGRAM_READERS, read_array_hists, read_array_hists_cached, set_histogram_reader
+from utils.workspace.uncertainties import get_shape_systematic_sources
+from makeWorkspace.make_workspace import ensure_nonzero_integral, merge_overflow_into_last_bin, resolve_shape_variation_name
+
+logger = initialize_colorized_logger(log_level="INFO")
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse and validate command-line arguments."""
+    parser = argparse.ArgumentParser(description="Validate the input and systematic histograms of a workspace.")
+    parser.add_argument("--input_filename", type=str, required=True, help="Path to the input ROOT file.")
+    parser.add_argument("--category", type=str, required=True, help="Analysis category (e.g., monojet_Run3).")
+    parser.add_argument("--variable", type=str, required=True, help="Observable variable (e.g., recoil).")
+    parser.add_argument("--root_folder", type=str, default=None, help="Subdirectory inside the input ROOT file.")
+    parser.add_argument("--reader", type=str, default="root", choices=HISTOGRAM_READERS, help="Library used to read the histograms.")
+    return parser.parse_args()
+
+
+def find_bins(mask: np.ndarray) -> str:
+    """Format the indices of the bins selected by a boolean mask, including the underflow (0) and overflow bins."""
+    return ", ".join(str(idx) for idx in np.flatnonzero(mask))
+
+
+def check_nominal_histograms(histograms: list[ArrayHist], errors: list[str], warnings: list[str]) -> None:
+    """Check the contents and binning of the nominal histograms, all at once."""
+    reference = histograms[0]
+    same_binning = [hist for hist in histograms if hist.nbins == reference.nbins and np.allclose(hist.edges, reference.edges)]
+    for hist in histograms:
+        if hist.nbins != reference.nbins or not np.allclose(hist.edges, reference.edges):
+            errors.append(f"{hist.name}: binning differs from {reference.name} ({hist.nbins} vs {reference.nbins} bins).")
+
+    names = [hist.name for hist in same_binning]
+    values = np.stack([hist.values for hist in same_binning])
+    sumw2 = np.stack([hist.sumw2 for hist in same_binning])
+    non_finite = ~np.isfinite(values) | ~np.isfinite(sumw2)
+    negative = values[:, 1:-1] < 0
+    empty = values[:, 1:-1] == 0
+    no_error = (values[:, 1:-1] != 0) & (sumw2[:, 1:-1] <= 0)
+
+    for idx in np.flatnonzero(non_finite.any(axis=1)):
+        errors.append(f"{names[idx]}: NaN or infinite content or error in bins {find_bins(non_finite[idx])}.")
+    for idx in np.flatnonzero(negative.any(axis=1)):
+        warnings.append(f"{names[idx]}: negative content in bins {find_bins(np.r_[False, negative[idx], False])}.")
+    for idx in np.flatnonzero(empty.all(axis=1)):
+        warnings.append(f"{names[idx]}: all bins are empty.")
+    is_mc = np.array(["data" not in name for name in names])
+    for idx in np.flatnonzero(no_error.any(axis=1) & is_mc):
+        warnings.append(f"{names[idx]}: zero error in non-empty bins {find_bins(np.r_[False, no_error[idx], False])}.")
+
+
+def check_merged_mc_errors(histograms: list[ArrayHist], category: str, errors: list[str]) -> None:
+    """Check that the merged minor backgrounds of each region have a non-zero error in every bin, as needed for their MC stat variations."""
+    per_region: dict[str, list[ArrayHist]] = defaultdict(list)
+    for hist in histograms:
+        if "data" not in hist.name and is_minor_bkg(category=category, hname=hist.name):
+            processed = hist.copy()
+            ensure_nonzero_integral(hist=processed)
+            merge_overflow_into_last_bin(hist=processed)
+            per_region[hist.name.split("_")[0]].append(processed)
+
+    for region, hists in per_region.items():
+        merged = sum_array_hists(histograms=hists, name=f"{region}_mergedMCBkg")
+        no_error = merged.errors[1:-1] <= 0
+        if no_error.any():
+            errors.append(f"{merged.name}: zero error in bins {find_bins(np.r_[False, no_error, False])}, the MC stat variations cannot be built.")
+
+
+def check_systematic_histogram(label: str, hist: ArrayHist, reference: ArrayHist, errors: list[str], warnings: list[str], strict: bool = True) -> None:
+    """Check the contents of a systematic histogram and its binning against the nominal histograms.
+
+    Single-bin histograms are global scale factors and are not checked against the nominal binning.
+    With `strict`, a binning mismatch is an error, otherwise it is a warning.
+    """
+    if hist.nbins > 1 and (hist.nbins != reference.nbins or not np.allclose(hist.edges, reference.edges)):
+        (errors if strict else warnings).append(f"{label}: binning differs from the nominal histograms ({hist.nbins} vs {reference.nbins} bins).")
+    if not np.all(np.isfinite(hist.values)):
+        errors.append(f"{label}: NaN or infinite content in bins {find_bins(~np.isfinite(hist.values))}.")
+    elif np.any(hist.values[1:-1] <= 0):
+        warnings.append(f"{label}: zero or negative factor in bins {find_bins(np.r_[False, hist.values[1:-1] <= 0, False])}.")
+
+
+def check_shape_files(names: list[str], reference: ArrayHist, category: str, variable: str, errors: list[str], warnings: list[str]) -> int:
+    """Check the keys of the shapes files that the build applies to at least one nominal histogram, see `build_shape_plan`.
+
+    Returns:
+        int: Number of shapes files checked.
+    """
+    sources = get_shape_systematic_sources(category=category)
+    mc_names = [name for name in names if "data" not in name]
+    for source in sources:
+        filename = f"inputs/sys/{variable}/{category}/shapes_{source}.root"
+        try:
+            multipliers = read_array_hists_cached(filename=filename)
+        except OSError:
+            errors.append(f"{filename}: could not open shapes file.")
+            continue
+        basename = os.path.basename(filename)
+        for varname, hist in multipliers.items():
+            if any(resolve_shape_variation_name(source=source, varname=varname, name=name) is not None for name in mc_names):
+                check_systematic_histogram(label=f"{basename}:{varname}", hist=hist, reference=reference, errors=errors, warnings=warnings)
+    return len(sources)
+
+
+def check_factor_files(reference: ArrayHist, category: str, variable: str, errors: list[str], warnings: list[str]) -> int:
+    """Check the transfer factor variations of the `systematics_*.root` files, read by `add_variation`.
+
+    Only the ratio (`_over_`) keys are checked. The keys read by the build depend on the channel lists of each model,
+    so binning mismatches and non-positive factors are reported as warnings, and only non-finite factors as errors.
+
+    Returns:
+        int: Number of factor files checked.
+    """
+    filenames = sorted(glob.glob(f"inputs/sys/{variable}/{category}/systematics_*.root"))
+    for filename in filenames:
+        try:
+            histograms = read_array_hists_cached(filename=filename)
+        except OSError:
+            errors.append(f"{filename}: could not open file.")
+            continue
+        basename = os.path.basename(filename)
+        for name, hist in histograms.items():
+            if "_over_" in name:
+                check_systematic_histogram(label=f"{basename}:{name}", hist=hist, reference=reference, errors=errors, warnings=warnings, strict=False)
+    return len(filenames)
+
+
+def validate_inputs(input_filename: str, category: str, variable: str, root_folder: Optional[str] = None) -> None:
+    """Check the input and systematic histograms read by the build before building the workspace, and fail with a single report.
+
+    The nominal histograms are checked for non-finite, negative and empty bins, and for bins without errors.
+    The keys of the shapes files applied by the build are checked for non-finite contents and for a binning
+    consistent with the nominal histograms. The `_over_` keys of the `systematics_*.root` files are checked as well, see `check_factor_files`.
+    Problems that would abort the build are errors, the others are reported as warnings.
+
+    Args:
+        input_filename (str): Path to the input ROOT file.
+        category (str): Analysis category (e.g., "monojet_Run3").
+        variable (str): Observable variable (e.g., mjj, recoil).
+        root_folder (Optional[str]): Subdirectory inside the input ROOT file.
+    """
+    logger.info(green(f"Validating inputs for category {category}..."))
+    errors: list[str] = []
+    warnings: list[str] = []
+
+    histograms = read_array_hists(filename=input_filename, folder=root_folder)
+    if not histograms:
+        logger.critical(f"No histograms found in {input_filename}.", exception_cls=ValueError)
+    reference = next(iter(histograms.values()))
+    check_nominal_histograms(histograms=list(histograms.values()), errors=errors, warnings=warnings)
+    check_merged_mc_errors(histograms=list(histograms.values()), category=category, errors=errors)
+    n_files = check_shape_files(names=list(histograms), reference=reference, category=category, variable=variable, errors=errors, warnings=warnings)
+    n_files += check_factor_files(reference=reference, category=category, variable=variable, errors=errors, warnings=warnings)
+
+    for warning in warnings:
+        logger.warning(warning)
+    logger.info(f"Checked {len(histograms)} input histograms and {n_files} systematics files: {len(errors)} errors, {len(warnings)} warnings.")
+    if errors:
+        report = "\n".join(f"  - {error}" for error in errors)
+        logger.critical(f"Invalid inputs for category {category}:\n{report}", exception_cls=ValueError)
+
+
+def main() -> None:
+    """Main entry point for the script."""
+    args = parse_args()
+    set_histogram_reader(args.reader)
+    validate_inputs(input_filename=args.input_filename, category=args.category, variable=args.variable, root_folder=args.root_folder)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,6 +3,7 @@ from counting_experiment import Category
 from model_utils import *
 
 model = "qcd_zjets"
+base_model = None  # Model this one depends on, see `Category.setDependant`
 
 
 def cmodel(
@@ -15,6 +16,7 @@ def cmodel(
     year: str,
     variable: str,
     convention: str = "BU",
+    pack_tf_stat: bool = False,
 ) -> Category:
     """
     Constructs a category model for QCD Z+jets processes using control regions and transfer factors.
@@ -35,6 +37,7 @@ def cmodel(
         diagonalizer: Diagonalizer to pass to `Category`
         year (str): Data-taking year.
         convention (str, optional): Naming convention for transfer factors. Defaults to "BU".
+        pack_tf_stat (bool, optional): Store the statistical variations of the transfer factors as packed TH2D. Defaults to False.
 
     Returns:
         Category: A `Category` object encapsulating the modeled process.
@@ -80,6 +83,7 @@ def cmodel(
         year=year,
         variable=variable,
         convention=convention,
+        pack_tf_stat=pack_tf_stat,
         # model-specific arguments
         **model_args,
     )
@@ -5,6 +5,7 @@ import plotter.cmsstyle as CMS
 from utils.generic.general import oplus
 from utils.workspace.uncertainties import get_all_flat_systematics_functions, get_veto_unc
 from utils.generic.logger import initialize_colorized_logger
+from utils.generic.hist_utils import get_detached_hist, get_root_file, unpack_th2_to_th1s
 
 logger = initialize_colorized_logger(log_level="INFO")
 
@@ -20,7 +21,7 @@ def plot_ratio(region: str, category: str, model_filename: str, outdir: str, lum
     production_modes = ["qcd"] if is_mono_category else ["qcd", "ewk"]
     tag = "mono" if is_mono_category else "vbf"
 
-    model_file = rt.TFile.Open(model_filename, "READ")
+    model_file = get_root_file(model_filename)
 
     region_config = {
         "dimuon": {"sample": "zll", "process": "zmm", "model": "z", "label": "#mu#mu"},
@@ -36,7 +37,7 @@ def plot_ratio(region: str, category: str, model_filename: str, outdir: str, lum
         dirname = f"{tag}_{mode}_{config['model']}_category_{category}"
         base_name = f"{mode}_{config['process']}_weights_{category}"
         label = f"R_{{{mode}}}^{{{config['label']}}}"
-        ratio = model_file.Get(f"{dirname}/{base_name}")
+        ratio = get_detached_hist(model_file, f"{dirname}/{base_name}")
         subdir = model_file.Get(dirname)
         model = f"{mode}_{config['sample']}"
 
@@ -71,14 +72,19 @@ def plot_ratio(region: str, category: str, model_filename: str, outdir: str, lum
         logger.info(f"Total flat syst: {flat_uncertainties}")
         # Collect systematics
         unc_dict = defaultdict(lambda: defaultdict(float))
+        up_hists = []
         for key in subdir.GetListOfKeys():
             name = key.GetName()
-            if "TH1" not in key.GetClassName():
-                continue
             if base_name not in name or "Up" not in name:
                 continue
-
-            up_hist = model_file.Get(f"{dirname}/{name}")
+            if "TH1" in key.GetClassName():
+                up_hists.append(get_detached_hist(model_file, f"{dirname}/{name}"))
+            elif "TH2" in key.GetClassName() and "stat_error" in name:
+                # Statistical variations stored with `--pack-tf-stat`, one row per bin
+                up_hists.extend(unpack_th2_to_th1s(get_detached_hist(model_file, f"{dirname}/{name}")))
+
+        for up_hist in up_hists:
+            name = up_hist.GetName()
             if "stat_error" in name:
                 syst = "stat"
             elif any(word in name for word in ["trig", "prefiring", "veto", "eff", "scale_j", "res_j", "photon_scale"]):
@@ -154,4 +160,3 @@ def plot_ratio(region: str, category: str, model_filename: str, outdir: str, lum
         for extension in ["pdf"]:
             canv.SaveAs(f"{outdir}/rfactor_{category}_{mode}_{config['process']}_{year}.{extension}")
         canv.Close()
-    model_file.Close()
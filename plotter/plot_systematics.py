@@ -6,6 +6,7 @@ import plotter.cmsstyle as CMS
 from utils.generic.general import oplus
 from utils.workspace.uncertainties import get_all_flat_systematics_functions
 from utils.generic.logger import initialize_colorized_logger
+from utils.generic.hist_utils import close_root_files, get_detached_hist, get_root_file, set_root_file_pool_size
 
 logger = initialize_colorized_logger(log_level="INFO")
 
@@ -14,6 +15,7 @@ def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Generate standard plots for a given analysis channel.")
     parser.add_argument("--channel", default="monojet", help="Analysis channel name (e.g. vbf, monojet)")
     parser.add_argument("--year", default="Run3", choices=["2017", "2018", "Run3"], help="Dataset year (default: Run3)")
+    parser.add_argument("--max-open-files", type=int, default=32, help="Maximum number of ROOT files kept open at the same time (default: 32)")
     return parser.parse_args()
 
 
@@ -23,7 +25,7 @@ def plot_systematics(inputdir: str, outdir: str, canvas_name: str, filename: str
 
     os.makedirs(outdir, exist_ok=True)
 
-    syst_file = rt.TFile.Open(f"{inputdir}/{filename}.root", "READ")
+    syst_file = get_root_file(f"{inputdir}/{filename}.root")
 
     hists = {}
     y_min = 10
@@ -31,8 +33,7 @@ def plot_systematics(inputdir: str, outdir: str, canvas_name: str, filename: str
     for hname in hist_names:
         for variation in ["Up", "Down"]:
             name = f"{hname}{variation}"
-            hist = syst_file.Get(name)
-            hist.SetDirectory(0)
+            hist = get_detached_hist(syst_file, name)
             hists[name] = hist
             y_min = min(y_min, hist.GetMinimum())
             y_max = max(y_max, hist.GetMaximum())
@@ -94,11 +95,10 @@ def plot_systematics(inputdir: str, outdir: str, canvas_name: str, filename: str
     canv.SaveAs(f"{outdir}/{canvas_name}.pdf")
     canv.Close()
 
-    syst_file.Close()
-
 
 def main():
     args = parse_args()
+    set_root_file_pool_size(args.max_open_files)
     base_path = f"inputs/sys/recoil/{args.channel}_{args.year}"
     outdir = f"{base_path}/pdf"
     info_map = {
@@ -131,6 +131,7 @@ def main():
     }
     for canvas_name, info in info_map.items():
         plot_systematics(inputdir=base_path, outdir=outdir, canvas_name=canvas_name, **info)
+    close_root_files()
 
 
 if __name__ == "__main__":
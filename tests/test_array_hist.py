@@ -0,0 +1,85 @@
+"""Tests of the ArrayHist arithmetic against the equivalent ROOT TH1 operations."""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+ROOT = pytest.importorskip("ROOT")
+
+from utils.generic.array_hist import ArrayHist  # noqa: E402
+from utils.generic.hist_utils import th1_to_array_hist  # noqa: E402
+
+EDGES = np.array([200.0, 250.0, 300.0, 400.0, 600.0, 1000.0])
+
+
+def make_pair(name: str, values: list[float], errors: list[float]) -> tuple[ArrayHist, ROOT.TH1D]:
+    """Return an ArrayHist and a TH1D with the same contents and errors, including underflow and overflow."""
+    th1 = ROOT.TH1D(name, name, len(EDGES) - 1, EDGES)
+    th1.SetDirectory(0)
+    th1.Sumw2()
+    for idx, (value, error) in enumerate(zip(values, errors)):
+        th1.SetBinContent(idx, value)
+        th1.SetBinError(idx, error)
+    return ArrayHist(name=name, edges=EDGES, values=values, sumw2=np.square(errors)), th1
+
+
+def assert_same(hist: ArrayHist, th1: ROOT.TH1) -> None:
+    """Check that the contents and errors of all bins agree, including underflow and overflow."""
+    expected = th1_to_array_hist(th1)
+    np.testing.assert_allclose(hist.edges, expected.edges)
+    np.testing.assert_allclose(hist.values, expected.values, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(hist.errors, expected.errors, rtol=1e-12, atol=1e-12)
+
+
+@pytest.fixture
+def numerator() -> tuple[ArrayHist, ROOT.TH1D]:
+    return make_pair("numerator", values=[1.0, 10.0, 8.0, 5.0, 2.0, 0.5, 3.0], errors=[0.5, 1.0, 0.9, 0.7, 0.4, 0.2, 0.6])
+
+
+@pytest.fixture
+def denominator() -> tuple[ArrayHist, ROOT.TH1D]:
+    return make_pair("denominator", values=[2.0, 20.0, 0.0, 4.0, 1.5, 0.25, 0.0], errors=[0.3, 2.0, 0.0, 0.5, 0.3, 0.1, 0.0])
+
+
+def test_scale(numerator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    hist, th1 = numerator
+    th1.Scale(1.7)
+    assert_same(hist.scale(1.7), th1)
+
+
+def test_multiply(numerator: tuple[ArrayHist, ROOT.TH1D], denominator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    (hist, th1), (other, other_th1) = numerator, denominator
+    assert th1.Multiply(other_th1)
+    assert_same(hist.multiply(other), th1)
+
+
+def test_divide(numerator: tuple[ArrayHist, ROOT.TH1D], denominator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    (hist, th1), (other, other_th1) = numerator, denominator
+    assert th1.Divide(other_th1)
+    assert_same(hist.divide(other), th1)
+
+
+def test_incompatible_binning(numerator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    hist, _ = numerator
+    other = ArrayHist(name="other", edges=EDGES[:-1], values=np.ones(len(EDGES)))
+    with pytest.raises(ValueError):
+        hist.multiply(other)
+
+
+def test_merge_overflow(numerator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    hist, th1 = numerator
+    n_bins = th1.GetNbinsX()
+    th1.SetBinContent(n_bins, th1.GetBinContent(n_bins) + th1.GetBinContent(n_bins + 1))
+    th1.SetBinError(n_bins, np.hypot(th1.GetBinError(n_bins), th1.GetBinError(n_bins + 1)))
+    th1.SetBinContent(n_bins + 1, 0)
+    th1.SetBinError(n_bins + 1, 0)
+    hist.merge_overflow()
+    assert_same(hist, th1)
+
+
+def test_with_bin_content(numerator: tuple[ArrayHist, ROOT.TH1D]) -> None:
+    hist, th1 = numerator
+    th1.SetBinContent(3, 42.0)
+    result = hist.with_bin_content(3, 42.0, name="modified")
+    assert_same(result, th1)
+    assert result.name == "modified"
+    assert hist.values[3] == 5.0
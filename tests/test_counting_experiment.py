@@ -0,0 +1,49 @@
+"""Tests of the per-bin bookkeeping of the control region models."""
+
+from types import SimpleNamespace
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("HiggsAnalysis.CombinedLimit.ModelTools")
+
+from makeWorkspace.counting_experiment import BinTable, get_bin_yields  # noqa: E402
+
+
+class FakeDataset:
+    """Minimal stand-in for a RooDataHist: `get(i)` selects the entry whose `weight()` is returned next."""
+
+    def __init__(self, varname: str, coordinates: list[float], weights: list[float]) -> None:
+        self.varname = varname
+        self.coordinates = coordinates
+        self.weights = weights
+        self.current = 0
+
+    def numEntries(self) -> int:
+        return len(self.coordinates)
+
+    def get(self, index: int) -> SimpleNamespace:
+        self.current = index
+        return SimpleNamespace(getRealValue=lambda name: self.coordinates[index] if name == self.varname else None)
+
+    def weight(self) -> float:
+        return self.weights[self.current]
+
+
+def test_get_bin_yields() -> None:
+    dataset = FakeDataset(varname="recoil", coordinates=[150.0, 250.0, 300.0, 450.0, 1200.0], weights=[1.0, 2.0, 3.0, 4.0, 5.0])
+    yields = get_bin_yields(dataset=dataset, varname="recoil", edges=np.array([250.0, 300.0, 500.0, 1000.0]))
+    # 150 and 1200 are outside the model range, 300 belongs to [300, 500)
+    np.testing.assert_allclose(yields, [2.0, 7.0, 0.0])
+
+
+def test_bin_table_rows() -> None:
+    edges = [250.0, 300.0, 500.0]
+    table = BinTable(edges=edges, n_crs=3)
+    assert table.n_bins == 2
+    assert table.row(cr_index=2, bin_index=1) == 5
+    np.testing.assert_array_equal(table.cr_index, [0, 0, 1, 1, 2, 2])
+    np.testing.assert_array_equal(table.bin_index, [0, 1, 0, 1, 0, 1])
+    np.testing.assert_allclose(table.xmin, [250.0, 300.0] * 3)
+    np.testing.assert_allclose(table.xmax, [300.0, 500.0] * 3)
+    assert table.initY.shape == (6,)
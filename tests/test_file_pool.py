@@ -0,0 +1,83 @@
+"""Tests of the least-recently-used pool of open files."""
+
+import os
+from typing import Any
+
+import pytest
+
+from utils.generic.file_pool import FilePool
+
+
+class RecordingPool(FilePool):
+    """Pool of plain Python file objects, recording the paths it opens and closes."""
+
+    def __init__(self, max_open: int) -> None:
+        super().__init__(max_open=max_open)
+        self.opened: list[str] = []
+        self.closed: list[str] = []
+
+    def open_file(self, path: str) -> Any:
+        self.opened.append(os.path.basename(path))
+        return open(path)
+
+    def close_file(self, handle: Any) -> None:
+        self.closed.append(os.path.basename(handle.name))
+        handle.close()
+
+
+@pytest.fixture
+def filenames(tmp_path: Any) -> list[str]:
+    names = []
+    for name in ["a", "b", "c"]:
+        path = tmp_path / name
+        path.write_text(name)
+        names.append(str(path))
+    return names
+
+
+def test_reuses_open_files(filenames: list[str]) -> None:
+    pool = RecordingPool(max_open=2)
+    handle = pool.get(filenames[0])
+    assert pool.get(filenames[0]) is handle
+    assert pool.opened == ["a"]
+
+
+def test_evicts_least_recently_used(filenames: list[str]) -> None:
+    pool = RecordingPool(max_open=2)
+    pool.get(filenames[0])
+    pool.get(filenames[1])
+    pool.get(filenames[0])
+    pool.get(filenames[2])
+    assert pool.closed == ["b"]
+    assert len(pool) == 2
+    assert filenames[0] in pool and filenames[2] in pool
+
+
+def test_reopens_modified_files(filenames: list[str]) -> None:
+    pool = RecordingPool(max_open=2)
+    handle = pool.get(filenames[0])
+    stat = os.stat(filenames[0])
+    os.utime(filenames[0], ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+    assert pool.get(filenames[0]) is not handle
+    assert handle.closed
+    assert pool.opened == ["a", "a"]
+
+
+def test_resize_and_close_all(filenames: list[str]) -> None:
+    pool = RecordingPool(max_open=3)
+    for filename in filenames:
+        pool.get(filename)
+    pool.resize(1)
+    assert pool.closed == ["a", "b"]
+    pool.close_all()
+    assert len(pool) == 0
+    assert pool.closed == ["a", "b", "c"]
+    with pytest.raises(ValueError):
+        pool.resize(0)
+
+
+def test_open_errors_do_not_enter_the_pool(tmp_path: Any) -> None:
+    pool = RecordingPool(max_open=2)
+    with pytest.raises(OSError):
+        pool.get(str(tmp_path / "missing"))
+    assert len(pool) == 0
@@ -0,0 +1,42 @@
+"""Tests of the ordering of the control region models by dependency."""
+
+from types import SimpleNamespace
+
+import pytest
+
+from utils.workspace.model import get_control_region_models, get_model_dependencies, sort_models
+
+# Definitions of the VBF models, see the `model` and `base_model` of makeWorkspace/vbf_*.py
+VBF_MODULES = {
+    "vbf_qcd_z": SimpleNamespace(model="qcd_zjets", base_model=None),
+    "vbf_qcd_w": SimpleNamespace(model="qcd_wjets", base_model="qcd_zjets"),
+    "vbf_ewk_z": SimpleNamespace(model="ewk_zjets", base_model="qcd_zjets"),
+    "vbf_ewk_w": SimpleNamespace(model="ewk_wjets", base_model="ewk_zjets"),
+}
+
+
+def test_dependencies() -> None:
+    dependencies = get_model_dependencies(model_list=list(VBF_MODULES), modules=VBF_MODULES)
+    assert dependencies == {"vbf_qcd_z": [], "vbf_qcd_w": ["vbf_qcd_z"], "vbf_ewk_z": ["vbf_qcd_z"], "vbf_ewk_w": ["vbf_ewk_z"]}
+
+
+def test_missing_dependency() -> None:
+    with pytest.raises(ValueError):
+        get_model_dependencies(model_list=["vbf_qcd_w"], modules=VBF_MODULES)
+
+
+def test_sort_keeps_order_when_possible() -> None:
+    model_list = get_control_region_models(category="vbf_Run3")
+    dependencies = get_model_dependencies(model_list=model_list, modules=VBF_MODULES)
+    assert sort_models(model_list=model_list, dependencies=dependencies) == model_list
+
+
+def test_sort_puts_dependencies_first() -> None:
+    model_list = ["vbf_ewk_w", "vbf_qcd_w", "vbf_ewk_z", "vbf_qcd_z"]
+    dependencies = get_model_dependencies(model_list=model_list, modules=VBF_MODULES)
+    assert sort_models(model_list=model_list, dependencies=dependencies) == ["vbf_qcd_z", "vbf_qcd_w", "vbf_ewk_z", "vbf_ewk_w"]
+
+
+def test_sort_rejects_cycles() -> None:
+    with pytest.raises(ValueError):
+        sort_models(model_list=["a", "b"], dependencies={"a": ["b"], "b": ["a"]})
@@ -0,0 +1,23 @@
+"""Tests of the ordered, bounded parallel iteration."""
+
+import os
+
+import pytest
+
+pytest.importorskip("tqdm")
+
+from utils.generic.parallelize import multi_process_iter  # noqa: E402
+
+
+def square(value: int) -> tuple[int, int]:
+    return value * value, os.getpid()
+
+
+def test_results_in_order() -> None:
+    results = list(multi_process_iter(func=square, arglist=[{"value": value} for value in range(20)], ncores=3, max_pending=2))
+    assert [result for result, _ in results] == [value * value for value in range(20)]
+    assert all(pid != os.getpid() for _, pid in results)
+
+
+def test_empty_arglist() -> None:
+    assert list(multi_process_iter(func=square, arglist=[], ncores=2)) == []
@@ -0,0 +1,59 @@
+"""Tests of the process registries and their cached accessors."""
+
+import pytest
+
+from utils.workspace import processes
+from utils.workspace.processes import (
+    get_all_regions,
+    get_process_model_map,
+    get_process_type,
+    get_processes,
+    get_processes_by_region,
+    get_region_from_label,
+    get_region_label_map,
+)
+
+
+def test_registries_are_frozen() -> None:
+    with pytest.raises(TypeError):
+        processes._PROCESSES["monojet"] = {}
+    with pytest.raises(TypeError):
+        processes._PROCESSES["monojet"]["signal"]["models"] = ()
+    with pytest.raises(TypeError):
+        processes._PROCESS_MODEL_MAP["signal"]["qcd_zjets"] = "other"
+    assert isinstance(processes._PROCESSES["monojet"]["signal"]["models"], tuple)
+
+
+def test_accessors_return_copies() -> None:
+    models = get_processes(analysis="monojet", region="signal", type="models")
+    models.append("modified")
+    assert get_processes(analysis="monojet", region="signal", type="models") == ["qcd_zjets", "qcd_wjets"]
+
+    model_map = get_process_model_map(region="signal")
+    model_map["qcd_zjets"] = "modified"
+    assert get_process_model_map(region="signal")["qcd_zjets"] == "signal_qcd_zjets"
+
+
+def test_unknown_keys() -> None:
+    assert get_processes(analysis="monojet", region="unknown", type="models") == []
+    assert get_processes(analysis="unknown", region="signal", type="models") == []
+    assert get_process_type(analysis="monojet", region="signal", process="unknown") is None
+    assert get_region_from_label("unknown") is None
+
+
+def test_processes_by_region_accepts_lists_and_tuples() -> None:
+    expected = frozenset(["zh", "wh", "vbf", "ggh", "ggzh", "qcd_estimate"])
+    assert get_processes_by_region(analysis="monojet", region="signal", types=["signals", "data_driven"]) == expected
+    assert get_processes_by_region(analysis="monojet", region="signal", types=("signals", "data_driven")) == expected
+    assert "qcd_zll" in get_processes_by_region(analysis="vbf", region="dimuon")
+
+
+def test_indexes_match_the_registry() -> None:
+    for analysis, regions in processes._PROCESSES.items():
+        for region, types in regions.items():
+            for type_name, names in types.items():
+                for name in names:
+                    assert get_process_type(analysis=analysis, region=region, process=name) == type_name
+    for region, label in get_region_label_map():
+        assert get_region_from_label(label) == region
+    assert get_all_regions() == [region for region, _ in get_region_label_map()]
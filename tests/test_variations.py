@@ -0,0 +1,57 @@
+"""Tests of the array-only helpers used to compute and prune the systematic variations."""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from utils.generic.array_hist import ArrayHist, compile_bin_formula, multiply_histogram_by_function, prune_identity_variations  # noqa: E402
+
+EDGES = np.array([200.0, 300.0, 500.0, 1000.0])
+
+
+def make_hist(name: str, values: list[float]) -> ArrayHist:
+    return ArrayHist(name=name, edges=EDGES, values=values)
+
+
+def test_compile_bin_formula() -> None:
+    function = compile_bin_formula("1 + 0.1 / 550 * (x - 250)")
+    x = np.array([250.0, 800.0])
+    np.testing.assert_allclose(function(x), [1.0, 1.1])
+    assert compile_bin_formula("1 + 0.1 / 550 * (x - 250)") is function
+
+
+def test_compile_bin_formula_has_no_builtins() -> None:
+    with pytest.raises(NameError):
+        compile_bin_formula("open('file')")(np.zeros(1))
+
+
+def test_multiply_histogram_by_function() -> None:
+    hist = ArrayHist(name="nominal", edges=EDGES, values=[5.0, 1.0, 2.0, 4.0, 7.0], sumw2=[1.0, 1.0, 1.0, 1.0, 1.0])
+    for function in ["1 + 0 * x + 1", lambda x: np.full_like(x, 2.0)]:
+        result = multiply_histogram_by_function(histogram=hist, function=function, name="scaled")
+        assert result.name == "scaled"
+        np.testing.assert_allclose(result.values, [5.0, 2.0, 4.0, 8.0, 7.0])
+        np.testing.assert_allclose(result.sumw2, [1.0, 4.0, 4.0, 4.0, 1.0])
+    np.testing.assert_allclose(hist.values, [5.0, 1.0, 2.0, 4.0, 7.0])
+
+
+def test_prune_identity_variations() -> None:
+    nominal = make_hist("signal_zjets", [0.0, 10.0, 20.0, 30.0, 0.0])
+    variations = {
+        "signal_zjets_flatUp": make_hist("signal_zjets_flatUp", [0.0, 10.0, 20.0, 30.0, 0.0]),
+        "signal_zjets_flatDown": make_hist("signal_zjets_flatDown", [0.0, 10.0, 20.000001, 30.0, 0.0]),
+        "signal_zjets_shapeUp": make_hist("signal_zjets_shapeUp", [0.0, 11.0, 20.0, 30.0, 0.0]),
+        "signal_zjets_shapeDown": make_hist("signal_zjets_shapeDown", [0.0, 10.0, 20.0, 30.0, 0.0]),
+        "signal_zjets_upOnlyUp": make_hist("signal_zjets_upOnlyUp", [0.0, 10.0, 20.0, 30.0, 0.0]),
+    }
+    kept, pruned = prune_identity_variations(variations=variations, nominals={"signal_zjets": nominal}, tolerance=1e-6)
+    assert sorted(kept) == ["signal_zjets_shapeDown", "signal_zjets_shapeUp", "signal_zjets_upOnlyUp"]
+    assert pruned == {"signal_zjets": ["flat"]}
+
+
+def test_prune_uses_the_longest_nominal_prefix() -> None:
+    nominals = {"signal": make_hist("signal", [0.0, 1.0, 1.0, 1.0, 0.0]), "signal_zjets": make_hist("signal_zjets", [0.0, 2.0, 2.0, 2.0, 0.0])}
+    variations = {f"signal_zjets_flat{direction}": make_hist(f"signal_zjets_flat{direction}", [0.0, 2.0, 2.0, 2.0, 0.0]) for direction in ["Up", "Down"]}
+    kept, pruned = prune_identity_variations(variations=variations, nominals=nominals, tolerance=0.0)
+    assert kept == {}
+    assert pruned == {"signal_zjets": ["flat"]}
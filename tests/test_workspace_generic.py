@@ -0,0 +1,18 @@
+"""Tests of the parsing of the output compression settings."""
+
+import pytest
+
+ROOT = pytest.importorskip("ROOT")
+
+from utils.workspace.generic import parse_compression  # noqa: E402
+
+
+@pytest.mark.parametrize("setting, algorithm, level", [("zlib:1", "kZLIB", 1), ("LZ4:4", "kLZ4", 4), ("zstd:5", "kZSTD", 5), ("lzma:9", "kLZMA", 9)])
+def test_parse_compression(setting: str, algorithm: str, level: int) -> None:
+    assert parse_compression(setting) == ROOT.CompressionSettings(getattr(ROOT.RCompressionSetting.EAlgorithm, algorithm), level)
+
+
+@pytest.mark.parametrize("setting", ["zlib", "zlib:10", "gzip:1", "lz4:-1", ""])
+def test_invalid_compression(setting: str) -> None:
+    with pytest.raises(ValueError):
+        parse_compression(setting)
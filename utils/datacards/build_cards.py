@@ -3,13 +3,14 @@ import os
 import ROOT  # type: ignore
 import subprocess
 import argparse
-from typing import Any
+from typing import Any, Optional
 from collections.abc import Callable
 from functools import partial
 
 import CombineHarvester.CombineTools.ch as ch  # type: ignore
 from utils.generic.logger import initialize_colorized_logger
-from utils.workspace.processes import get_processes, get_region_label_map, get_process_model_map
+from utils.generic.file_utils import load_json
+from utils.workspace.processes import get_processes, get_process_type, get_region_label_map, get_process_model_map
 from utils.workspace.uncertainties import get_all_flat_systematics_functions, get_all_shapes_functions, get_automc_stat
 
 
@@ -22,6 +23,7 @@ class DatacardBuilder:
         self.workspace_name: str = "combinedws"
         self.ws_path: str = f"../root/combined_model_{self.analysis}.root"
         self.card_path: str = f"cards/card_{self.analysis}_{self.year}.txt"
+        self.pruning_report_path: str = f"root/ws_{self.analysis}.pruned.json"
 
         self.harvester = ch.CombineHarvester()
         os.makedirs("cards", exist_ok=True)
@@ -33,6 +35,13 @@ class DatacardBuilder:
         self.model_names = list(set([model for region in self.region_names for model in get_processes(analysis=self.analysis, region=region, type="models")]))
         self.n_bins = 0  # this will be automatically filled later in the code
 
+        # Variations identical to the nominal that were not written to the workspace, by histogram name
+        self.pruned_variations: dict[str, set[str]] = {}
+        if os.path.isfile(self.pruning_report_path):
+            report = load_json(self.pruning_report_path)
+            self.pruned_variations = {hname: set(systematics) for hname, systematics in report["pruned"].items()}
+        self.n_dropped_shapes = 0
+
         self.init_processes()
 
     def init_processes(self) -> None:
@@ -69,6 +78,10 @@ class DatacardBuilder:
 
         self.add_systematics(syst_func=partial(get_automc_stat, n_bins=self.n_bins), syst_type="shape")
 
+        if self.pruned_variations:
+            n_pruned = sum(len(systematics) for systematics in self.pruned_variations.values())
+            logger.info(f"Dropped {self.n_dropped_shapes} shape entries out of {n_pruned} variations pruned from the workspace.")
+
     def add_workspace_nuisances(self) -> None:
         """Extract constrained nuisance parameters from the RooWorkspace and add them to datacard."""
         file_ = ROOT.TFile(self.ws_path.replace("../", ""), "READ")
@@ -90,21 +103,42 @@ class DatacardBuilder:
         """Add a lnN or shape systematic uncertainty to the card."""
         syst_dict = syst_func(year=self.year, analysis=self.analysis)
         for name, val in syst_dict.items():
-            valmap = self.build_syst_map(syst_val=val)
+            valmap = self.build_syst_map(syst_val=val, shape_name=name if syst_type == "shape" else None)
             self.harvester.AddSyst(target=self.harvester, name=name, type=syst_type, valmap=valmap)
 
-    def build_syst_map(self, syst_val: dict[str, Any]) -> ch.SystMap:
-        """Build a SystMap from the provided value map of the systematic for each region and process it applies to."""
+    def build_syst_map(self, syst_val: dict[str, Any], shape_name: Optional[str] = None) -> ch.SystMap:
+        """Build a SystMap from the provided value map of the systematic for each region and process it applies to.
+
+        For shape systematics, processes whose variations were pruned from the workspace are skipped.
+        """
         syst_map = ch.SystMap("era", "bin_id", "process")
+        region_labels = dict(get_region_label_map())
         for region_idx, region_name in self.regions:
             entry = syst_val
             if region_name in entry:
                 # Apply a region-specific value
                 entry = entry[region_name]
             if "value" in entry:
-                syst_map([self.year], [region_idx], entry["processes"], entry["value"])
+                processes = list(entry["processes"])
+                if shape_name is not None:
+                    processes = self.drop_pruned_processes(shape_name=shape_name, region_label=region_labels[region_name], processes=processes)
+                syst_map([self.year], [region_idx], processes, entry["value"])
         return syst_map
 
+    def drop_pruned_processes(self, shape_name: str, region_label: str, processes: list[str]) -> list[str]:
+        """Remove the processes for which the variations of a shape systematic were pruned from the workspace.
+
+        Pruned variations are identical to the nominal, so the card is unchanged by dropping them.
+        """
+        kept = []
+        for process in processes:
+            if shape_name in self.pruned_variations.get(f"{region_label}_{process}", ()):
+                logger.debug(f"Dropping pruned shape {shape_name} for process {process} in region {region_label}.")
+                self.n_dropped_shapes += 1
+                continue
+            kept.append(process)
+        return kept
+
     def add_nuisances(self, nuisances: list[str]) -> None:
         """Add flat nuisance parameters as Gaussian priors."""
         for nuisance in nuisances:
@@ -195,7 +229,7 @@ class DatacardBuilder:
             shapes_list += [
                 format_line(process=proc, region=region, hname=f"{model}_model")
                 for proc, model in get_process_model_map(region=region).items()
-                if proc in get_processes(analysis=self.analysis, region=region, type="models")
+                if get_process_type(analysis=self.analysis, region=region, process=proc) == "models"
             ]
 
             for shape in shapes_list:
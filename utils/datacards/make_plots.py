@@ -5,17 +5,20 @@ from plotter.plot_prefit_postfit import plot_prefit_postfit
 from plotter.plot_data_validation import plot_data_validation
 from plotter.plot_ratio import plot_ratio
 from plotter.plot_diff_nuis import plot_diff_nuis
+from utils.generic.hist_utils import close_root_files, set_root_file_pool_size
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Generate standard plots for a given analysis channel.")
     parser.add_argument("--channel", required=True, help="Analysis channel name (e.g. vbf, monojet)")
     parser.add_argument("--year", default="Run3", choices=["2017", "2018", "Run3"], help="Dataset year (default: Run3)")
+    parser.add_argument("--max-open-files", type=int, default=32, help="Maximum number of ROOT files kept open at the same time (default: 32)")
     return parser.parse_args()
 
 
 def main() -> None:
     args = parse_args()
+    set_root_file_pool_size(args.max_open_files)
 
     lumi = {
         "2017": 41.5,
@@ -56,6 +59,7 @@ def main() -> None:
         plot_data_validation(region1=region1, region2=region2, shapes_filename=shapes_filename, **common_args)
 
     plot_diff_nuis(diffnuis_file=diffnuis_file, outdir=outdir, category=category)
+    close_root_files()
 
 
 if __name__ == "__main__":
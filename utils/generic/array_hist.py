@@ -0,0 +1,191 @@
+"""Array-backed 1D histograms for systematic variation arithmetic without ROOT."""
+
+import hashlib
+from typing import Optional, Union
+from functools import lru_cache
+from collections import defaultdict
+from collections.abc import Callable
+import numpy as np
+
+# Scale factor as a function of the bin centers: a vectorized callable or a formula string of `x`
+BinFunction = Union[Callable[[np.ndarray], np.ndarray], str]
+
+
+class ArrayHist:
+    """Lightweight 1D histogram holding bin edges, contents and sum of squared weights.
+
+    Contents and squared weights include the underflow and overflow bins, so that index `i` of the arrays
+    matches bin `i` of the equivalent ROOT TH1 (0 is the underflow, `nbins + 1` the overflow).
+    """
+
+    def __init__(self, name: str, edges: np.ndarray, values: np.ndarray, sumw2: Optional[np.ndarray] = None) -> None:
+        """Initialize the histogram.
+
+        Args:
+            name (str): Name of the histogram.
+            edges (np.ndarray): Bin edges of the visible bins (nbins + 1 entries).
+            values (np.ndarray): Bin contents, including underflow and overflow (nbins + 2 entries).
+            sumw2 (Optional[np.ndarray]): Sum of squared weights per bin. Defaults to Poisson errors (|values|).
+        """
+        self.name = name
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.values = np.array(values, dtype=np.float64)
+        self.sumw2 = np.abs(self.values) if sumw2 is None else np.array(sumw2, dtype=np.float64)
+        if self.values.shape != (len(self.edges) + 1,) or self.sumw2.shape != self.values.shape:
+            raise ValueError(f"Inconsistent array shapes for histogram '{name}': {len(self.edges)} edges, {self.values.shape} values, {self.sumw2.shape} sumw2.")
+
+    def __repr__(self) -> str:
+        return f"ArrayHist(name={self.name!r}, nbins={self.nbins})"
+
+    @property
+    def nbins(self) -> int:
+        """Number of visible bins."""
+        return len(self.edges) - 1
+
+    @property
+    def errors(self) -> np.ndarray:
+        """Bin errors, including underflow and overflow."""
+        return np.sqrt(self.sumw2)
+
+    @property
+    def centers(self) -> np.ndarray:
+        """Centers of the visible bins."""
+        return 0.5 * (self.edges[1:] + self.edges[:-1])
+
+    def integral(self) -> float:
+        """Sum of the visible bin contents, as `TH1::Integral()`."""
+        return float(np.sum(self.values[1:-1]))
+
+    def digest(self) -> str:
+        """Return a hash of the binning, contents and squared weights (the name is not included)."""
+        hash_sha = hashlib.sha256()
+        for array in (self.edges, self.values, self.sumw2):
+            hash_sha.update(np.ascontiguousarray(array, dtype=np.float64).tobytes())
+        return hash_sha.hexdigest()
+
+    def is_close(self, other: "ArrayHist", rtol: float) -> bool:
+        """Return whether all bin contents agree with `other` within a relative tolerance of the contents of `other`."""
+        self.check_compatibility(other)
+        return bool(np.all(np.abs(self.values - other.values) <= rtol * np.abs(other.values)))
+
+    def copy(self, name: Optional[str] = None) -> "ArrayHist":
+        """Return a deep copy of the histogram, optionally renamed."""
+        return ArrayHist(name=self.name if name is None else name, edges=self.edges, values=self.values, sumw2=self.sumw2)
+
+    def check_compatibility(self, other: "ArrayHist") -> None:
+        """Raise a ValueError if the binning of `other` differs from this histogram."""
+        if self.nbins != other.nbins or not np.allclose(self.edges, other.edges):
+            raise ValueError(f"Incompatible binning between '{self.name}' ({self.nbins} bins) and '{other.name}' ({other.nbins} bins).")
+
+    def scale(self, factor: float, name: Optional[str] = None) -> "ArrayHist":
+        """Return a copy scaled by a constant factor in all bins, as `TH1::Scale`."""
+        return ArrayHist(name=self.name if name is None else name, edges=self.edges, values=self.values * factor, sumw2=self.sumw2 * factor**2)
+
+    def scale_bins(self, factors: np.ndarray, name: Optional[str] = None) -> "ArrayHist":
+        """Return a copy with the content and error of each visible bin scaled by the corresponding factor."""
+        factors = np.asarray(factors, dtype=np.float64)
+        if factors.shape != (self.nbins,):
+            raise ValueError(f"Expected {self.nbins} scale factors for '{self.name}', got {factors.shape}.")
+        result = self.copy(name=name)
+        result.values[1:-1] *= factors
+        result.sumw2[1:-1] *= factors**2
+        return result
+
+    def add(self, other: "ArrayHist", name: Optional[str] = None) -> "ArrayHist":
+        """Return the bin-by-bin sum with another histogram, as `TH1::Add`."""
+        self.check_compatibility(other)
+        return ArrayHist(name=self.name if name is None else name, edges=self.edges, values=self.values + other.values, sumw2=self.sumw2 + other.sumw2)
+
+    def multiply(self, other: "ArrayHist", name: Optional[str] = None) -> "ArrayHist":
+        """Return the bin-by-bin product with another histogram, propagating errors as `TH1::Multiply`."""
+        self.check_compatibility(other)
+        values = self.values * other.values
+        sumw2 = self.sumw2 * other.values**2 + other.sumw2 * self.values**2
+        return ArrayHist(name=self.name if name is None else name, edges=self.edges, values=values, sumw2=sumw2)
+
+    def divide(self, other: "ArrayHist", name: Optional[str] = None) -> "ArrayHist":
+        """Return the bin-by-bin ratio to another histogram, propagating errors as `TH1::Divide`.
+
+        Bins where the denominator is zero are set to zero, with zero error.
+        """
+        self.check_compatibility(other)
+        nonzero = other.values != 0
+        denominator = np.where(nonzero, other.values, 1.0)
+        values = np.where(nonzero, self.values / denominator, 0.0)
+        sumw2 = np.where(nonzero, (self.sumw2 * other.values**2 + other.sumw2 * self.values**2) / denominator**4, 0.0)
+        return ArrayHist(name=self.name if name is None else name, edges=self.edges, values=values, sumw2=sumw2)
+
+    def with_bin_content(self, bin_idx: int, content: float, name: Optional[str] = None) -> "ArrayHist":
+        """Return a copy with the content of a single bin replaced, leaving its error untouched as `TH1::SetBinContent`."""
+        result = self.copy(name=name)
+        result.values[bin_idx] = content
+        return result
+
+    def merge_overflow(self) -> None:
+        """Move the overflow content into the last visible bin, adding the errors in quadrature."""
+        self.values[-2] += self.values[-1]
+        self.sumw2[-2] += self.sumw2[-1]
+        self.values[-1] = 0.0
+        self.sumw2[-1] = 0.0
+
+
+def sum_array_hists(histograms: list[ArrayHist], name: str) -> ArrayHist:
+    """Add a list of histograms into a new histogram with a given name."""
+    if not histograms:
+        raise ValueError("Empty list provided to sum_array_hists")
+    summed = histograms[0].copy(name=name)
+    for hist in histograms[1:]:
+        summed = summed.add(hist, name=name)
+    return summed
+
+
+@lru_cache(maxsize=None)
+def compile_bin_formula(formula: str) -> Callable[[np.ndarray], np.ndarray]:
+    """Compile a formula of the bin center `x` (e.g. "1 + 0.1 / 550 * (x - 250)") into a vectorized function.
+
+    The formula is compiled once and evaluated on whole arrays, with NumPy available as `np`.
+    """
+    code = compile(formula, f"<formula {formula}>", "eval")
+    return lambda x: eval(code, {"__builtins__": {}, "np": np}, {"x": x})  # pylint: disable=W0123
+
+
+def multiply_histogram_by_function(histogram: ArrayHist, function: BinFunction, name: str) -> ArrayHist:
+    """Return a copy of the histogram with the content and error of each bin scaled by a function of the bin center.
+
+    The function is evaluated once on the array of bin centers. It can be a vectorized callable
+    (e.g. a NumPy ufunc) or a formula string of `x`, see `compile_bin_formula`.
+    """
+    if isinstance(function, str):
+        function = compile_bin_formula(function)
+    scales = np.broadcast_to(np.asarray(function(histogram.centers), dtype=np.float64), (histogram.nbins,))
+    return histogram.scale_bins(factors=scales, name=name)
+
+
+def prune_identity_variations(
+    variations: dict[str, ArrayHist], nominals: dict[str, ArrayHist], tolerance: float
+) -> tuple[dict[str, ArrayHist], dict[str, list[str]]]:
+    """Drop the Up/Down variation pairs that are both identical to their nominal within a relative tolerance.
+
+    Args:
+        variations (dict[str, ArrayHist]): Variations named `<nominal>_<systematic>Up/Down`.
+        nominals (dict[str, ArrayHist]): Processed nominal histograms by name.
+        tolerance (float): Maximum relative difference to the nominal content, in every bin.
+
+    Returns:
+        tuple[dict[str, ArrayHist], dict[str, list[str]]]: Variations to write, and pruned systematics by nominal histogram name.
+    """
+    kept = dict(variations)
+    pruned: dict[str, list[str]] = defaultdict(list)
+    for name_up, hist_up in variations.items():
+        if not name_up.endswith("Up"):
+            continue
+        base = name_up[: -len("Up")]
+        hist_down = variations.get(f"{base}Down")
+        nominal_name = max((nom for nom in nominals if base.startswith(f"{nom}_")), key=len, default=None)
+        if hist_down is None or nominal_name is None:
+            continue
+        nominal = nominals[nominal_name]
+        if hist_up.is_close(nominal, rtol=tolerance) and hist_down.is_close(nominal, rtol=tolerance):
+            del kept[name_up], kept[f"{base}Down"]
+            pruned[nominal_name].append(base[len(nominal_name) + 1 :])
+    return kept, dict(pruned)
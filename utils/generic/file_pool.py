@@ -0,0 +1,62 @@
+"""Pool of open file handles with least-recently-used eviction, independent of the library opening the files."""
+
+import os
+from typing import Any
+from collections import OrderedDict
+
+
+class FilePool:
+    """Keep the most recently used files open, and close the least recently used ones beyond `max_open`.
+
+    A file is reopened if it was modified since it was opened. Subclasses implement `open_file` and `close_file`.
+    """
+
+    def __init__(self, max_open: int = 32) -> None:
+        self.max_open = max_open
+        self._files: OrderedDict[str, tuple[Any, int]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, filename: str) -> bool:
+        return os.path.abspath(filename) in self._files
+
+    def open_file(self, path: str) -> Any:
+        """Open a file, raising an OSError if it cannot be opened."""
+        raise NotImplementedError
+
+    def close_file(self, handle: Any) -> None:
+        """Close a file opened by `open_file`."""
+        raise NotImplementedError
+
+    def get(self, filename: str) -> Any:
+        """Return an open handle to a file, opening it if needed."""
+        path = os.path.abspath(filename)
+        mtime = os.stat(path).st_mtime_ns if os.path.exists(path) else -1
+        if path in self._files:
+            handle, opened_mtime = self._files[path]
+            if opened_mtime == mtime:
+                self._files.move_to_end(path)
+                return handle
+            self._close(path)
+        handle = self.open_file(path)
+        self._files[path] = (handle, mtime)
+        self.resize(self.max_open)
+        return handle
+
+    def resize(self, max_open: int) -> None:
+        """Change the maximum number of open files, closing the least recently used ones if needed."""
+        if max_open < 1:
+            raise ValueError(f"The file pool must allow at least one open file, got {max_open}.")
+        self.max_open = max_open
+        while len(self._files) > self.max_open:
+            self._close(next(iter(self._files)))
+
+    def close_all(self) -> None:
+        """Close all the files of the pool."""
+        for path in list(self._files):
+            self._close(path)
+
+    def _close(self, path: str) -> None:
+        handle, _ = self._files.pop(path)
+        self.close_file(handle)
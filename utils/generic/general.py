@@ -3,7 +3,7 @@
 # ==============================
 
 import numpy as np
-from utils.workspace.processes import get_region_label_map, get_processes
+from utils.workspace.processes import get_region_from_label, get_process_type
 
 
 def oplus(*args: float) -> float:
@@ -19,10 +19,7 @@ def extract_analysis(category):
 
 
 def rename_region(label: str) -> str:
-    region = None
-    for key, value in get_region_label_map():
-        if value == label:
-            region = key
+    region = get_region_from_label(label)
     if not region:
         raise ValueError(f"Region not found for {label}.")
     return region
@@ -34,5 +31,4 @@ def is_minor_bkg(category: str, hname: str):
     label = hname.split("_")[0]
     background = hname.replace(f"{label}_", "")
     region = rename_region(label)
-    backgrounds = get_processes(analysis=extract_analysis(category), region=region, type="backgrounds")
-    return background in backgrounds
+    return get_process_type(analysis=extract_analysis(category), region=region, process=background) == "backgrounds"
@@ -1,4 +1,255 @@
+import os
+import numpy as np
 import ROOT as rt  # type: ignore
+from typing import Optional
+from functools import lru_cache
+from utils.generic.array_hist import ArrayHist
+from utils.generic.file_pool import FilePool
+
+try:
+    import uproot  # type: ignore
+except ImportError:  # only needed by the "uproot" histogram reader
+    uproot = None
+
+HISTOGRAM_READERS = ("root", "uproot")
+_histogram_reader = "root"
+
+
+class RootFilePool(FilePool):
+    """Keep the most recently used ROOT files open for reading, see `FilePool`.
+
+    Objects read with `TDirectory::Get` belong to the file, are shared by all callers and are deleted when it is closed:
+    read histograms with `get_detached_hist` instead.
+    """
+
+    def open_file(self, path: str) -> rt.TFile:
+        root_file = rt.TFile.Open(path, "READ")
+        if not root_file or root_file.IsZombie():
+            raise OSError(f"Could not open file: {path}")
+        # As after closing it, do not leave the file as current directory, new objects would be attached to it
+        rt.gROOT.cd()
+        return root_file
+
+    def close_file(self, handle: rt.TFile) -> None:
+        handle.Close()
+
+
+_root_file_pool = RootFilePool()
+
+
+def get_root_file(filename: str) -> rt.TFile:
+    """Return a ROOT file opened for reading from the process-wide pool, see `RootFilePool`."""
+    return _root_file_pool.get(filename)
+
+
+def get_detached_hist(directory: rt.TDirectory, name: str) -> Optional[rt.TH1]:
+    """Read a histogram from a directory, detached from it and owned by Python, or return None if it is not found.
+
+    Each call returns a new object, which the caller can modify, and which is deleted with its last Python reference
+    instead of staying in memory until the file is closed.
+    """
+    hist = directory.Get(name)
+    if not hist:
+        return None
+    hist.SetDirectory(0)
+    rt.SetOwnership(hist, True)
+    return hist
+
+
+def set_root_file_pool_size(max_open: int) -> None:
+    """Change the maximum number of ROOT files kept open by the process-wide pool."""
+    _root_file_pool.resize(max_open)
+
+
+def close_root_files() -> None:
+    """Close all the ROOT files of the process-wide pool."""
+    _root_file_pool.close_all()
+
+
+def set_histogram_reader(reader: str) -> None:
+    """Select the library used by `read_array_hists` to read histograms from files, for the whole process."""
+    global _histogram_reader  # pylint: disable=W0603
+    if reader not in HISTOGRAM_READERS:
+        raise ValueError(f"Unknown histogram reader '{reader}', expected one of {HISTOGRAM_READERS}.")
+    if reader == "uproot" and uproot is None:
+        raise ImportError("The uproot histogram reader requires the uproot package.")
+    _histogram_reader = reader
+
+
+def get_histogram_reader() -> str:
+    """Return the library used by `read_array_hists` to read histograms from files."""
+    return _histogram_reader
+
+
+def read_array_hists(filename: str, folder: Optional[str] = None, names: Optional[list[str]] = None) -> dict[str, ArrayHist]:
+    """Read 1D histograms from a ROOT file into ArrayHists, with the reader selected by `set_histogram_reader`.
+
+    Args:
+        filename (str): Path to the ROOT file.
+        folder (Optional[str]): Subdirectory of the file to read from.
+        names (Optional[list[str]]): Names of the histograms to read. Defaults to all the TH1 in the directory, in key order.
+
+    Returns:
+        dict[str, ArrayHist]: Histograms by name.
+    """
+    if _histogram_reader == "uproot":
+        return _read_array_hists_uproot(filename=filename, folder=folder, names=names)
+    return _read_array_hists_root(filename=filename, folder=folder, names=names)
+
+
+# Enough for all the systematics files of one category, see `inputs/sys/<variable>/<category>`
+_MAX_CACHED_FILES = 128
+
+
+def read_array_hists_cached(filename: str, names: Optional[list[str]] = None) -> dict[str, ArrayHist]:
+    """Read 1D histograms from a ROOT file like `read_array_hists`, through a process-wide cache of whole files.
+
+    Meant for the systematics files, which are read many times within a build. The cache keeps the `_MAX_CACHED_FILES`
+    most recently used files, and an entry is invalidated when its file is modified. Copies are returned, so that the cached
+    histograms are never modified.
+    """
+    stat = os.stat(filename)
+    hists = _read_whole_file_cached(filename=filename, mtime=stat.st_mtime_ns, size=stat.st_size, reader=_histogram_reader)
+    if names is None:
+        names = list(hists)
+    for name in names:
+        if name not in hists:
+            raise KeyError(f"Histogram {name} not found in {filename}.")
+    return {name: hists[name].copy() for name in names}
+
+
+def clear_array_hists_cache() -> None:
+    """Release the histograms cached by `read_array_hists_cached`."""
+    _read_whole_file_cached.cache_clear()
+
+
+@lru_cache(maxsize=_MAX_CACHED_FILES)
+def _read_whole_file_cached(filename: str, mtime: int, size: int, reader: str) -> dict[str, ArrayHist]:
+    # The modification time, size and reader are only part of the cache key
+    return read_array_hists(filename=filename)
+
+
+def _read_array_hists_root(filename: str, folder: Optional[str], names: Optional[list[str]]) -> dict[str, ArrayHist]:
+    root_file = get_root_file(filename)
+    directory = root_file if folder is None else root_file.Get(folder)
+    if names is None:
+        names = [key.GetName() for key in directory.GetListOfKeys() if key.GetClassName().startswith("TH1")]
+    hists = {}
+    for name in names:
+        hist = get_detached_hist(directory, name)
+        if hist is None:
+            raise KeyError(f"Histogram {name} not found in {filename}.")
+        hists[name] = th1_to_array_hist(hist)
+    return hists
+
+
+def _read_array_hists_uproot(filename: str, folder: Optional[str], names: Optional[list[str]]) -> dict[str, ArrayHist]:
+    hists = {}
+    with uproot.open(filename) as root_file:
+        directory = root_file if folder is None else root_file[folder]
+        if names is None:
+            names = [name for name, classname in directory.classnames(recursive=False, cycle=False).items() if classname.startswith("TH1")]
+        for name in names:
+            if name not in directory:
+                raise KeyError(f"Histogram {name} not found in {filename}.")
+            hist = directory[name]
+            edges = hist.axis().edges(flow=False)
+            hists[name] = ArrayHist(name=name, edges=edges, values=hist.values(flow=True), sumw2=hist.variances(flow=True))
+    return hists
+
+
+# Storage type of the bin contents of each TH1 flavour (TH1D inherits from TArrayD, ...)
+_TH1_ARRAY_DTYPES = (("TArrayD", np.float64), ("TArrayF", np.float32), ("TArrayI", np.int32), ("TArrayS", np.int16), ("TArrayC", np.int8))
+
+
+def th1_to_array_hist(hist: rt.TH1, name: Optional[str] = None) -> ArrayHist:
+    """Convert a ROOT TH1 into an ArrayHist, including underflow and overflow bins.
+
+    The contents, squared weights and variable bin edges are copied from the ROOT buffers at once, instead of bin by bin.
+    Without squared weights (no `Sumw2`), the errors are the Poisson ones, as `TH1::GetBinError`.
+    """
+    n_bins = hist.GetNbinsX()
+    axis = hist.GetXaxis()
+    xbins = axis.GetXbins()
+    if xbins.GetSize() == n_bins + 1:
+        edges = np.frombuffer(xbins.GetArray(), dtype=np.float64, count=n_bins + 1).copy()
+    else:
+        edges = np.linspace(axis.GetXmin(), axis.GetXmax(), n_bins + 1)
+    dtype = next((dtype for array_class, dtype in _TH1_ARRAY_DTYPES if hist.InheritsFrom(array_class)), None)
+    if dtype is None:
+        values = np.array([hist.GetBinContent(i) for i in range(n_bins + 2)])
+    else:
+        values = np.frombuffer(hist.GetArray(), dtype=dtype, count=n_bins + 2)
+    sumw2 = None
+    if hist.GetSumw2N() > 0:
+        sumw2 = np.frombuffer(hist.GetSumw2().GetArray(), dtype=np.float64, count=n_bins + 2)
+    # ArrayHist copies the contents and squared weights
+    return ArrayHist(name=name or hist.GetName(), edges=edges, values=values, sumw2=sumw2)
+
+
+def array_hist_to_th1(hist: ArrayHist, name: Optional[str] = None, title: Optional[str] = None) -> rt.TH1D:
+    """Materialize an ArrayHist as a ROOT TH1D, detached from any directory."""
+    name = name or hist.name
+    th1 = rt.TH1D(name, title or name, hist.nbins, np.ascontiguousarray(hist.edges, dtype=np.float64))
+    th1.SetDirectory(0)
+    th1.Sumw2()
+    th1.SetContent(np.ascontiguousarray(hist.values, dtype=np.float64))
+    th1.GetSumw2().Set(len(hist.sumw2), np.ascontiguousarray(hist.sumw2, dtype=np.float64))
+    th1.SetEntries(hist.integral())
+    return th1
+
+
+def pack_array_hists_to_th2(hists: list[ArrayHist], name: str) -> rt.TH2D:
+    """Pack histograms with the same binning into the rows of a TH2D, labelled by the name of each histogram."""
+    if not hists:
+        raise ValueError("Empty list provided to pack_array_hists_to_th2")
+    reference = hists[0]
+    for hist in hists[1:]:
+        reference.check_compatibility(hist)
+    n_rows = len(hists)
+    th2 = rt.TH2D(name, name, reference.nbins, np.ascontiguousarray(reference.edges, dtype=np.float64), n_rows, 0, n_rows)
+    th2.SetDirectory(0)
+    th2.Sumw2()
+    # Global bin numbering of ROOT is x-major: bin = binx + (nbinsx + 2) * biny, with empty y underflow/overflow rows
+    values = np.zeros((n_rows + 2, reference.nbins + 2))
+    sumw2 = np.zeros_like(values)
+    values[1:-1] = np.stack([hist.values for hist in hists])
+    sumw2[1:-1] = np.stack([hist.sumw2 for hist in hists])
+    th2.SetContent(np.ascontiguousarray(values.ravel()))
+    th2.GetSumw2().Set(sumw2.size, np.ascontiguousarray(sumw2.ravel()))
+    for row, hist in enumerate(hists, start=1):
+        th2.GetYaxis().SetBinLabel(row, hist.name)
+    th2.SetEntries(sum(hist.integral() for hist in hists))
+    return th2
+
+
+def unpack_th2_to_th1s(th2: rt.TH2) -> list[rt.TH1D]:
+    """Unpack the rows of a TH2 built by `pack_array_hists_to_th2` into TH1Ds named after the row labels."""
+    th1s = []
+    for row in range(1, th2.GetNbinsY() + 1):
+        name = th2.GetYaxis().GetBinLabel(row)
+        th1 = th2.ProjectionX(name, row, row, "e")
+        th1.SetDirectory(0)
+        th1.SetTitle(name)
+        th1s.append(th1)
+    return th1s
+
+
+def roo_data_hist_to_th1(data_hist: rt.RooDataHist, name: Optional[str] = None) -> rt.TH1D:
+    """Convert a one-dimensional RooDataHist back into a TH1D with its binning, contents and errors, detached from any directory.
+
+    A RooDataHist has no underflow or overflow bins, so those of the TH1D are empty. It is only lossless for histograms
+    with empty flow bins, which `write_histogram_to_workspace` enforces for the histograms it does not write as TH1.
+    """
+    binning = data_hist.get().first().getBinning()
+    n_bins = binning.numBins()
+    edges = np.array([binning.binLow(i) for i in range(n_bins)] + [binning.binHigh(n_bins - 1)])
+    values = np.zeros(n_bins + 2)
+    sumw2 = np.zeros(n_bins + 2)
+    for i in range(n_bins):
+        values[i + 1] = data_hist.weight(i)
+        sumw2[i + 1] = data_hist.weightSquared(i)
+    return array_hist_to_th1(hist=ArrayHist(name=name or data_hist.GetName(), edges=edges, values=values, sumw2=sumw2))
 
 
 def histograms_are_equal(h1: rt.TH1, h2: rt.TH1, check_errors: bool = True, tolerance: float = 0.0) -> None:
@@ -7,7 +7,8 @@ import time
 import subprocess
 import functools
 from typing import Optional, Any, Union
-from collections.abc import Callable
+from collections import deque
+from collections.abc import Callable, Iterator
 from types import SimpleNamespace
 from multiprocessing import Pool
 from concurrent.futures import ThreadPoolExecutor, as_completed
@@ -68,6 +69,31 @@ def multi_process(func: Callable, arglist: list[dict[str, Any]], ncores: int = 8
     return results
 
 
+def multi_process_iter(func: Callable, arglist: list[dict[str, Any]], ncores: int = 8, max_pending: Optional[int] = None) -> Iterator[Any]:
+    """Run a function in parallel using multiprocessing, yielding the results in order as soon as they are available.
+
+    Args:
+        func (Callable): Function to execute. It must be picklable, i.e. defined at module level.
+        arglist (list[dict[str, Any]]): Arguments for the function, which will be called once for each item in the list.
+        ncores (int): Number of cores to use.
+        max_pending (Optional[int]): Maximum number of results computed ahead of the consumer. Defaults to twice `ncores`.
+
+    Yields:
+        Any: Results from the function calls, in the order of `arglist`.
+    """
+    if len(arglist) == 0:
+        return
+    max_pending = max_pending or 2 * ncores
+    with Pool(processes=ncores) as pool:
+        pending: deque = deque()
+        for kwargs in tqdm(arglist, desc="Processed"):
+            pending.append(pool.apply_async(func, kwds=kwargs))
+            if len(pending) >= max_pending:
+                yield pending.popleft().get()
+        while pending:
+            yield pending.popleft().get()
+
+
 def multi_thread(func: Callable, arglist: list[dict[str, Any]], ncores: int = 8) -> list[Any]:
     """Run a function in parallel using multithreading.
 
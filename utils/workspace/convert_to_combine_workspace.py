@@ -1,12 +1,49 @@
 import ROOT  # type: ignore
 from typing import Any
 from utils.generic.logger import initialize_colorized_logger
-from utils.workspace.generic import safe_import
+from utils.generic.hist_utils import roo_data_hist_to_th1, unpack_th2_to_th1s
+from utils.workspace.generic import VARIATION_HISTOGRAM_MODE_KEY, BulkImporter, get_variation_histograms_filename, safe_import
 
 ROOT.gSystem.Load("libHiggsAnalysisCombinedLimit")
 logger = initialize_colorized_logger("INFO")
 
 
+def read_histograms(directory: ROOT.TDirectory) -> list[ROOT.TH1]:
+    """Read the TH1D/TH1F of a directory, and unpack the rows of its packed TH2 histograms (see `pack_array_hists_to_th2`)."""
+    histograms = []
+    for key in directory.GetListOfKeys():
+        obj = key.ReadObj()
+        logger.debug(f"{obj.GetName()}, {obj.GetTitle()}, {type(obj)}")
+        if obj.InheritsFrom("TH2"):
+            histograms.extend(unpack_th2_to_th1s(obj))
+        elif isinstance(obj, (ROOT.TH1D, ROOT.TH1F)):
+            histograms.append(obj)
+    return histograms
+
+
+def read_variation_histograms(f_simple_hists: ROOT.TFile, fdir: ROOT.TDirectory, wlocal: ROOT.RooWorkspace, names: set[str]) -> list[ROOT.TH1]:
+    """Return the variation histograms that are not stored next to the nominal ones, following the mode recorded by `create_workspace`.
+
+    In "sidecar" mode they are read from the sidecar file. In "skip" mode they are rebuilt from the RooDataHists
+    of the workspace that have no histogram in `names`. Nothing is returned in "main" mode, or for older files without mode.
+    """
+    mode = fdir.Get(VARIATION_HISTOGRAM_MODE_KEY)
+    mode = mode.GetTitle() if mode else "main"
+    if mode == "sidecar":
+        sidecar_filename = get_variation_histograms_filename(f_simple_hists.GetName())
+        sidecar_file = ROOT.TFile.Open(sidecar_filename, "READ")
+        if not sidecar_file or sidecar_file.IsZombie():
+            logger.critical(f"Could not open the variation histograms file {sidecar_filename}.", exception_cls=IOError)
+        histograms = read_histograms(directory=sidecar_file.Get(fdir.GetName()))
+        for hist in histograms:
+            hist.SetDirectory(0)
+        sidecar_file.Close()
+        return histograms
+    if mode == "skip":
+        return [roo_data_hist_to_th1(data_hist=data) for data in wlocal.allData() if data.GetName() not in names]
+    return []
+
+
 def convert_to_combine_workspace(
     wsin_combine: ROOT.RooWorkspace,
     f_simple_hists: ROOT.TFile,
@@ -55,17 +92,17 @@ def convert_to_combine_workspace(
     logger.info(f"Renaming: {varl.GetName()} -> {rename_variable}")
 
     # Loop other all the histograms in the directory for the year convert them to RooDataHist and save them to the workspace
-    for key in fdir.GetListOfKeys():
-        obj = key.ReadObj()
-        logger.debug(f"{obj.GetName()}, {obj.GetTitle()}, {type(obj)}")
-        if not isinstance(obj, (ROOT.TH1D, ROOT.TH1F)):
-            continue
-        if obj.Integral() <= 0:
-            obj.SetBinContent(1, 1e-4)
-        name = obj.GetName()
-        logger.debug(f"Importing histogram {name} for category {cat}")
-        dhist = ROOT.RooDataHist(f"{cat}_{name}", f"DataSet - {cat}, {name}", ROOT.RooArgList(varl), obj)
-        safe_import(workspace=wsin_combine, obj=dhist)
+    # The variation histograms can also be in a sidecar file or only in the workspace, see `create_workspace`
+    histograms = read_histograms(directory=fdir)
+    histograms.extend(read_variation_histograms(f_simple_hists=f_simple_hists, fdir=fdir, wlocal=wlocal, names={hist.GetName() for hist in histograms}))
+
+    with BulkImporter(workspace=wsin_combine) as importer:
+        for obj in histograms:
+            if obj.Integral() <= 0:
+                obj.SetBinContent(1, 1e-4)
+            name = obj.GetName()
+            logger.debug(f"Importing histogram {name} for category {cat}")
+            importer.add(ROOT.RooDataHist(f"{cat}_{name}", f"DataSet - {cat}, {name}", ROOT.RooArgList(varl), obj))
 
     # Add in the V-jets backgrounds MODELS
     # Loop over all models (`Category` objects) and all their "control regions" (`Channel` objects)
@@ -1,7 +1,13 @@
+import re
 from contextlib import contextmanager
 
 import ROOT  # type: ignore
-from typing import Any
+from typing import Any, Optional
+
+COMPRESSION_ALGORITHMS = ("zlib", "lzma", "lz4", "zstd")
+# Where the TH1 copies of the variations are written next to the RooWorkspace, see `create_workspace`
+VARIATION_HISTOGRAM_MODES = ("main", "sidecar", "skip")
+VARIATION_HISTOGRAM_MODE_KEY = "variation_histograms"
 
 
 @contextmanager
@@ -34,3 +40,110 @@ def safe_import(workspace: ROOT.RooWorkspace, obj: Any, debug: bool = False) ->
             workspace._import(obj, ROOT.RooFit.RecycleConflictNodes())
         else:
             workspace._import(obj)
+
+
+def import_workspace(workspace: ROOT.RooWorkspace, source: ROOT.RooWorkspace, debug: bool = False) -> None:
+    """Import all the variables, categories, functions and pdfs of another RooWorkspace, reusing the objects already in `workspace`.
+
+    Objects with the same name in both workspaces are expected to be identical (e.g., shared nuisance parameters), and are not duplicated.
+
+    Args:
+        workspace (ROOT.RooWorkspace): The target workspace.
+        source (ROOT.RooWorkspace): The workspace to merge into `workspace`.
+    """
+    with suppress_roofit_info(debug=debug):
+        for components in [source.allVars(), source.allCats(), source.allFunctions(), source.allPdfs()]:
+            if components.getSize():
+                workspace._import(components, ROOT.RooFit.RecycleConflictNodes())
+
+
+def parse_compression(setting: str) -> int:
+    """Convert an `algorithm:level` string (e.g., "lz4:4", "zstd:5") into a ROOT compression setting.
+
+    Args:
+        setting (str): Compression algorithm among `COMPRESSION_ALGORITHMS` and level between 0 (uncompressed) and 9.
+
+    Returns:
+        int: The setting passed to the TFile constructor, i.e. 100 * algorithm + level.
+    """
+    algorithm, _, level = setting.lower().partition(":")
+    if algorithm not in COMPRESSION_ALGORITHMS or not level.isdigit() or int(level) > 9:
+        raise ValueError(f"Invalid compression '{setting}', expected <algorithm>:<level> with algorithm in {COMPRESSION_ALGORITHMS} and level in 0-9.")
+    return ROOT.CompressionSettings(getattr(ROOT.RCompressionSetting.EAlgorithm, f"k{algorithm.upper()}"), int(level))
+
+
+def create_output_file(filename: str, compression: Optional[int] = None) -> ROOT.TFile:
+    """Open a ROOT file for writing, with the given compression setting or the ROOT default if None."""
+    if compression is None:
+        return ROOT.TFile(filename, "RECREATE")
+    return ROOT.TFile(filename, "RECREATE", "", compression)
+
+
+def get_variation_histograms_filename(workspace_filename: str) -> str:
+    """Return the path of the sidecar file holding the TH1 copies of the variations of a workspace file."""
+    return re.sub(r"\.root$", "", workspace_filename) + ".variations.root"
+
+
+class BulkImporter:
+    """Queue objects and import them into a RooWorkspace at once, under a single message-service guard.
+
+    Name collisions are checked against an in-memory set of the names in the workspace, instead of one
+    workspace lookup per object. The set is built once from the workspace, then extended with each queued object
+    and the nodes imported alongside it (its observables, or the servers of a function), without scanning the
+    workspace again. With `batch_size`, the queue is flushed whenever it reaches this size, which bounds its memory.
+    It can be used as a context manager, which flushes the queue on exit.
+    """
+
+    def __init__(self, workspace: ROOT.RooWorkspace, debug: bool = False, batch_size: Optional[int] = None) -> None:
+        self.workspace = workspace
+        self.debug = debug
+        self.batch_size = batch_size
+        self._queue: list[Any] = []
+        self._names: set[str] = {arg.GetName() for arg in workspace.components()} | {data.GetName() for data in workspace.allData()}
+
+    def __enter__(self) -> "BulkImporter":
+        return self
+
+    def __exit__(self, exc_type: Any, exc_value: Any, traceback: Any) -> None:
+        if exc_type is None:
+            self.flush()
+
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    def add(self, obj: Any) -> None:
+        """Queue an object for import. The queue keeps it alive until it is imported."""
+        name = obj.GetName()
+        if name in self._names:
+            raise RuntimeError(f"Object '{name}' already exists in the workspace '{self.workspace.GetName()}'.")
+        self._names.add(name)
+        self._names.update(self._server_names(obj))
+        self._queue.append(obj)
+        if self.batch_size is not None and len(self._queue) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Import all queued objects, in the order they were added, and empty the queue."""
+        if not self._queue:
+            return
+        with suppress_roofit_info(debug=self.debug):
+            for obj in self._queue:
+                if isinstance(obj, ROOT.RooDataHist):
+                    self.workspace._import(obj)
+                else:
+                    self.workspace._import(obj, ROOT.RooFit.RecycleConflictNodes())
+        self._queue.clear()
+
+    @staticmethod
+    def _server_names(obj: Any) -> set[str]:
+        """Return the names of the nodes that the workspace imports together with `obj`."""
+        if isinstance(obj, ROOT.RooAbsData):
+            return {arg.GetName() for arg in obj.get()}
+        if isinstance(obj, ROOT.RooAbsArg):
+            names: set[str] = set()
+            # Both sets are created for the caller, which must delete them
+            for servers in (obj.getComponents(), obj.getVariables()):
+                ROOT.SetOwnership(servers, True)
+                names.update(arg.GetName() for arg in servers)
+            return names
+        return set()
@@ -1,3 +1,4 @@
+from typing import Any, Optional
 from utils.generic.logger import initialize_colorized_logger
 
 logger = initialize_colorized_logger(log_level="INFO")
@@ -20,3 +21,36 @@ def get_control_region_models(category: str) -> list[str]:
         return ["vbf_qcd_z", "vbf_qcd_w", "vbf_ewk_z", "vbf_ewk_w"]
     else:
         logger.critical(f"Could not infer control region definitions for category = {category}.", exception_cls=RuntimeError)
+
+
+def get_model_dependencies(model_list: list[str], modules: Optional[dict[str, Any]] = None) -> dict[str, list[str]]:
+    """Return the models each model of `model_list` depends on, from the `base_model` of their definition (see `Category.setDependant`).
+
+    `modules` maps each model name to its definition module, which is imported by name by default.
+    """
+    if modules is None:
+        modules = {model_name: __import__(model_name) for model_name in model_list}
+    providers = {modules[model_name].model: model_name for model_name in model_list}
+    dependencies = {}
+    for model_name in model_list:
+        base_model = modules[model_name].base_model
+        if base_model is None:
+            dependencies[model_name] = []
+        elif base_model in providers:
+            dependencies[model_name] = [providers[base_model]]
+        else:
+            logger.critical(f"Model {model_name} depends on {base_model}, which is not in {model_list}.", exception_cls=ValueError)
+    return dependencies
+
+
+def sort_models(model_list: list[str], dependencies: dict[str, list[str]]) -> list[str]:
+    """Order the models such that each one comes after the models it depends on, otherwise keeping the order of `model_list`."""
+    ordered: list[str] = []
+    pending = list(model_list)
+    while pending:
+        ready = [model_name for model_name in pending if all(dep in ordered for dep in dependencies[model_name])]
+        if not ready:
+            logger.critical(f"Circular dependency between the models {pending}.", exception_cls=ValueError)
+        ordered.append(ready[0])
+        pending.remove(ready[0])
+    return ordered
@@ -1,9 +1,22 @@
-from typing import Any
+from types import MappingProxyType
+from functools import lru_cache
+from collections.abc import Mapping, Sequence
+from typing import Any, Optional
 
 
-def get_processes(analysis: str, region: str, type: str) -> list[str]:
-    """Return the list of processes for a given analysis, region, and type."""
-    processes = {
+def _freeze(obj: Any) -> Any:
+    """Recursively convert dicts to read-only mappings and lists to tuples."""
+    if isinstance(obj, Mapping):
+        return MappingProxyType({key: _freeze(value) for key, value in obj.items()})
+    if isinstance(obj, list):
+        return tuple(_freeze(item) for item in obj)
+    return obj
+
+
+# Registry of the processes of each analysis, by region and type. It is frozen (see `_freeze`):
+# use the accessors below, which are cached and return copies or immutable views.
+_PROCESSES: Mapping[str, Mapping[str, Mapping[str, tuple[str, ...]]]] = _freeze(
+    {
         "vbf": {
             "signal": {
                 "signals": ["zh", "wh", "vbf", "ggh", "ggzh"],
@@ -60,27 +73,19 @@ def get_processes(analysis: str, region: str, type: str) -> list[str]:
             },
         },
     }
+)
 
-    return processes.get(analysis, {}).get(region, {}).get(type, [])
-
-
-def get_all_regions() -> list[str]:
-    return [region for region, _ in get_region_label_map()]
-
+_REGION_LABELS: tuple[tuple[str, str], ...] = (
+    ("signal", "signal"),
+    ("singlemu", "Wmn"),
+    ("singleel", "Wen"),
+    ("dimuon", "Zmm"),
+    ("dielec", "Zee"),
+    ("photon", "gjets"),
+)
 
-def get_region_label_map() -> list[tuple[str, str]]:
-    return [
-        ("signal", "signal"),
-        ("singlemu", "Wmn"),
-        ("singleel", "Wen"),
-        ("dimuon", "Zmm"),
-        ("dielec", "Zee"),
-        ("photon", "gjets"),
-    ]
-
-
-def get_process_model_map(region: str) -> dict[str, dict[str, str]]:
-    return {
+_PROCESS_MODEL_MAP: Mapping[str, Mapping[str, str]] = _freeze(
+    {
         "dielec": {
             "ewk_zll": "ewk_dielectron_ewk_zjets",
             "qcd_zll": "qcd_dielectron_qcd_zjets",
@@ -107,12 +112,62 @@ def get_process_model_map(region: str) -> dict[str, dict[str, str]]:
             "ewk_gjets": "ewk_photon_ewk_zjets",
             "qcd_gjets": "qcd_photon_qcd_zjets",
         },
-    }[region]
+    }
+)
+
+# Inverse indexes
+_LABEL_TO_REGION = MappingProxyType({label: region for region, label in _REGION_LABELS})
+_PROCESS_TYPE = MappingProxyType(
+    {
+        (analysis, region, process): type
+        for analysis, regions in _PROCESSES.items()
+        for region, types in regions.items()
+        for type, processes in types.items()
+        for process in processes
+    }
+)
+
+
+@lru_cache(maxsize=None)
+def _get_processes(analysis: str, region: str, type: str) -> tuple[str, ...]:
+    return tuple(_PROCESSES.get(analysis, {}).get(region, {}).get(type, ()))
+
+
+def get_processes(analysis: str, region: str, type: str) -> list[str]:
+    """Return the list of processes for a given analysis, region, and type."""
+    return list(_get_processes(analysis=analysis, region=region, type=type))
+
+
+def get_all_regions() -> list[str]:
+    return [region for region, _ in _REGION_LABELS]
+
+
+def get_region_label_map() -> list[tuple[str, str]]:
+    return list(_REGION_LABELS)
+
+
+def get_region_from_label(label: str) -> Optional[str]:
+    """Return the region name (e.g. "dimuon") of a histogram label (e.g. "Zmm"), or None if unknown."""
+    return _LABEL_TO_REGION.get(label)
+
+
+def get_process_type(analysis: str, region: str, process: str) -> Optional[str]:
+    """Return the type ("signals", "models", ...) of a process in a region, or None if it is not used there."""
+    return _PROCESS_TYPE.get((analysis, region, process))
+
+
+def get_process_model_map(region: str) -> dict[str, str]:
+    return dict(_PROCESS_MODEL_MAP[region])
+
+
+@lru_cache(maxsize=None)
+def _get_processes_by_region(analysis: str, region: str, types: tuple[str, ...]) -> frozenset[str]:
+    return frozenset(proc for category in types for proc in _get_processes(analysis=analysis, region=region, type=category))
 
 
-def get_processes_by_region(analysis: str, region: str, types: list[str] = ["backgrounds", "models"]) -> set[str]:
+def get_processes_by_region(analysis: str, region: str, types: Sequence[str] = ("backgrounds", "models")) -> frozenset[str]:
     """Return the set of all processes of the given types used in all regions of the given analysis."""
-    return {proc for category in types for proc in get_processes(analysis=analysis, region=region, type=category)}
+    return _get_processes_by_region(analysis=analysis, region=region, types=tuple(types))
 
 
 if __name__ == "__main__":